@@ -0,0 +1,152 @@
+"""Cache of the activations of the frozen backbone prefixes, for training only the later layers and the heads.
+
+With AMFAR.freeze_prefix, the ResNet up to a stage (e.g. layer3) and the I3D up to an end point (e.g. Mixed_4f)
+are fixed: no gradients and BatchNorm in inference mode. Their output for a clip then never changes, so it is
+computed the first time the clip is seen in training and read back from a VideoStore (see video_store.py)
+afterwards: per video, the activations of each of its seq_len frames for the ResNet and of the whole clip for the
+I3D. Training steps only run the unfrozen layers, and the loader workers do not read or decode the inputs of the
+videos whose activations are stored (see VideoDataset.use_prefix_cache): their frames and flow are left out of the
+episodes, which only carry the clips of the videos still to cache.
+
+Reuse requires the same clip every time a video is drawn, so VideoDataset reads training clips like test clips
+(evenly spaced frames, centre crop, no flip) when the cache is on: the frozen layers give up input augmentation.
+Activations are large (a 224 x 224 frame gives 1024 x 14 x 14 values at layer3, 3.2 MB per 8 frame clip as
+float16), so by default they are stored as uint8: each channel of each frame (of each time step for the I3D) is
+quantised between its own minimum and maximum, an error of at most 1/510 of its range, which halves the store.
+The store is keyed by the frozen weights and by the inputs of the train split (dataset, flow format and
+preprocessing, see VideoDataset.inputs_key), so it is rebuilt rather than reused for another dataset.
+Size the store directory for the number of training videos times bytes_per_video().
+"""
+import zlib
+
+import numpy as np
+import torch
+
+from video_store import VideoStore
+
+CACHE_DTYPES = ("uint8", "float16")
+
+
+def prefix_signature(module):
+    """ crc32 of the parameters and buffers of the frozen layers of a module, whose outputs are cached """
+    crc = 0
+    for name, value in module.state_dict().items():
+        crc = zlib.crc32(name.encode("utf-8"), crc)
+        crc = zlib.crc32(value.detach().cpu().contiguous().numpy().tobytes(), crc)
+    return crc
+
+
+def quantise(activations):
+    """
+    uint8 codes of activations (n x A x B x ...), with the offset and the scale (n x A x B float32) of each A x B
+    slice: activations ~= codes * scale + offset
+    """
+    flat = activations.float().reshape(activations.shape[:3] + (-1,))
+    offset = flat.amin(dim=3)
+    scale = (flat.amax(dim=3) - offset) / 255
+    scale = torch.where(scale > 0, scale, torch.ones_like(scale)) # constant slices
+    codes = torch.round((flat - offset.unsqueeze(3)) / scale.unsqueeze(3)).to(torch.uint8)
+    return codes.reshape(activations.shape), offset, scale
+
+
+def dequantise(codes, offset, scale):
+    """ float activations from the output of quantise """
+    shape = offset.shape + (1,) * (codes.dim() - offset.dim())
+    return codes.float() * scale.reshape(shape) + offset.reshape(shape)
+
+
+class PrefixCache():
+    """
+    model: AMFAR with frozen backbone prefixes (freeze_prefix with rgb_stage, flow_stage or both)
+    directory: where the activations of the train split of dataset are stored
+    dtype: one of CACHE_DTYPES, the storage of the activations
+    """
+    def __init__(self, model, directory, dataset, device, dtype="uint8"):
+        self.model = model
+        self.device = device
+        self.quantised = dtype == "uint8"
+        self.rgb = model.rgb_backbone.frozen_stages > 0
+        self.flow = model.flow_backbone.frozen_stage is not None
+        if not (self.rgb or self.flow):
+            raise ValueError("no backbone prefix is frozen, there are no activations to cache")
+        seq_len, img_size = dataset.seq_len, dataset.img_size
+        arrays = {}
+        key = {"inputs": dataset.inputs_key(dataset.train_split), "dtype": dtype}
+        with torch.no_grad():
+            # shapes of the activations of one clip, from a blank one
+            if self.rgb:
+                shape = model.rgb_backbone.prefix(torch.zeros(seq_len, 3, img_size, img_size, device=device)).shape
+                arrays["rgb"] = (tuple(shape), np.dtype(dtype))
+                key["rgb"] = {"stage": model.rgb_backbone.frozen_stages,
+                              "weights": prefix_signature(model.rgb_backbone.resnet[:model.rgb_backbone.frozen_stages])}
+            if self.flow:
+                shape = model.flow_backbone.prefix(torch.zeros(1, seq_len - 1, 2, img_size, img_size, device=device)).shape
+                arrays["flow"] = (tuple(shape[1:]), np.dtype(dtype))
+                key["flow"] = {"stage": model.flow_backbone.frozen_stage,
+                               "weights": prefix_signature(torch.nn.ModuleList([model.flow_backbone.i3d._modules[e] for e in model.flow_backbone.frozen_end_points]))}
+        if self.quantised:
+            for name, (shape, _) in list(arrays.items()):
+                arrays[name + "_offset"] = arrays[name + "_scale"] = (shape[:2], np.float32)
+        self.store = VideoStore(directory, len(dataset.train_split), arrays, key)
+        self.hits = 0
+        self.misses = 0
+
+    def bytes_per_video(self):
+        return self.store.nbytes() // max(len(self.store), 1)
+
+    def activations(self, images, flows, vid_ids, cached=None):
+        """
+        The inputs of AMFAR for the clips of videos vid_ids, given as images ((n * seq_len) x 3 x H x W) and flows
+        (n x length x 2 x H x W): the prefix activations of the frozen backbones, computed for the videos seen for
+        the first time, or the clips themselves for a backbone that is not frozen. The clips flagged in cached
+        (support_cached or target_cached of the episode) have no rows in the inputs of the frozen backbones.
+        """
+        vid_ids = [int(v) for v in vid_ids]
+        cached = [False] * len(vid_ids) if cached is None else [bool(c) for c in cached]
+        missing = [i for i, v in enumerate(vid_ids) if not self.store.done[v]]
+        if any(cached[i] for i in missing):
+            raise RuntimeError("clips left out of the episode for activations that are not stored")
+        self.hits += len(vid_ids) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # row of each clip in the inputs of the frozen backbones
+            row = {i: r for r, i in enumerate(i for i in range(len(vid_ids)) if not cached[i])}
+            rows = {}
+            with torch.no_grad():
+                if self.rgb:
+                    clips = images.reshape(len(row), -1, *images.shape[1:])[[row[i] for i in missing]]
+                    clips, _ = self.model.preprocess(clips.reshape(-1, *clips.shape[2:]).to(self.device))
+                    out = self.model.rgb_backbone.prefix(clips)
+                    rows.update(self.encode("rgb", out.reshape(len(missing), -1, *out.shape[1:])))
+                if self.flow:
+                    _, clips = self.model.preprocess(flows=flows[[row[i] for i in missing]].to(self.device))
+                    rows.update(self.encode("flow", self.model.flow_backbone.prefix(clips)))
+            self.store.put([vid_ids[i] for i in missing], **rows)
+
+        if self.rgb:
+            rgb = self.decode("rgb", vid_ids)
+            images = rgb.reshape(-1, *rgb.shape[2:])
+        if self.flow:
+            flows = self.decode("flow", vid_ids)
+        return images, flows
+
+    def encode(self, name, activations):
+        """ store rows of the activations (one per video) of input name """
+        if not self.quantised:
+            return {name: activations.half().cpu().numpy()}
+        codes, offset, scale = quantise(activations)
+        return {name: codes.cpu().numpy(), name + "_offset": offset.cpu().numpy(), name + "_scale": scale.cpu().numpy()}
+
+    def decode(self, name, vid_ids):
+        """ float activations of input name of videos vid_ids, on the device """
+        rows = torch.from_numpy(self.store[name][vid_ids]).to(self.device)
+        if not self.quantised:
+            return rows.float()
+        return dequantise(rows, torch.from_numpy(self.store[name + "_offset"][vid_ids]).to(self.device),
+                          torch.from_numpy(self.store[name + "_scale"][vid_ids]).to(self.device))
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return "hit rate {:.3f} ({} hits, {} misses), {}/{} videos stored, {:.1f} MB/video".format(
+            self.hits / lookups if lookups else 0.0, self.hits, self.misses, len(self.store) - len(self.store.missing()),
+            len(self.store), self.bytes_per_video() / 2 ** 20)
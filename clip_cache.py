@@ -0,0 +1,203 @@
+"""Cache of decoded frames shared by all DataLoader workers of a VideoDataset.
+
+The cache is a fixed-size slab of shared anonymous memory divided into equal slots, one decoded frame per slot
+(an RGB frame as uint8 H x W x C, or one 224 x 224 float32 flow frame), plus an index in the same mapping: the key
+and shape of every slot, and an open addressing hash table (linear probing, at most half full) from frame keys to
+slots. It is created before the workers are forked, so every worker reads the frames the others decoded and fills
+the cache for them; it cannot be pickled, so the workers must be forked. Slots are evicted with the CLOCK
+approximation of LRU. Lookups, inserts and the hit/miss counters are guarded by one multiprocessing lock; a lookup
+probes a few table entries whatever the size of the cache, so the lock is held for microseconds, well below the
+JPEG decode or flow read a hit saves.
+"""
+import mmap
+import multiprocessing
+
+import numpy as np
+
+KIND_RGB = 0
+KIND_FLOW_X = 1
+KIND_FLOW_Y = 2
+
+_DTYPES = (np.dtype(np.uint8), np.dtype(np.float16), np.dtype(np.float32))
+_MAX_NDIM = 4
+_EMPTY = -1
+# Fibonacci hashing multiplier, spreading the structured frame keys over the table
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+# counters
+_HITS, _MISSES, _BYTES_SAVED, _INSERTS, _EVICTIONS, _REJECTED = range(6)
+_N_COUNTERS = 8
+
+
+def frame_key(split, vid_id, kind, frame):
+    """
+    int64 cache key of one frame: split is 0 for train and 1 for test (video ids are per split), kind one of the
+    KIND_* constants, frame the index of the frame in its video.
+    """
+    return ((split * 4 + kind) << 52) | (vid_id << 20) | frame
+
+
+class SharedFrameCache():
+    """
+    capacity_bytes: size of the slab holding frame data
+    slot_bytes: size of one slot, the largest frame that can be cached
+    """
+    def __init__(self, capacity_bytes, slot_bytes):
+        self.slot_bytes = int(slot_bytes)
+        self.n_slots = int(capacity_bytes) // self.slot_bytes
+        if self.n_slots < 1:
+            raise ValueError("frame cache of {} bytes cannot hold one {} byte slot".format(capacity_bytes, slot_bytes))
+        self.capacity_bytes = self.n_slots * self.slot_bytes
+        # hash table of at least twice as many entries as slots, a power of two
+        self.table_bits = max(1, (2 * self.n_slots - 1).bit_length())
+        self.table_size = 1 << self.table_bits
+
+        layout = [("keys", np.int64, (self.n_slots,)),
+                  ("table", np.int32, (self.table_size,)),
+                  ("nbytes", np.int64, (self.n_slots,)),
+                  ("shapes", np.int32, (self.n_slots, _MAX_NDIM)),
+                  ("ndims", np.int8, (self.n_slots,)),
+                  ("dtypes", np.int8, (self.n_slots,)),
+                  ("ref", np.uint8, (self.n_slots,)),
+                  ("hand", np.int64, (1,)),
+                  ("counters", np.int64, (_N_COUNTERS,))]
+        index_bytes = 0
+        offsets = []
+        for name, dtype, shape in layout:
+            index_bytes = (index_bytes + 63) // 64 * 64
+            offsets.append(index_bytes)
+            index_bytes += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        index_bytes = (index_bytes + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+        # MAP_SHARED anonymous memory is shared with the processes forked after this point
+        self._mem = mmap.mmap(-1, index_bytes + self.capacity_bytes)
+        for (name, dtype, shape), offset in zip(layout, offsets):
+            setattr(self, name, np.frombuffer(self._mem, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape))
+        self.data = np.frombuffer(self._mem, dtype=np.uint8, count=self.capacity_bytes, offset=index_bytes)
+        self.keys[:] = _EMPTY
+        self.table[:] = _EMPTY
+        self.lock = multiprocessing.Lock()
+
+    def __getstate__(self):
+        raise TypeError("SharedFrameCache is shared with forked processes only and cannot be pickled")
+
+    def _home(self, key):
+        """ table entry where the probe for key starts """
+        return ((int(key) * _HASH_MULTIPLIER) & _MASK64) >> (64 - self.table_bits)
+
+    def _find(self, key):
+        """ table entry holding key, or the empty entry where it would be inserted """
+        mask = self.table_size - 1
+        i = self._home(key)
+        for _ in range(self.table_size):
+            s = int(self.table[i])
+            if s == _EMPTY or self.keys[s] == key:
+                return i
+            i = (i + 1) & mask
+        raise RuntimeError("frame cache hash table is full") # cannot happen below half full
+
+    def _slot(self, key):
+        s = int(self.table[self._find(key)])
+        return None if s == _EMPTY else s
+
+    def _unlink(self, key):
+        """ remove key from the hash table, moving back the entries after it so that no probe sequence breaks """
+        mask = self.table_size - 1
+        i = self._find(key)
+        if self.table[i] == _EMPTY:
+            return
+        j = i
+        while True:
+            j = (j + 1) & mask
+            s = int(self.table[j])
+            if s == _EMPTY:
+                break
+            home = self._home(self.keys[s])
+            # the entry at j can fill the hole at i if its home is not cyclically in (i, j]
+            if (j > i and (home <= i or home > j)) or (j < i and home <= i and home > j):
+                self.table[i] = s
+                i = j
+        self.table[i] = _EMPTY
+
+    def _victim(self):
+        """ next slot on the clock with a clear reference bit, clearing the bits the hand passes """
+        h = int(self.hand[0])
+        free = np.flatnonzero(self.ref[h:] == 0)
+        if len(free):
+            s = h + int(free[0])
+            self.ref[h:s] = 0
+        else:
+            self.ref[h:] = 0
+            free = np.flatnonzero(self.ref[:h] == 0)
+            s = int(free[0]) if len(free) else h # every slot was referenced: the hand comes back round
+            self.ref[:s] = 0
+        self.hand[0] = (s + 1) % self.n_slots
+        return s
+
+    def __contains__(self, key):
+        """ whether key is cached, without locking or counting: a hint, the entry may be evicted right after """
+        return self._slot(key) is not None
+
+    def get(self, key, out=None):
+        """ copy of the frame stored under key (written into out if given), None on a miss """
+        with self.lock:
+            s = self._slot(key)
+            if s is None:
+                self.counters[_MISSES] += 1
+                return None
+            self.ref[s] = 1
+            dtype = _DTYPES[self.dtypes[s]]
+            shape = tuple(self.shapes[s, :self.ndims[s]])
+            n = int(self.nbytes[s])
+            start = s * self.slot_bytes
+            frame = self.data[start:start + n].view(dtype).reshape(shape)
+            if out is None:
+                out = frame.copy()
+            else:
+                out[...] = frame
+            self.counters[_HITS] += 1
+            self.counters[_BYTES_SAVED] += n
+        return out
+
+    def put(self, key, frame):
+        """ store a frame under key, evicting another if the cache is full. Returns False if it cannot be cached. """
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_bytes or frame.ndim > _MAX_NDIM or frame.dtype not in _DTYPES:
+            with self.lock:
+                self.counters[_REJECTED] += 1
+            return False
+        with self.lock:
+            if self._slot(key) is not None: # filled meanwhile by another worker
+                return True
+            s = self._victim()
+            if self.keys[s] != _EMPTY:
+                self._unlink(self.keys[s])
+                self.counters[_EVICTIONS] += 1
+            start = s * self.slot_bytes
+            self.data[start:start + frame.nbytes] = frame.reshape(-1).view(np.uint8)
+            self.nbytes[s] = frame.nbytes
+            self.shapes[s, :frame.ndim] = frame.shape
+            self.ndims[s] = frame.ndim
+            self.dtypes[s] = _DTYPES.index(frame.dtype)
+            self.keys[s] = key
+            self.table[self._find(key)] = s
+            self.ref[s] = 1
+            self.counters[_INSERTS] += 1
+        return True
+
+    def stats(self):
+        """ counters summed over all processes using the cache """
+        with self.lock:
+            counters = self.counters.copy()
+            entries = int((self.keys != _EMPTY).sum())
+        lookups = counters[_HITS] + counters[_MISSES]
+        return {"hits": int(counters[_HITS]), "misses": int(counters[_MISSES]),
+                "hit_rate": float(counters[_HITS]) / lookups if lookups else 0.0,
+                "bytes_saved": int(counters[_BYTES_SAVED]), "inserts": int(counters[_INSERTS]),
+                "evictions": int(counters[_EVICTIONS]), "rejected": int(counters[_REJECTED]),
+                "entries": entries, "slots": self.n_slots, "capacity_bytes": self.capacity_bytes}
+
+    def summary(self):
+        s = self.stats()
+        return "hit rate {:.3f} ({} hits, {} misses), {:.1f} MB saved, {}/{} slots used, {} evictions, {} rejected".format(
+            s["hit_rate"], s["hits"], s["misses"], s["bytes_saved"] / 2 ** 20, s["entries"], s["slots"], s["evictions"], s["rejected"])
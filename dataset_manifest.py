@@ -0,0 +1,148 @@
+"""Compact on-disk index of a class/video/{img,flow_x,flow_y} dataset tree, so that VideoDataset.read_dir does not
+have to list every video folder on every run. """
+import os
+import json
+import hashlib
+from collections.abc import Sequence
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+SUBDIRS = ("img", "flow_x", "flow_y")
+# files of an img folder that are frames; anything else there (Thumbs.db, .partial leftovers) is ignored
+FRAME_EXTENSIONS = (".jpg", ".png")
+
+
+class FramePaths(Sequence):
+    """Frame paths of one video folder, joined on access. The file names live in one list shared by the manifest."""
+    __slots__ = ("directory", "names", "start", "stop")
+
+    def __init__(self, directory, names, start=0, stop=None):
+        self.directory = directory
+        self.names = names
+        self.start = start
+        self.stop = len(names) if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("frame index out of range")
+        return os.path.join(self.directory, self.names[self.start + i])
+
+
+class DatasetManifest():
+    """
+    Class folders, video folders (relative to the dataset root), class ids, and the sorted img/flow_x/flow_y file
+    names of every indexed video. Stored as a single .npz with the names packed into one utf-8 blob.
+    """
+    def __init__(self, class_folders, fingerprint=None):
+        self.class_folders = list(class_folders)
+        self.fingerprint = fingerprint
+        self.video_dirs = []
+        self.class_ids = []
+        self.counts = []  # (n_frames, n_flow_x, n_flow_y) per video
+        self.names = []   # img, then flow_x, then flow_y names of each video, videos back to back
+
+    def add_video(self, video_dir, class_id, imgs, flow_x, flow_y):
+        self.video_dirs.append(video_dir)
+        self.class_ids.append(class_id)
+        self.counts.append((len(imgs), len(flow_x), len(flow_y)))
+        self.names.extend(imgs)
+        self.names.extend(flow_x)
+        self.names.extend(flow_y)
+
+    def __len__(self):
+        return len(self.video_dirs)
+
+    def videos(self, root):
+        """ yields (video_dir, class_id, frame paths, flow_x paths, flow_y paths) for every video, paths under root """
+        offset = 0
+        for video_dir, class_id, (n_img, n_x, n_y) in zip(self.video_dirs, self.class_ids, self.counts):
+            base = os.path.join(root, video_dir)
+            paths = FramePaths(os.path.join(base, SUBDIRS[0]), self.names, offset, offset + n_img)
+            offset += n_img
+            paths_x = FramePaths(os.path.join(base, SUBDIRS[1]), self.names, offset, offset + n_x)
+            offset += n_x
+            paths_y = FramePaths(os.path.join(base, SUBDIRS[2]), self.names, offset, offset + n_y)
+            offset += n_y
+            yield video_dir, class_id, paths, paths_x, paths_y
+
+    def save(self, path):
+        """ write atomically, so a concurrent reader never sees a partial manifest """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        blob = "\n".join(self.names).encode("utf-8")
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f,
+                     version=np.array(MANIFEST_VERSION),
+                     fingerprint=np.array(json.dumps(self.fingerprint, sort_keys=True)),
+                     class_folders=np.array(self.class_folders, dtype=str),
+                     video_dirs=np.array(self.video_dirs, dtype=str),
+                     class_ids=np.array(self.class_ids, dtype=np.int32),
+                     counts=np.array(self.counts, dtype=np.int32).reshape(-1, 3),
+                     names=np.frombuffer(blob, dtype=np.uint8))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """
+        Load a manifest written by save(). Returns None if it is missing, unreadable, from another manifest version,
+        or if fingerprint is given and does not match the stored one (i.e. the tree or split files changed).
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != MANIFEST_VERSION:
+                    return None
+                stored = json.loads(str(data["fingerprint"]))
+                if fingerprint is not None and stored != json.loads(json.dumps(fingerprint, sort_keys=True)):
+                    return None
+                manifest = cls(data["class_folders"].tolist(), stored)
+                manifest.video_dirs = data["video_dirs"].tolist()
+                manifest.class_ids = data["class_ids"].tolist()
+                manifest.counts = [tuple(c) for c in data["counts"].tolist()]
+                blob = data["names"].tobytes().decode("utf-8")
+        except (OSError, KeyError, ValueError):
+            return None
+        manifest.names = blob.split("\n") if blob else []
+        if len(manifest.names) != sum(sum(c) for c in manifest.counts):
+            return None
+        return manifest
+
+
+def tree_fingerprint(root, split_files, **options):
+    """
+    Cheap summary of a dataset tree: the mtimes of the root, of every class folder and of the split files, plus
+    any indexing options. Adding or removing a video changes its class folder mtime; edits inside an existing
+    video folder do not, so after adding, removing or re-extracting frames in place, rebuild the manifest with
+    --rebuild_manifest or read the tree through a verified index written by scripts/fsck_dataset.py
+    (--dataset_index). Nothing below the class folders is read, so a cached index loads without a pass over the
+    videos, which on a network mount costs as much as listing them.
+    """
+    root = os.path.abspath(root)
+    class_mtimes = {}
+    for entry in os.scandir(root):
+        if entry.name[0] != '.' and entry.is_dir():
+            class_mtimes[entry.name] = entry.stat().st_mtime_ns
+    return {"root": root,
+            "root_mtime": os.stat(root).st_mtime_ns,
+            "class_mtimes": class_mtimes,
+            "split_files": {os.path.abspath(f): os.stat(f).st_mtime_ns for f in split_files},
+            "options": options}
+
+
+def verified_index_fingerprint(root, split_files, seq_len):
+    """ fingerprint of a verified index written by scripts/fsck_dataset.py, checked by VideoDataset on --dataset_index """
+    return tree_fingerprint(root, split_files, seq_len=seq_len, verified=True)
+
+
+def manifest_path(cache_dir, root, split_files, **options):
+    """ location of the cached manifest for this root, split files and options """
+    key = json.dumps([os.path.abspath(root), sorted(os.path.abspath(f) for f in split_files), options], sort_keys=True)
+    name = "{}_{}.npz".format(os.path.basename(os.path.normpath(root)), hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+    return os.path.join(cache_dir, name)
@@ -0,0 +1,177 @@
+"""Episode prefetching bounded by bytes instead of by a number of batches.
+
+A DataLoader keeps num_workers * prefetch_factor episodes in flight whatever their size, so the memory it takes
+changes with way, shot, img_size and the transport dtype. EpisodeLoader admits a new episode to its workers only
+while the bytes of the episodes already in flight (being built, waiting in the queue, or held by the consumer)
+plus the expected size of one more stay within a budget. Sizes are learned from the episodes produced: until the
+first one arrives a single episode is in flight, afterwards the largest episode seen so far is the estimate.
+Each iteration keeps its own record of the episodes it has in flight and adds only its changes to the loader's
+count, so iterations can nest (an evaluation run from inside the training loop) and share one budget.
+
+Workers are forked, like DataLoader workers on Linux, so they share the dataset index and its frame cache, and
+return collated episodes (leading batch dimension of 1) through shared memory.
+"""
+import os
+import queue
+import random
+import time
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import default_collate
+
+
+def episode_nbytes(episode):
+    """ bytes of the tensors of an episode dict """
+    return sum(v.numel() * v.element_size() for v in episode.values() if torch.is_tensor(v))
+
+
+def _worker_loop(dataset, index_queue, result_queue, done_event, seed):
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    torch.manual_seed(seed)
+    # results still queued when the loader shuts down are dropped instead of blocking the exit of the worker
+    result_queue.cancel_join_thread()
+    while True:
+        task = index_queue.get()
+        if task is None or done_event.is_set():
+            break
+        n, index = task
+        try:
+            episode = default_collate([dataset[index]])
+            result_queue.put((n, episode, episode_nbytes(episode), None))
+        except Exception:
+            result_queue.put((n, None, 0, "worker {} failed on episode {}:\n{}".format(os.getpid(), index, traceback.format_exc())))
+
+
+class EpisodeLoader():
+    """
+    dataset: an episode dataset such as VideoDataset (indexable, with a length)
+    num_workers: worker processes building episodes; 0 builds them in the consumer, without prefetching
+    budget_bytes: bytes of episodes allowed in flight; at least one episode is always admitted
+    """
+    def __init__(self, dataset, num_workers, budget_bytes):
+        self.dataset = dataset
+        self.num_workers = num_workers
+        self.budget_bytes = budget_bytes
+        self.estimate_bytes = None # expected size of the next episode
+        self.bytes_in_flight = 0   # over all iterations in progress
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def reset_stats(self):
+        self.episodes = 0
+        self.stall_time = 0.0       # consumer time spent waiting for the next episode
+        self.max_bytes_in_flight = self.bytes_in_flight
+        self.queue_depth = 0        # episodes produced and waiting for the consumer
+        self.queue_depth_sum = 0
+
+    def stats(self):
+        return {"episodes": self.episodes, "stall_time": self.stall_time,
+                "stall_per_episode": self.stall_time / self.episodes if self.episodes else 0.0,
+                "bytes_in_flight": self.bytes_in_flight, "max_bytes_in_flight": self.max_bytes_in_flight,
+                "queue_depth": self.queue_depth,
+                "mean_queue_depth": self.queue_depth_sum / self.episodes if self.episodes else 0.0,
+                "episode_bytes": self.estimate_bytes, "budget_bytes": self.budget_bytes}
+
+    def summary(self):
+        s = self.stats()
+        return ("{} episodes, stalled {:.1f} s ({:.1f} ms/episode), queue depth {} (mean {:.2f}), "
+                "{:.1f} MB in flight (max {:.1f} MB of {:.1f} MB), {:.1f} MB/episode").format(
+            s["episodes"], s["stall_time"], s["stall_per_episode"] * 1e3, s["queue_depth"], s["mean_queue_depth"],
+            s["bytes_in_flight"] / 2 ** 20, s["max_bytes_in_flight"] / 2 ** 20, s["budget_bytes"] / 2 ** 20,
+            (s["episode_bytes"] or 0) / 2 ** 20)
+
+    def __iter__(self):
+        if self.num_workers == 0:
+            return self._iter_serial()
+        return self._iter_workers()
+
+    def _iter_serial(self):
+        held = 0 # bytes of the episode held by the consumer
+        try:
+            for index in range(len(self.dataset)):
+                t0 = time.perf_counter()
+                episode = default_collate([self.dataset[index]])
+                self.stall_time += time.perf_counter() - t0
+                self.episodes += 1
+                held = episode_nbytes(episode)
+                self.estimate_bytes = max(self.estimate_bytes or 0, held)
+                self.bytes_in_flight += held
+                self.max_bytes_in_flight = max(self.max_bytes_in_flight, self.bytes_in_flight)
+                yield episode
+                del episode
+                self.bytes_in_flight -= held
+                held = 0
+        finally:
+            self.bytes_in_flight -= held
+
+    def _iter_workers(self):
+        ctx = mp.get_context("fork")
+        index_queue = ctx.SimpleQueue()
+        result_queue = ctx.Queue()
+        done_event = ctx.Event()
+        base_seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        workers = [ctx.Process(target=_worker_loop, args=(self.dataset, index_queue, result_queue, done_event, base_seed + i), daemon=True)
+                   for i in range(self.num_workers)]
+        for w in workers:
+            w.start()
+
+        n_total = len(self.dataset)
+        booked = {}   # episode number -> bytes this iteration counts in flight (the estimate until it arrives)
+        ready = {}    # episode number -> episode, produced and not yet yielded
+        next_issue = next_yield = 0
+        try:
+            while next_yield < n_total:
+                # admit episodes while the budget, shared with any other iteration in progress, allows one more of the expected size
+                while next_issue < n_total and (not booked or (self.estimate_bytes is not None and
+                       self.bytes_in_flight + self.estimate_bytes <= self.budget_bytes)):
+                    booked[next_issue] = self.estimate_bytes or 0
+                    self.bytes_in_flight += booked[next_issue]
+                    index_queue.put((next_issue, next_issue))
+                    next_issue += 1
+
+                t0 = time.perf_counter()
+                while next_yield not in ready:
+                    try:
+                        n, episode, nbytes, error = result_queue.get(timeout=5.0)
+                    except queue.Empty:
+                        dead = [w.pid for w in workers if not w.is_alive()]
+                        if dead:
+                            raise RuntimeError("episode loader workers {} exited unexpectedly".format(dead))
+                        continue
+                    if error is not None:
+                        raise RuntimeError(error)
+                    self.estimate_bytes = max(self.estimate_bytes or 0, nbytes)
+                    self.bytes_in_flight += nbytes - booked[n]
+                    booked[n] = nbytes
+                    ready[n] = episode
+                self.stall_time += time.perf_counter() - t0
+
+                episode = ready.pop(next_yield)
+                self.queue_depth = len(ready)
+                self.queue_depth_sum += self.queue_depth
+                self.max_bytes_in_flight = max(self.max_bytes_in_flight, self.bytes_in_flight)
+                self.episodes += 1
+                yield episode
+                # the consumer asked for the next episode, so it is done with this one
+                del episode
+                self.bytes_in_flight -= booked.pop(next_yield)
+                next_yield += 1
+        finally:
+            done_event.set()
+            for _ in workers:
+                index_queue.put(None)
+            for w in workers:
+                w.join(timeout=5.0)
+                if w.is_alive():
+                    w.terminate()
+            result_queue.cancel_join_thread()
+            result_queue.close()
+            # only what this iteration still had in flight, another one may be in progress
+            self.bytes_in_flight -= sum(booked.values())
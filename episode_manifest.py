@@ -0,0 +1,143 @@
+"""Seeded few-shot episodes fixed in advance, so that evaluations draw the same tasks every time.
+
+An episode manifest stores, for every episode, the classes drawn and, for every support and query slot, the video
+id (in its split), the episode label and the frame indices of the clip, in the order VideoDataset returns them.
+VideoDataset replays episode i of a manifest as its item i (see --episode_manifest), which makes evaluations
+comparable across checkpoints and lets ranges of episodes be evaluated by separate processes.
+
+Video ids are positions in the split, so a manifest is only valid for the dataset and split lists it was generated
+from; a signature of the split (labels and frame counts of its videos) is stored and checked when replaying.
+"""
+import os
+import random
+import zlib
+
+import numpy as np
+
+EPISODE_MANIFEST_VERSION = 1
+_SLOTS = ("support", "query")
+
+
+def split_signature(split):
+    """ crc32 of the labels and frame counts of the videos of a Split, in video id order """
+    labels = np.asarray(split.gt_a_list, dtype=np.int64)
+    counts = np.array([(len(v), len(x), len(y)) for v, x, y in zip(split.videos, split.videos_flows_X, split.videos_flows_Y)],
+                      dtype=np.int64).reshape(-1, 3)
+    return zlib.crc32(counts.tobytes(), zlib.crc32(labels.tobytes()))
+
+
+class EpisodeManifest():
+    """
+    classes: (episodes, way) class ids drawn for each episode, indexed by the episode labels
+    support_videos, support_labels: (episodes, way * shot) video id and episode label of each support slot
+    support_frames: (episodes, way * shot, seq_len) frame indices of each support clip
+    query_videos, query_labels, query_frames: the same for the way * query_per_class query slots
+    """
+    def __init__(self, classes, support_videos, support_labels, support_frames, query_videos, query_labels, query_frames,
+                 train=False, seed=None, signature=None, first=0):
+        self.classes = classes
+        self.support_videos = support_videos
+        self.support_labels = support_labels
+        self.support_frames = support_frames
+        self.query_videos = query_videos
+        self.query_labels = query_labels
+        self.query_frames = query_frames
+        self.train = train         # episodes of the train split, otherwise of the test split
+        self.seed = seed
+        self.signature = signature # split_signature of the split the episodes were drawn from
+        self.first = first         # number of the first episode in the generated manifest, for selections
+
+    def __len__(self):
+        return len(self.classes)
+
+    @property
+    def way(self):
+        return self.classes.shape[1]
+
+    @property
+    def seq_len(self):
+        return self.support_frames.shape[2]
+
+    def select(self, start, stop):
+        """ manifest of episodes start to stop (exclusive), e.g. the share of one of several evaluation processes """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return EpisodeManifest(*(getattr(self, name)[start:stop] for name in self._arrays()),
+                               train=self.train, seed=self.seed, signature=self.signature, first=self.first + start)
+
+    def episode(self, i):
+        """ (classes, [(video id, label, frame indices) of each support slot], [... of each query slot]) """
+        slots = [list(zip(getattr(self, s + "_videos")[i].tolist(), getattr(self, s + "_labels")[i].tolist(),
+                          getattr(self, s + "_frames")[i].tolist())) for s in _SLOTS]
+        return self.classes[i].tolist(), slots[0], slots[1]
+
+    def check(self, split, seq_len):
+        """ raise ValueError if the episodes cannot be replayed on split, the train or test split of the dataset """
+        if seq_len != self.seq_len:
+            raise ValueError("episode manifest has clips of {} frames, seq_len is {}".format(self.seq_len, seq_len))
+        if self.signature is not None and split_signature(split) != self.signature:
+            raise ValueError("episode manifest was generated from another dataset or split list")
+
+    @staticmethod
+    def _arrays():
+        return ["classes"] + [s + f for s in _SLOTS for f in ("_videos", "_labels", "_frames")]
+
+    def save(self, path):
+        """ write atomically as a compressed .npz """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f,
+                                version=np.array(EPISODE_MANIFEST_VERSION),
+                                train=np.array(self.train),
+                                seed=np.array(-1 if self.seed is None else self.seed, dtype=np.int64),
+                                signature=np.array(-1 if self.signature is None else self.signature, dtype=np.int64),
+                                first=np.array(self.first, dtype=np.int64),
+                                **{name: getattr(self, name) for name in self._arrays()})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != EPISODE_MANIFEST_VERSION:
+                raise ValueError("{}: episode manifest version {}, expected {}".format(path, int(data["version"]), EPISODE_MANIFEST_VERSION))
+            seed, signature = int(data["seed"]), int(data["signature"])
+            return cls(*(data[name] for name in cls._arrays()), train=bool(data["train"]),
+                       seed=None if seed < 0 else seed, signature=None if signature < 0 else signature, first=int(data["first"]))
+
+
+def generate_episodes(dataset, n_episodes, seed, train=False):
+    """
+    Draw n_episodes episodes of the train or test split of a VideoDataset as its __getitem__ does: way classes,
+    shot support and query_per_class (query_per_class_test for the test split) query videos per class, clip frames
+    sampled as in training or testing, slots shuffled. Uses its own generator seeded with seed, so the result
+    depends only on the seed, the dataset and the episode shape.
+    """
+    rng = random.Random(seed)
+    split = dataset.train_split if train else dataset.test_split
+    way, shot = dataset.way, dataset.args.shot
+    n_queries = dataset.args.query_per_class if train else dataset.args.query_per_class_test
+    classes = split.get_unique_classes()
+    # the frames sampled depend on dataset.train
+    was_train, dataset.train = dataset.train, train
+    episodes = {name: [] for name in EpisodeManifest._arrays()}
+    try:
+        for _ in range(n_episodes):
+            batch_classes = rng.sample(classes, way)
+            slots = {"support": [], "query": []}
+            for bl, bc in enumerate(batch_classes):
+                idxs = rng.sample(range(split.get_num_videos_for_class(bc)), shot + n_queries)
+                for i, idx in enumerate(idxs):
+                    paths, paths_flow_x, _, vid_id = split.get_rand_vid(bc, idx)
+                    frames = dataset.sample_idxs(len(paths), len(paths_flow_x), rng)
+                    slots["support" if i < shot else "query"].append((vid_id, bl, frames))
+            episodes["classes"].append(batch_classes)
+            for s in _SLOTS:
+                rng.shuffle(slots[s])
+                vids, labels, frames = zip(*slots[s])
+                episodes[s + "_videos"].append(vids)
+                episodes[s + "_labels"].append(labels)
+                episodes[s + "_frames"].append(frames)
+    finally:
+        dataset.train = was_train
+    arrays = [np.array(episodes[name], dtype=np.int8 if name.endswith("_labels") else np.int32) for name in EpisodeManifest._arrays()]
+    return EpisodeManifest(*arrays, train=train, seed=seed, signature=split_signature(split))
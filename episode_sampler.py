@@ -0,0 +1,67 @@
+"""Episode sampling from a slowly rotating window of classes and videos, to bound the working set of training.
+
+VideoDataset draws the classes of an episode among all classes and its videos among all videos of each class, so
+consecutive episodes share almost no files and neither the page cache nor the frame cache (clip_cache.py) gets
+reuse. WindowedEpisodeSampler draws them from windows instead:
+
+- the classes are put on a ring in a random order, and an episode draws its way classes uniformly from the
+  class_window consecutive classes starting at position episode // shift_every: the window advances by one class
+  every shift_every episodes;
+- the videos of each class are put on a ring in a random order, and the videos of a class are drawn uniformly from
+  the video_window consecutive videos starting at the number of window shifts the class has spent in the class
+  window so far: its video window advances by one video per shift, only while the class is in use.
+
+Every class spends the same number of episodes in the window per turn of the ring, and every video the same
+number of shifts in the window of its class per turn of that ring, so over full turns class and video frequencies
+are those of the uniform sampler. Positions are computed from the episode index alone, so DataLoader workers
+building different episodes agree on the windows without sharing state.
+"""
+import random
+
+import numpy as np
+
+
+class WindowedEpisodeSampler():
+    """
+    split: Split the episodes are drawn from (its classes and per-class video indices)
+    class_window: classes in the window, at least the way of the episodes
+    video_window: videos in the window of each class, at least shot + queries (all videos of smaller classes)
+    shift_every: episodes between moves of the class window
+    seed: seed of the orders of the rings
+    """
+    def __init__(self, split, class_window, video_window, shift_every=100, seed=0):
+        rng = np.random.RandomState(seed)
+        self.classes = [split.get_unique_classes()[i] for i in rng.permutation(len(split.get_unique_classes()))]
+        self.class_window = min(class_window, len(self.classes))
+        self.video_window = video_window
+        self.shift_every = max(1, shift_every)
+        self.position = {c: p for p, c in enumerate(self.classes)}
+        # per class, the ring of its video indices (positions in the class, as get_rand_vid takes them)
+        self.video_rings = {c: rng.permutation(split.get_num_videos_for_class(c)) for c in self.classes}
+
+    def step(self, index):
+        return index // self.shift_every
+
+    def window_classes(self, index):
+        """ classes of the class window for episode index """
+        t = self.step(index)
+        return [self.classes[(t + k) % len(self.classes)] for k in range(self.class_window)]
+
+    def shifts_in_window(self, label, index):
+        """ class window shifts class label has spent in the window up to episode index, it being in the window """
+        n, w = len(self.classes), self.class_window
+        # steps since the class first entered the window, at step position - class_window + 1
+        since = self.step(index) - (self.position[label] - w + 1)
+        return (since // n) * w + since % n
+
+    def episode(self, index, way, n_videos, rng=random):
+        """ (classes, {class: video indices in the class}) of episode index, with n_videos videos per class """
+        batch_classes = rng.sample(self.window_classes(index), way)
+        videos = {}
+        for c in batch_classes:
+            ring = self.video_rings[c]
+            size = max(min(self.video_window, len(ring)), n_videos)
+            start = self.shifts_in_window(c, index)
+            window = [int(ring[(start + k) % len(ring)]) for k in range(min(size, len(ring)))]
+            videos[c] = rng.sample(window, n_videos)
+        return batch_classes, videos
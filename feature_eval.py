@@ -0,0 +1,86 @@
+"""Evaluation of a frozen AMFAR model on its video-level features instead of on clips.
+
+The backbones embed every clip independently of the episode it is in (see RGB_Strm_Backbone.embed and
+Flow_i3d_backbone.embed), and in testing a video always gives the same centre-cropped clip. So every test video is
+embedded once, into a VideoStore (see video_store.py), and episodes are scored from the stored vectors: class
+prototypes, AAS, AMD and AMI (AMFAR.score) only, without decoding a frame or running a backbone. Episodes come
+from an episode manifest (see episode_manifest.py), so the same tasks can be scored for several checkpoints.
+
+The store is filled in batches and resumable: videos already embedded for the same checkpoint and inputs (split,
+dataset and preprocessing, see VideoDataset.inputs_key) are skipped.
+"""
+import os
+from itertools import islice
+
+import numpy as np
+import torch
+
+from video_store import VideoStore
+from utils import aggregate_prob_accuracy, loss_prob
+
+
+def checkpoint_key(path):
+    """ identifies a checkpoint file by path, size and modification time """
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+
+def open_store(directory, dataset, checkpoint=None, rgb_dim=2048, flow_dim=1024):
+    """ VideoStore of the rgb and flow embeddings of the test split of a VideoDataset by the weights of checkpoint (a file path) """
+    key = {"checkpoint": checkpoint_key(checkpoint) if checkpoint else None, "inputs": dataset.inputs_key(dataset.test_split)}
+    return VideoStore(directory, len(dataset.test_split), {"rgb": ((rgb_dim,), np.float32), "flow": ((flow_dim,), np.float32)}, key)
+
+
+def embed_videos(model, dataset, store, device, batch_videos=4, log=print):
+    """
+    Embed the videos of the test split of dataset missing from store with the backbones of model, batch_videos
+    videos per backbone call, reading them as in testing (evenly spaced frames, centre crop).
+    """
+    todo = store.missing()
+    if not len(todo):
+        return
+    was_train, dataset.train = dataset.train, False
+    c = dataset.get_train_or_test_db()
+    model.eval()
+
+    def plan(vid_id):
+        return dataset.plan_vid(vid_id, dataset.sample_idxs(len(c.videos[vid_id]), len(c.videos_flows_X[vid_id])))
+
+    try:
+        with torch.no_grad():
+            clips = dataset.load_clips(todo.tolist(), plan)
+            for start in range(0, len(todo), batch_videos):
+                vid_ids, imgs, flows = zip(*[(vid_id, imgs, flow) for vid_id, (imgs, flow, _) in islice(clips, batch_videos)])
+                imgs, flows = model.preprocess(torch.cat(imgs).to(device), torch.stack(flows).to(device))
+                store.put(list(vid_ids), rgb=model.rgb_backbone.embed(imgs).cpu().numpy(), flow=model.flow_backbone.embed(flows).cpu().numpy())
+                if (start // batch_videos + 1) % 25 == 0:
+                    store.flush()
+                    log("embedded {}/{} test videos".format(len(store) - len(store.missing()), len(store)))
+    finally:
+        store.flush()
+        dataset.train = was_train
+
+
+def score_episodes(model, store, manifest, device, tasks_per_batch=1):
+    """
+    Yields (accuracy, loss) of every episode of manifest, scored by model from the stored embeddings; loss is the
+    joint loss of Learner.test (posterior losses over tasks_per_batch plus the AMD losses).
+    """
+    model.eval()
+    with torch.no_grad():
+        for i in range(len(manifest)):
+            classes, support, query = manifest.episode(i)
+            support_vids, support_labels, _ = zip(*support)
+            query_vids, query_labels, _ = zip(*query)
+            support_vids, query_vids = list(support_vids), list(query_vids)
+            context_labels = torch.tensor(support_labels, device=device)
+            target_labels = torch.tensor(query_labels, dtype=torch.long, device=device)
+            tensor = lambda a: torch.from_numpy(np.ascontiguousarray(a)).to(device)
+            x_features = {"context_rgb_features": model.rgb_backbone.prototypes(tensor(store["rgb"][support_vids]), context_labels),
+                          "context_flow_features": model.flow_backbone.prototypes(tensor(store["flow"][support_vids]), context_labels),
+                          "target_rgb_features": tensor(store["rgb"][query_vids]),
+                          "target_flow_features": tensor(store["flow"][query_vids])}
+            model_dict = model.score(x_features)
+            loss = (loss_prob(model_dict['P_r'], target_labels, device) / tasks_per_batch + model_dict['L_f_r']
+                    + loss_prob(model_dict['P_f'], target_labels, device) / tasks_per_batch + model_dict['L_r_f'])
+            yield aggregate_prob_accuracy(model_dict['posterior'], target_labels).item(), loss.item()
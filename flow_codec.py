@@ -0,0 +1,72 @@
+"""Storage formats for optical flow frames.
+
+Flow is extracted at 256 x 256 and the loader only uses the [8:232, 8:232] window, so compact formats store that
+window only, as float16, or as uint8 after clipping to [-bound, bound] and scaling to [0, 255] (the usual TV-L1
+convention). The format of a stored frame is given by its dtype; the bound of a uint8 dataset is recorded in
+FLOW_FORMAT_FILE at the dataset root.
+"""
+import json
+import os
+
+import numpy as np
+
+FLOW_CROP_OFFSET = 8
+FLOW_CROP_SIZE = 224
+FLOW_BOUND = 20.0
+FLOW_FORMATS = ("float32", "float16", "uint8")
+FLOW_FORMAT_FILE = "flow_format.json"
+
+
+def crop_flow(flow):
+    """ the 224 x 224 window of a flow frame (or of the last two axes of a stack), if not already cropped """
+    if flow.shape[-1] > FLOW_CROP_SIZE or flow.shape[-2] > FLOW_CROP_SIZE:
+        end = FLOW_CROP_OFFSET + FLOW_CROP_SIZE
+        flow = flow[..., FLOW_CROP_OFFSET:end, FLOW_CROP_OFFSET:end]
+    return flow
+
+
+def encode_flow(flow, flow_format="uint8", bound=FLOW_BOUND, crop=True):
+    """ float flow -> stored array in flow_format ("float32", "float16" or "uint8") """
+    if crop:
+        flow = crop_flow(flow)
+    if flow_format == "float32":
+        return np.ascontiguousarray(flow, dtype=np.float32)
+    if flow_format == "float16":
+        return np.ascontiguousarray(flow, dtype=np.float16)
+    if flow_format == "uint8":
+        scaled = (np.clip(flow, -bound, bound) + bound) * (255.0 / (2 * bound))
+        return np.ascontiguousarray(np.round(scaled), dtype=np.uint8)
+    raise ValueError("unknown flow format {}, expected one of {}".format(flow_format, FLOW_FORMATS))
+
+
+def decode_flow(stored, bound=FLOW_BOUND, out=None):
+    """ stored array -> float32 flow, written into out (float32, or float16 for a compact copy) if given """
+    if out is None and stored.dtype == np.float32:
+        return stored
+    if out is None:
+        out = np.empty(stored.shape, dtype=np.float32)
+    if stored.dtype == np.uint8:
+        np.multiply(stored, np.float32(2 * bound / 255.0), out=out)
+        out -= np.float32(bound)
+    else:
+        out[...] = stored
+    return out
+
+
+def write_flow_format(root, flow_format, bound=FLOW_BOUND):
+    with open(os.path.join(root, FLOW_FORMAT_FILE), "w") as f:
+        json.dump({"format": flow_format, "bound": bound, "crop": FLOW_CROP_SIZE}, f)
+
+
+def read_flow_format(root):
+    """ contents of the FLOW_FORMAT_FILE of a dataset, None if it has none """
+    try:
+        with open(os.path.join(root, FLOW_FORMAT_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_flow_bound(root):
+    """ uint8 quantisation bound recorded for a dataset, FLOW_BOUND if none is """
+    return float((read_flow_format(root) or {}).get("bound", FLOW_BOUND))
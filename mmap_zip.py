@@ -0,0 +1,148 @@
+"""Read-only zip archive backed by mmap, for the zip mode of VideoDataset. """
+import io
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+
+import numpy as np
+
+# zip local file header: signature, version, flags, compression, time, date, crc, sizes, name and extra lengths
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+
+
+class _MemberFile(io.RawIOBase):
+    """Seekable file object over one stored member, reading straight out of the mapping. """
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError("invalid whence {}".format(whence))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class MmapZip():
+    """
+    The archive is mapped read-only and indexed once (member name -> data offset and sizes). Members are then read
+    by offset from the mapping, so every DataLoader worker shares the same page cache pages instead of holding its
+    own copy of the archive. Stored (uncompressed) members are not copied at all; deflated ones are inflated per read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+        self._names = []
+        self.members = {} # name -> (data offset, compressed size, size, compress type)
+        with open(path, 'rb') as f, zipfile.ZipFile(f) as zf:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for info in zf.infolist():
+                    self._names.append(info.filename)
+                    if info.is_dir():
+                        continue
+                    header = _LOCAL_HEADER.unpack_from(mm, info.header_offset)
+                    if header[0] != zipfile.stringFileHeader:
+                        raise zipfile.BadZipFile("bad local file header for {} in {}".format(info.filename, path))
+                    name_len, extra_len = header[-2], header[-1]
+                    offset = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+                    self.members[info.filename] = (offset, info.compress_size, info.file_size, info.compress_type)
+            except BaseException:
+                mm.close()
+                raise
+        self._mm = mm
+
+    def __getstate__(self):
+        # mappings cannot be pickled (spawned workers); they map the file again on first read
+        state = self.__dict__.copy()
+        state["_mm"] = None
+        return state
+
+    def _mapping(self):
+        if self._mm is None:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def namelist(self):
+        return list(self._names)
+
+    def read(self, name):
+        """ member bytes: a memoryview into the mapping for stored members, inflated bytes otherwise """
+        offset, compress_size, size, compress_type = self.members[name]
+        view = memoryview(self._mapping())[offset:offset + compress_size]
+        if compress_type == zipfile.ZIP_STORED:
+            return view
+        if compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(view, -zlib.MAX_WBITS, size)
+        raise NotImplementedError("unsupported zip compression {} for {}".format(compress_type, name))
+
+    def open(self, name):
+        """ file object for a member, e.g. for PIL.Image.open """
+        data = self.read(name)
+        if isinstance(data, memoryview):
+            return _MemberFile(data)
+        return io.BytesIO(data)
+
+    def fetch(self, name):
+        """
+        member bytes copied out of the archive with a positional read instead of through the mapping, so that I/O
+        threads wait for the storage without holding the GIL
+        """
+        offset, compress_size, size, compress_type = self.members[name]
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, compress_size, offset)
+            while len(data) < compress_size:
+                more = os.pread(fd, compress_size - len(data), offset + len(data))
+                if not more:
+                    raise IOError("unexpected end of {} reading {}".format(self.path, name))
+                data += more
+        finally:
+            os.close(fd)
+        if compress_type == zipfile.ZIP_STORED:
+            return data
+        if compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS, size)
+        raise NotImplementedError("unsupported zip compression {} for {}".format(compress_type, name))
+
+    def load_npy(self, name):
+        """ load a .npy member; for stored members the array is a read-only view of the mapping """
+        return npy_from_buffer(self.read(name))
+
+
+def npy_from_buffer(data):
+    """ array stored in .npy bytes, as a read-only view of them when the format allows it """
+    f = _MemberFile(memoryview(data))
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        return np.load(io.BytesIO(data))
+    count = int(np.prod(shape)) if shape else 1
+    array = np.frombuffer(data, dtype=dtype, count=count, offset=f.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
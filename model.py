@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from collections import OrderedDict
 from utils import split_first_dim_linear
 import math
@@ -419,6 +420,20 @@ class MLP_Mix_Enrich(nn.Module):
 
         return out
 
+class InputPreprocess(nn.Module):
+    """
+        Converts clips sent by the loader in compact form (VideoDataset with --compact_transport: uint8 RGB frames
+        and float16 flow) to the float32 inputs of the backbones, once, on the device the model runs on.
+        uint8 frames are scaled to [0, 1] as ToTensor does; float32 inputs pass through unchanged.
+    """
+    def forward(self, images=None, flows=None):
+        if images is not None and images.dtype == torch.uint8:
+            images = images.float().div_(255)
+        if flows is not None and flows.dtype != torch.float32:
+            flows = flows.float()
+        return images, flows
+
+
 class CNN_STRM(nn.Module):
     """
         Standard Video Backbone connected to a Temporal Cross Transformer, Query Distance 
@@ -457,6 +472,8 @@ class CNN_STRM(nn.Module):
         # MLP-mixing frame-level enrichment over the 8 frames.
         self.fr_enrich = MLP_Mix_Enrich(self.args.trans_linear_in_dim, self.args.seq_len)
 
+        self.preprocess = InputPreprocess()
+
     def forward(self, context_images, context_labels, target_images):
 
         '''
@@ -465,6 +482,8 @@ class CNN_STRM(nn.Module):
         '''
             context_images: 200 x 3 x 224 x 224, target_images = 160 x 3 x 224 x 224
         '''
+        context_images, _ = self.preprocess(context_images)
+        target_images, _ = self.preprocess(target_images)
         context_features = self.resnet(context_images) # 200 x 2048 x 7 x 7
         target_features = self.resnet(target_images) # 160 x 2048 x 7 x 7
 
@@ -492,8 +511,6 @@ class CNN_STRM(nn.Module):
         context_features = context_features.reshape(-1, self.args.seq_len, self.args.trans_linear_in_dim) # 25 x 8 x 2048
         target_features = target_features.reshape(-1, self.args.seq_len, self.args.trans_linear_in_dim) # 20 x 8 x 2048
 
-        print("Context Features: ", context_features.shape)
-        print("Target Features: ", target_features.shape)
 
         # Compute logits using the new loss before applying frame-level attention
         all_logits_post_pat = [n(context_features, context_labels, target_features)['logits'] for n in self.new_dist_loss_post_pat]
@@ -507,8 +524,6 @@ class CNN_STRM(nn.Module):
         context_features_fr = self.fr_enrich(context_features) # 25 x 8 x 2048
         target_features_fr = self.fr_enrich(target_features) # 20 x 8 x 2048
 
-        print("Context Features Frame level: ", context_features_fr.shape)
-        print("Target Features Frame level: ", target_features_fr.shape)
 
         '''
             For different temporal lengths(2, 3, ...) get the final logits and perform mean.
@@ -546,6 +561,17 @@ class CNN_STRM(nn.Module):
 
 
 
+# children of the ResNet trunk of RGB_Strm_Backbone, and I3D end points of Flow_i3d_backbone, that can be frozen
+RESNET_STAGES = ("conv1", "bn1", "relu", "maxpool", "layer1", "layer2", "layer3", "layer4")
+I3D_STAGES = InceptionI3d.VALID_ENDPOINTS[:InceptionI3d.VALID_ENDPOINTS.index("Mixed_5c") + 1]
+
+
+def class_prototypes(features, labels, way):
+    """ mean of the rows of features (n x dim) with each label 0..way-1, a way x dim tensor """
+    one_hot = F.one_hot(labels.long(), num_classes=way).to(features.dtype) # n x way
+    return (one_hot.t() @ features) / one_hot.sum(dim=0).unsqueeze(1)
+
+
 class RGB_Strm_Backbone(nn.Module):   
     '''
     Input: 
@@ -576,61 +602,61 @@ class RGB_Strm_Backbone(nn.Module):
         # MLP-mixing frame-level enrichment over the 8 frames.
         self.fr_enrich = MLP_Mix_Enrich(self.args.trans_linear_in_dim, self.args.seq_len)
 
+        # leading children of self.resnet frozen by freeze_prefix
+        self.frozen_stages = 0
+
                    
-    def forward(self, context_feature,context_labels, target_feature):
-         
-        context_features = self.resnet(context_feature) # 200 x 2048 x 7 x 7
-        target_features = self.resnet(target_feature) # 160 x 2048 x 7 x 7
+    def forward(self, context_feature,context_labels, target_feature, activations=False):
+        context_features = self.embed(context_feature, activations) # 25 x 2048
+        target_features = self.embed(target_feature, activations) # 20 x 2048
+        return {'context_features': self.prototypes(context_features, context_labels), 
+                    'target_features': target_features}
+
+    def freeze_prefix(self, stage):
+        """ Freeze the ResNet up to and including stage (one of RESNET_STAGES): no gradients, fixed BatchNorm statistics. """
+        self.frozen_stages = RESNET_STAGES.index(stage) + 1
+        self.resnet[:self.frozen_stages].requires_grad_(False)
+        self.train(self.training)
+
+    def train(self, mode=True):
+        super(RGB_Strm_Backbone, self).train(mode)
+        self.resnet[:self.frozen_stages].eval()
+        return self
+
+    def prefix(self, images):
+        """ activations of the frozen stages for frames (n_clips * seq_len) x 3 x H x W """
+        return self.resnet[:self.frozen_stages](images)
+
+    def embed(self, images, activations=False):
+        """
+        Video-level features of clips given as their frames, clip after clip: (n_clips * seq_len) x 3 x H x W.
+        Clips are embedded independently of each other, so they can be embedded once and reused across episodes.
+        With activations, images are the prefix() activations of the frames and only the later stages run.
+        """
+        features = self.resnet[self.frozen_stages if activations else 0:](images) # 200 x 2048 x 7 x 7
             # Decrease to 4 x 4 = 16 patches
-        context_features = self.adap_max(context_features) # 200 x 2048 x 4 x4
-        target_features = self.adap_max(target_features)    # 160 x 2048 x 4x 4
+        features = self.adap_max(features) # 200 x 2048 x 4x 4
             # Reshape before averaging across all the patches
-        context_features = context_features.reshape(-1, 2048, self.num_patches) # 200 x 2048 x 16  
-        target_features = target_features.reshape(-1, 2048, self.num_patches)   
+        features = features.reshape(-1, 2048, self.num_patches) # 200 x 2048 x 16  
         
             # Permute before passing to the self-attention layer
-        context_features = context_features.permute(0, 2, 1) # 200 x 16 x 2048
-        target_features = target_features.permute(0, 2, 1)
+        features = features.permute(0, 2, 1) # 200 x 16 x 2048
             # Average across the patches 
             
-        context_features = self.attn_pat(context_features) # 200 x 16 x 2048 
-        target_features = self.attn_pat(target_features) # 160 x 16 x 2048
-        
-        context_features = torch.mean(context_features, dim = 1) # 200 x 2048 
-        target_features = torch.mean(target_features, dim = 1) # 200 x 2048
+        features = self.attn_pat(features) # 200 x 16 x 2048 
         
+        features = torch.mean(features, dim = 1) # 200 x 2048 
 
-        # Reshaping before passing to the Cross-Transformer and computing the distance after patch-enrichment as well
-        context_features = context_features.reshape(-1, self.args.seq_len, self.args.trans_linear_in_dim) # 25 x 8 x 2048
-        target_features = target_features.reshape(-1, self.args.seq_len, self.args.trans_linear_in_dim) # 25 x 8 x 2048
-
-
+        # Reshaping before the frame-level enrichment
+        features = features.reshape(-1, self.args.seq_len, self.args.trans_linear_in_dim) # 25 x 8 x 2048
         
+        features = self.fr_enrich(features) # 25 x 8 x 2048
         
-        context_features = self.fr_enrich(context_features) # 25 x 8 x 2048
-        target_features = self.fr_enrich(target_features) # 20 x 8 x 2048
-        
-        target_features = target_features.mean(dim=1) # 20 x 2048
-        context_features = context_features.mean(dim=1) # 25 x 2048
-        print("Context Features video level: ", context_features.shape)
-        print("Target Features video level: ", target_features.shape)
-        # 我要把每个class对应的vieo的特征做平均，作为class的特征
-        # todo, based on context_labels的值，把context_features分成5类，然后求平均
-        context_group = zip(context_features, context_labels)
-        context_group = list(context_group)
-        context_group = sorted(context_group, key=lambda x: x[1])
-        context_features, context_labels = zip(*context_group)
-        context_features = torch.stack(context_features)
-        context_labels = torch.stack(context_labels)
-        print("context_features zip shape", context_features.shape)
-        context_features = context_feature.reshape(self.args.way, -1, self.args.trans_linear_in_dim)
-        context_features = context_features.mean(dim=1)
-        # context_group = list(zip(context_features, context_labels))
-        # import random
-        # random.shuffle(context_group)
-        # context_features, context_labels = zip(*context_group)
-        return {'context_features': context_features, 
-                    'target_features': target_features}
+        return features.mean(dim=1) # 25 x 2048
+
+    def prototypes(self, context_features, context_labels):
+        """ class prototypes: the mean of the video-level features of each class, in the order of the labels 0..way-1 """
+        return class_prototypes(context_features, context_labels, self.args.way)
     
     
     def distribute_model(self):
@@ -650,35 +676,58 @@ class Flow_i3d_backbone(nn.Module):
         self.i3d = InceptionI3d(400, in_channels=2)
         self.i3d.replace_logits(157)
         self.i3d.load_state_dict(torch.load('model/flow_charades.pt'))
+        # last I3D end point frozen by freeze_prefix, and the end points up to it
+        self.frozen_stage = None
+        self.frozen_end_points = []
 
         
-    def forward(self, context_feature, context_labels, target_feature):
-        # batch, lengh, channel, height, width -> batch, channel, length, height, width
-        print("context_feature", context_feature.shape) # 25 x 7 x 2 x 224 x 224
-        # for input size > 8: 7 -> 9
-        context_feature = torch.cat((context_feature[:, 0:1, :, :, :], context_feature, context_feature[:, 6:7, :, :, :]), 1)
-        target_feature = torch.cat((target_feature[:, 0:1, :, :, :], target_feature, target_feature[:, 6:7, :, :, :]), 1)
-        context_feature = context_feature.permute(0, 2, 1, 3, 4)
-        target_feature = target_feature.permute(0, 2, 1, 3, 4)
-        context_features = self.i3d.extract_features(context_feature)
-        context_features = context_features.squeeze()
-        target_features = self.i3d.extract_features(target_feature)
-        target_features = target_features.squeeze()
-        # 我要把每个class对应的vieo的特征做平均，作为class的特征
-        # todo, based on context_labels的值，把context_features分成5类，然后求平均
-        context_group = zip(context_features, context_labels)
-        context_group = list(context_group)
-        context_group = sorted(context_group, key=lambda x: x[1])
-        context_features, context_labels = zip(*context_group)
-        context_features = torch.stack(context_features)
-        context_labels = torch.stack(context_labels)
-        context_features = context_feature.reshape(self.args.way, -1, 1024)
-        context_features = context_features.mean(dim=1)
-
-
-        return {'context_features': context_features, 
+    def forward(self, context_feature, context_labels, target_feature, activations=False):
+        context_features = self.embed(context_feature, activations) # 25 x 1024
+        target_features = self.embed(target_feature, activations) # 20 x 1024
+        return {'context_features': self.prototypes(context_features, context_labels), 
                     'target_features': target_features}
 
+    def freeze_prefix(self, stage):
+        """ Freeze the I3D up to and including end point stage (one of I3D_STAGES): no gradients, fixed BatchNorm statistics. """
+        end_points = [e for e in InceptionI3d.VALID_ENDPOINTS if e in self.i3d.end_points]
+        self.frozen_stage = stage
+        self.frozen_end_points = end_points[:end_points.index(stage) + 1]
+        for end_point in self.frozen_end_points:
+            self.i3d._modules[end_point].requires_grad_(False)
+        self.train(self.training)
+
+    def train(self, mode=True):
+        super(Flow_i3d_backbone, self).train(mode)
+        for end_point in self.frozen_end_points:
+            self.i3d._modules[end_point].eval()
+        return self
+
+    def clip_input(self, flows):
+        """ I3D input of flow clips batch x length x 2 x H x W """
+        # for input size > 8: 7 -> 9
+        flows = torch.cat((flows[:, 0:1, :, :, :], flows, flows[:, 6:7, :, :, :]), 1)
+        # batch, lengh, channel, height, width -> batch, channel, length, height, width
+        return flows.permute(0, 2, 1, 3, 4)
+
+    def prefix(self, flows):
+        """ activations of the frozen end points for flow clips batch x length x 2 x H x W """
+        return self.i3d.extract_features(self.clip_input(flows), end=self.frozen_stage)
+
+    def embed(self, flows, activations=False):
+        """
+        Video-level features of flow clips, batch x length x 2 x H x W, each embedded independently.
+        With activations, flows are the prefix() activations of the clips and only the later end points run.
+        """
+        if activations:
+            features = self.i3d.extract_features(flows, start=self.frozen_stage)
+        else:
+            features = self.i3d.extract_features(self.clip_input(flows))
+        return features.reshape(features.size(0), -1) # 25 x 1024
+
+    def prototypes(self, context_features, context_labels):
+        """ class prototypes: the mean of the video-level features of each class, in the order of the labels 0..way-1 """
+        return class_prototypes(context_features, context_labels, self.args.way)
+
     def distribute_model(self):
         """
         Distributes the CNNs over multiple GPUs.
@@ -708,8 +757,8 @@ class AAS(nn.Module):
         # print(target_rgb_features.shape)
         # print(target_flow_features.shape)
         
-        p_r, c_r, h_r = self.rgb_Posterior(context_rgb_features, target_rgb_features)
-        p_f, c_f, h_f = self.flow_Posterior(context_flow_features, target_flow_features)
+        p_r, c_r, h_r, d_r = self.rgb_Posterior(context_rgb_features, target_rgb_features)
+        p_f, c_f, h_f, d_f = self.flow_Posterior(context_flow_features, target_flow_features)
         # For each query sample, if a specific modality achieves high absolute certainty and relative certainty, this modality is re- liable enough to express discriminative action characteris- tic in the few-shot task. Conversely, if the certainty is low, the modality is probably unreliable to identify actions in the few-shot task. To facilitate the exploring of cross-modal complementarity, we select query samples with large differ- ences in the reliability of two modalities and organize them into two group
         # To facilitate the exploring of cross-modal complementarity, we select query samples with large differ- ences in the reliability of two modalities and organize them into two groups:
         # Q_r = {(x_i^r, x_i^f) | h_i^r > h_i^f, c_i^r > c_i^f}
@@ -722,7 +771,7 @@ class AAS(nn.Module):
                 Q_r.append((target_rgb_features[i], target_flow_features[i]))
             else:
                 Q_f.append((target_rgb_features[i], target_flow_features[i]))
-        return {"Q_r": Q_r, "Q_f": Q_f, "p_r": p_r, "c_r": c_r, "h_r": h_r, "p_f": p_f, "c_f": c_f, "h_f": h_f}
+        return {"Q_r": Q_r, "Q_f": Q_f, "p_r": p_r, "c_r": c_r, "h_r": h_r, "d_r": d_r, "p_f": p_f, "c_f": c_f, "h_f": h_f, "d_f": d_f}
 
 class ModalitySpecificPosterior(nn.Module):
     def __init__(self, args):
@@ -738,29 +787,21 @@ class ModalitySpecificPosterior(nn.Module):
             class_prototypes: Tensor of shape (num_classes, feature_dim) containing the class prototypes.
         Returns:
             posterior: Tensor of shape (num_queries, num_classes) containing the posterior distribution for each query sample.
+            c, h: Tensors of shape (num_queries,) containing the absolute and relative certainty of each query sample.
+            distance: Tensor of shape (num_queries, num_classes) containing the query-prototype distances (reused by AMI).
         """
-        print("query_features", query_features)
-        print("class_prototypes", class_prototypes)
-
-        num_queries = query_features.size(0)
-        num_classes = class_prototypes.size(0)
-        posterior = torch.zeros(num_queries, num_classes)
+        # all query-prototype distances at once; psi adds eps to each difference, as does shifting the queries by it
+        distance = torch.cdist(query_features + self.psi.eps, class_prototypes, p=2, compute_mode="donot_use_mm_for_euclid_dist")
+        # exp(-distance) normalised over the classes, in log space: far queries would underflow exp(-distance) to 0 for every class
+        log_posterior = F.log_softmax(-distance, dim=1)
+        posterior = log_posterior.exp()
 
-        
-        for i in range(num_queries):
-            for k in range(num_classes):
-                distance = self.psi(query_features[i], class_prototypes[k])
-                posterior[i, k] = torch.exp(-distance)
-        posterior = posterior / torch.sum(posterior, dim=1, keepdim=True)
-        
         # We define the absolute certainty c_m^i as the maximum element of the modality-specific posterior distribution:
         c = torch.max(posterior, dim=1)[0]
 
-        # print("c", c)
-        # print("posterior", posterior)
         # we define the relative certainty h_m^i as the nega- tive self-entropy of the modality-specific posterior distribu- tion:
-        h = -torch.sum(posterior * torch.log(posterior), dim=1)
-        return posterior, c, h
+        h = -torch.sum(posterior * log_posterior, dim=1)
+        return posterior, c, h, distance
 
 class AMD(nn.Module):
     def __init__(self, args):
@@ -804,24 +845,24 @@ class AMI(nn.Module):
         super(AMI, self).__init__()
         self.args = args
     def forward(self, x, output_AAS):
-        context_rgb_features = x['context_rgb_features']
-        context_flow_features = x['context_flow_features']
-        target_rgb_features = x['target_rgb_features']
-        target_flow_features = x['target_flow_features']
+        """
+        Fuse the modalities: the posterior of query i over class k is proportional to
+        w_r^i * exp(-d_r^ik) + w_f^i * exp(-d_f^ik), with w_m^i = c_m^i / (c_r^i + c_f^i).
+        The distances d_r and d_f are those AAS computed for the modality-specific posteriors (x is not read again).
+        Returns:
+            posterior: Tensor of shape (num_queries, num_classes).
+        """
         c_r = output_AAS['c_r']
         c_f = output_AAS['c_f']
-        w_r = c_r / (c_r + c_f)
-        w_f = c_f / (c_r + c_f)
-        num_queries = target_rgb_features.size(0)
-        num_classes = context_rgb_features.size(0)
-        posterior = torch.zeros(num_queries, num_classes)
-
-        for i in range(num_queries):
-            for k in range(num_classes):
-                distance_rgb = torch.nn.PairwiseDistance(p=2)(target_rgb_features[i], context_rgb_features[k])
-                distance_flow = torch.nn.PairwiseDistance(p=2)(target_flow_features[i], context_flow_features[k])
-                posterior[i, k] = w_r[i] * torch.exp(-distance_rgb) + w_f[i] * torch.exp(-distance_flow)
-        posterior = posterior / torch.sum(posterior, dim=1, keepdim=True)
+        d_r = output_AAS['d_r']
+        d_f = output_AAS['d_f']
+        # log w_m, broadcast over the classes
+        log_c = torch.log(c_r + c_f)
+        log_w_r = (torch.log(c_r) - log_c).unsqueeze(1)
+        log_w_f = (torch.log(c_f) - log_c).unsqueeze(1)
+        # log(w_r * exp(-d_r) + w_f * exp(-d_f)), normalised over the classes, in log space: exp(-d) underflows for far queries
+        log_posterior = torch.logaddexp(log_w_r - d_r, log_w_f - d_f)
+        posterior = F.softmax(log_posterior, dim=1)
         return posterior
 
 class AMFAR(nn.Module):
@@ -833,6 +874,7 @@ class AMFAR(nn.Module):
         self.AAS = AAS(args)
         self.AMD = AMD(args)
         self.AMI = AMI(args)
+        self.preprocess = InputPreprocess()
     def forward(self, x):
         #  model_input = {"context_rgb_features": context_images, "context_flow_features": context_flow_images, "context_labels": context_labels, "target_rgb_features": target_images, "target_flow_features": target_flow_images}
 
@@ -843,16 +885,30 @@ class AMFAR(nn.Module):
         target_rgb_features = x['target_rgb_features']
         target_flow_features = x['target_flow_features']
         context_labels = x['context_labels']
-        Features_rgb = self.rgb_backbone(context_rgb_features, context_labels, target_rgb_features)
+        # with rgb_activations / flow_activations, the inputs are the activations of the frozen backbone prefixes
+        rgb_activations = x.get('rgb_activations', False)
+        flow_activations = x.get('flow_activations', False)
+        context_rgb_features, context_flow_features = self.preprocess(context_rgb_features, context_flow_features)
+        target_rgb_features, target_flow_features = self.preprocess(target_rgb_features, target_flow_features)
+        Features_rgb = self.rgb_backbone(context_rgb_features, context_labels, target_rgb_features, rgb_activations)
         context_rgb_features, target_rgb_features = Features_rgb['context_features'], Features_rgb['target_features']
-        Features_flow = self.flow_backbone(context_flow_features, context_labels, target_flow_features)
+        Features_flow = self.flow_backbone(context_flow_features, context_labels, target_flow_features, flow_activations)
         context_flow_features, target_flow_features = Features_flow['context_features'], Features_flow['target_features']
         x_features = {"context_rgb_features": context_rgb_features, "context_flow_features": context_flow_features, "target_rgb_features": target_rgb_features, "target_flow_features": target_flow_features}
+        return self.score(x_features)
+
+    def freeze_prefix(self, rgb_stage=None, flow_stage=None):
+        """ Freeze the backbones up to the given stages (see RGB_Strm_Backbone.freeze_prefix, Flow_i3d_backbone.freeze_prefix). """
+        if rgb_stage:
+            self.rgb_backbone.freeze_prefix(rgb_stage)
+        if flow_stage:
+            self.flow_backbone.freeze_prefix(flow_stage)
 
+    def score(self, x_features):
+        """ losses and posteriors of an episode from its class prototypes and query features, as the backbones return them """
         output_AAS = self.AAS(x_features)
         P_r = output_AAS['p_r']
         P_f = output_AAS['p_f']
-        print("Shapes------", P_r.shape, P_f.shape, output_AAS['c_r'].shape, output_AAS['c_f'].shape, context_rgb_features.shape, context_flow_features.shape, target_rgb_features.shape, target_flow_features.shape)
         L_f_r, L_r_f = self.AMD(output_AAS)
         posterior = self.AMI(x_features,output_AAS)
         return {"L_f_r": L_f_r, "L_r_f": L_r_f, "P_f": P_f, "P_r": P_r, "posterior": posterior}
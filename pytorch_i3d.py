@@ -331,10 +331,20 @@ class InceptionI3d(nn.Module):
         return logits
         
 
-    def extract_features(self, x):
+    def extract_features(self, x, start=None, end=None):
+        """
+        Pooled features of x. With start, x is the output of end point start and only the later end points run;
+        with end, the output of end point end is returned, before pooling.
+        """
+        running = start is None
         for end_point in self.VALID_ENDPOINTS:
             if end_point in self.end_points:
-                x = self._modules[end_point](x)
+                if running:
+                    x = self._modules[end_point](x)
+                if end_point == end:
+                    return x
+                if end_point == start:
+                    running = True
         return self.avg_pool(x)
     
 if __name__ == '__main__':
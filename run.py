@@ -4,7 +4,7 @@ import argparse
 import os
 import pickle
 from utils import print_and_log, get_log_files, TestAccuracies, loss, aggregate_accuracy, verify_checkpoint_dir, task_confusion, loss_prob, aggregate_prob_accuracy
-from model import CNN_STRM, AMFAR
+from model import CNN_STRM, AMFAR, RESNET_STAGES, I3D_STAGES
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # Quiet TensorFlow warnings
 import tensorflow as tf
 
@@ -12,6 +12,10 @@ from torch.optim.lr_scheduler import MultiStepLR
 from torch.utils.tensorboard import SummaryWriter
 import torchvision
 import video_reader
+from episode_loader import EpisodeLoader
+from episode_manifest import generate_episodes
+import feature_eval
+from activation_cache import CACHE_DTYPES, PrefixCache
 import random 
 
 import logging
@@ -68,7 +72,15 @@ class Learner:
         self.train_set, self.validation_set, self.test_set = self.init_data()
 
         self.vd = video_reader.VideoDataset(self.args)
-        self.video_loader = torch.utils.data.DataLoader(self.vd, batch_size=1, num_workers=self.args.num_workers)
+        if self.args.episode_buffer_bytes:
+            # prefetch as many episodes as fit in the memory budget, whatever their size
+            self.video_loader = EpisodeLoader(self.vd, self.args.num_workers, self.args.episode_buffer_bytes)
+        else:
+            # the frame cache is inherited by forked workers only, whatever the default start method
+            context = "fork" if self.vd.frame_cache is not None and self.args.num_workers > 0 else None
+            self.video_loader = torch.utils.data.DataLoader(self.vd, batch_size=1, num_workers=self.args.num_workers,
+                                                            prefetch_factor=self.args.prefetch_factor if self.args.num_workers > 0 else None,
+                                                            multiprocessing_context=context)
         self.loss = loss_prob
         self.accuracy_fn = aggregate_prob_accuracy
         
@@ -90,9 +102,17 @@ class Learner:
             self.load_checkpoint()
         self.optimizer.zero_grad()
 
+        # activations of the frozen backbone layers, computed once per training video
+        self.prefix_cache = None
+        if self.args.activation_cache_dir:
+            self.prefix_cache = PrefixCache(self.model, self.args.activation_cache_dir, self.vd, self.device, self.args.activation_cache_dtype)
+            # the loader workers stop decoding the inputs of the videos as their activations are stored
+            self.vd.use_prefix_cache(self.prefix_cache.store.done, self.prefix_cache.rgb, self.prefix_cache.flow)
+
     def init_model(self):
         # model = CNN_STRM(self.args)
         model = AMFAR(self.args)
+        model.freeze_prefix(self.args.freeze_rgb_stage, self.args.freeze_flow_stage)
         model = model.to(self.device) 
         # if self.args.num_gpus > 1:
         #     model.distribute_model()
@@ -138,6 +158,30 @@ class Learner:
         parser.add_argument("--num_gpus", type=int, default=1, help="Number of GPUs to split the ResNet over")
         parser.add_argument("--debug_loader", default=False, action="store_true", help="Load 1 vid per class for debugging")
         parser.add_argument("--split", type=int, default=7, help="Dataset split.")
+        parser.add_argument("--manifest_dir", default=None, help="Directory for cached dataset manifests (default ~/.cache/cse455_final/manifests).")
+        parser.add_argument("--rebuild_manifest", default=False, action="store_true", help="Re-list the dataset tree and overwrite its cached manifest, needed after frames are added, removed or re-extracted inside existing video folders.")
+        parser.add_argument("--no_manifest_cache", default=False, action="store_true", help="Always list the dataset tree, never read or write a manifest.")
+        parser.add_argument("--dataset_index", default=None, help="Index the dataset tree from this verified index (scripts/fsck_dataset.py --index) instead of listing it; only the videos that passed the checks are used.")
+        parser.add_argument("--video_dir", default=None, help="Read clips straight from the <class>/<video>.avi (or .mp4, ...) files under this directory instead of the dataset's frames, computing flow on the fly (needs OpenCV).")
+        parser.add_argument("--decoder", choices=["pil", "pil_draft", "torchvision"], default="pil", help="JPEG decoder: PIL at full size, PIL at a reduced scale when frames are resized down (Image.draft), or torchvision batched per clip.")
+        parser.add_argument("--transform_backend", choices=["pil", "tensor"], default="pil", help="Augment frames one PIL image at a time, or as one uint8 clip tensor.")
+        parser.add_argument("--compact_transport", default=False, action="store_true", help="Send uint8 frames and float16 flow from the loader workers; the model converts them.")
+        parser.add_argument("--prefetch_factor", type=int, default=2, help="Episodes prefetched by each loader worker.")
+        parser.add_argument("--episode_buffer_bytes", type=int, default=0, help="Prefetch episodes while they fit in this many bytes, instead of prefetch_factor per worker (0 uses a DataLoader).")
+        parser.add_argument("--io_threads", type=int, default=0, help="Threads per loader worker reading the files of an episode ahead of decoding (0 reads them serially).")
+        parser.add_argument("--sampler_class_window", type=int, default=0, help="Draw training episodes from a window of this many classes moving through the split (0 draws from all classes).")
+        parser.add_argument("--sampler_video_window", type=int, default=20, help="Videos per class in the window of --sampler_class_window.")
+        parser.add_argument("--sampler_shift_every", type=int, default=100, help="Episodes between moves of the class window.")
+        parser.add_argument("--episode_manifest", default=None, help="Replay the episodes of this manifest (scripts/make_episode_manifest.py) instead of random ones, for the split it was made for.")
+        parser.add_argument("--episode_range", nargs=2, type=int, default=None, metavar=("START", "STOP"), help="Replay only episodes START to STOP of --episode_manifest.")
+        parser.add_argument("--feature_eval_dir", default=None, help="With --test_model_only, embed every test video once into this directory and score the test episodes from the stored features.")
+        parser.add_argument("--freeze_rgb_stage", choices=RESNET_STAGES, default=None, help="Freeze the ResNet up to and including this stage, e.g. layer3.")
+        parser.add_argument("--freeze_flow_stage", choices=I3D_STAGES, default=None, help="Freeze the I3D up to and including this end point, e.g. Mixed_4f.")
+        parser.add_argument("--activation_cache_dir", default=None, help="Store the activations of the frozen backbone layers of each training video here and train from them; training clips are then not augmented.")
+        parser.add_argument("--activation_cache_dtype", choices=CACHE_DTYPES, default="uint8", help="Storage of the cached activations: uint8 quantised per channel, or float16.")
+        parser.add_argument("--eval_clip_store", default=None, help="Directory where the preprocessed test clips are stored on the first evaluation and read from by the later ones.")
+        parser.add_argument("--frame_cache_bytes", type=int, default=0, help="Bytes of shared memory for decoded frames shared by the loader workers (0 disables the cache).")
+        parser.add_argument("--frame_cache_slot_bytes", type=int, default=0, help="Largest frame the frame cache holds (default: a flow frame or the first RGB frame, whichever is larger).")
         parser.add_argument('--sch', nargs='+', type=int, help='iters to drop learning rate', default=[1000000])
         parser.add_argument("--test_model_only", type=bool, default=False, help="Only testing the model from the given checkpoint")
         parser.add_argument("--unimodal_iters", type=int, default=15000, help="Number of iterations to train unimodal model")
@@ -147,8 +191,8 @@ class Learner:
             args.scratch = "/mnt/storage/home2/tp8961/scratch"
         elif args.scratch == "bp":
             args.num_gpus = 4
-            # this is low becuase of RAM constraints for the data loader
-            args.num_workers = 3
+            # the dataset zip is memory-mapped and shared by all loader workers, so they can scale with the cores
+            args.num_workers = os.cpu_count() or args.num_workers
             args.scratch = "/work/tp8961"
         elif args.scratch == "new":
             args.scratch = "/data2/CSE455_final"
@@ -157,6 +201,10 @@ class Learner:
             print("need to specify a checkpoint dir")
             exit(1)
 
+        if args.activation_cache_dir and not (args.freeze_rgb_stage or args.freeze_flow_stage):
+            print("--activation_cache_dir needs --freeze_rgb_stage or --freeze_flow_stage")
+            exit(1)
+
         if (args.method == "resnet50") or (args.method == "resnet34"):
             args.img_size = 224
         if args.method == "resnet50":
@@ -178,6 +226,8 @@ class Learner:
             args.traintestlist = os.path.join(args.scratch, "video_datasets/splits/hmdb_ARN")
             args.path = os.path.join("/data3/cse455/hmdb51_org_256x256q5_rgb_flow")
             # args.path = os.path.join(args.scratch, "video_datasets/data/hmdb51_jpegs_256.zip")
+        if args.video_dir:
+            args.path = args.video_dir
 
         with open("args.pkl", "wb") as f:
             pickle.dump(args, f, pickle.HIGHEST_PROTOCOL)
@@ -198,7 +248,10 @@ class Learner:
                 if self.args.test_model_only:
                     print("Model being tested at path: " + self.args.test_model_path)
                     self.load_checkpoint()
-                    accuracy_dict = self.test(session, 1)
+                    if self.args.feature_eval_dir:
+                        accuracy_dict = self.test_features(1)
+                    else:
+                        accuracy_dict = self.test(session, 1)
                     print(accuracy_dict)
 
 
@@ -247,6 +300,13 @@ class Learner:
                         train_logger.info("For Task: {0}, the training loss is {1} and Training Accuracy is {2}".format(iteration + 1, torch.Tensor(losses).mean().item(),
                             torch.Tensor(train_accuracies).mean().item()))
 
+                        if isinstance(self.video_loader, EpisodeLoader):
+                            print_and_log(self.logfile, "Episode loader: {}".format(self.video_loader.summary()))
+                        if self.vd.frame_cache is not None:
+                            print_and_log(self.logfile, "Frame cache: {}".format(self.vd.frame_cache.summary()))
+                        if self.prefix_cache is not None:
+                            print_and_log(self.logfile, "Activation cache: {}".format(self.prefix_cache.summary()))
+
                         avg_train_acc = torch.Tensor(train_accuracies).mean().item()
                         avg_train_loss = torch.Tensor(losses).mean().item()
                         
@@ -288,6 +348,11 @@ class Learner:
 
 
         model_input = {"context_rgb_features": context_images, "context_flow_features": context_flow_images, "context_labels": context_labels, "target_rgb_features": target_images, "target_flow_features": target_flow_images}
+        if self.prefix_cache is not None:
+            # only the layers after the frozen ones run, from their cached input
+            model_input["context_rgb_features"], model_input["context_flow_features"] = self.prefix_cache.activations(context_images, context_flow_images, task_dict['support_vids'][0], task_dict['support_cached'][0])
+            model_input["target_rgb_features"], model_input["target_flow_features"] = self.prefix_cache.activations(target_images, target_flow_images, task_dict['target_vids'][0], task_dict['target_cached'][0])
+            model_input["rgb_activations"], model_input["flow_activations"] = self.prefix_cache.rgb, self.prefix_cache.flow
         model_dict = self.model(model_input)
         #     print("shape of out", out['L_f_r'].shape, out['L_r_f'].shape, out['P_f'].shape, out['P_r'].shape, out['posterior'].shape)
 
@@ -333,6 +398,11 @@ class Learner:
         with torch.no_grad():
 
                 self.video_loader.dataset.train = False
+                if self.vd.eval_clips is not None:
+                    # decodes the test clips the first time only, later evaluations read them preprocessed
+                    self.vd.build_eval_clips(log=lambda m: print_and_log(self.logfile, m))
+                if self.video_loader.dataset.replaying():
+                    eval_logger.info("Replaying {} episodes of {}".format(min(len(self.video_loader.dataset), self.args.num_test_tasks), self.args.episode_manifest))
                 accuracy_dict ={}
                 accuracies = []
                 losses = []
@@ -417,11 +487,7 @@ class Learner:
                         losses.append(task_loss.item())    
                         accuracies.append(accuracy)
 
-                accuracy = np.array(accuracies).mean() * 100.0
-                confidence = (196.0 * np.array(accuracies).std()) / np.sqrt(len(accuracies))
-                loss = np.array(losses).mean()
-                accuracy_dict[item] = {"accuracy": accuracy, "confidence": confidence, "loss": loss}
-                eval_logger.info("For Task: {0}, the testing loss is {1} and Testing Accuracy is {2}".format(num_episode, loss, accuracy))
+                accuracy_dict[item] = self.test_summary(num_episode, accuracies, losses)
 
                 self.video_loader.dataset.train = True
         self.model.train()
@@ -429,6 +495,38 @@ class Learner:
         return accuracy_dict
 
 
+    def test_features(self, num_episode):
+        """
+        Test of a frozen model from its video-level features: every test video is embedded once into the store in
+        --feature_eval_dir, then the episodes of --episode_manifest (or num_test_tasks seeded ones) are scored from it.
+        """
+        dataset = self.video_loader.dataset
+        store = feature_eval.open_store(self.args.feature_eval_dir, dataset, self.args.test_model_path)
+        feature_eval.embed_videos(self.model, dataset, store, self.device, log=lambda m: print_and_log(self.logfile, m))
+        if dataset.episode_manifest is not None and not dataset.episode_manifest.train:
+            manifest = dataset.episode_manifest
+        else:
+            manifest = generate_episodes(dataset, self.args.num_test_tasks, random.randrange(2 ** 31))
+        manifest = manifest.select(0, self.args.num_test_tasks)
+
+        accuracies = []
+        losses = []
+        for iteration, (accuracy, task_loss) in enumerate(feature_eval.score_episodes(self.model, store, manifest, self.device, self.args.tasks_per_batch)):
+            eval_logger.info("For Task: {0}, the testing loss is {1} and Testing Accuracy is {2}".format(iteration + 1, task_loss, accuracy))
+            accuracies.append(accuracy)
+            losses.append(task_loss)
+
+        self.model.train()
+        return {self.args.dataset: self.test_summary(num_episode, accuracies, losses)}
+
+    def test_summary(self, num_episode, accuracies, losses):
+        """ mean accuracy (%), its 95% confidence interval and mean loss over the test episodes, logged """
+        accuracy = np.array(accuracies).mean() * 100.0
+        confidence = (196.0 * np.array(accuracies).std()) / np.sqrt(len(accuracies))
+        loss = np.array(losses).mean()
+        eval_logger.info("For Task: {0}, the testing loss is {1} and Testing Accuracy is {2}".format(num_episode, loss, accuracy))
+        return {"accuracy": accuracy, "confidence": confidence, "loss": loss}
+
     def prepare_task(self, task_dict, images_to_device = True):
         # task_dict_shape torch.Size([1, 200, 3, 224, 224]) torch.Size([1, 25]) torch.Size([1, 160, 3, 224, 224]) torch.Size([1, 20]) torch.Size([1, 20]) torch.Size([1, 5])
         # context_images_shape torch.Size([200, 3, 224, 224]) torch.Size([25]) target_images_shape torch.Size([160, 3, 224, 224]) torch.Size([20]) context_labels_shape torch.Size([25]) target_labels_shape torch.Size([20]) real_target_labels_shape torch.Size([20]) batch_class_list_shape torch.Size([5])
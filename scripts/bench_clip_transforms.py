@@ -0,0 +1,73 @@
+"""
+Per-clip latency of the training and test transforms of VideoDataset, PIL backend (Compose over a list of PIL
+images, ToTensor per frame, torch.stack) against the tensor backend (one uint8 (T, C, H, W) clip through the
+videotransforms.tensor_transforms equivalents, then ClipToFloat), for the 84 and 224 pipelines.
+
+Both start from decoded frames, PIL images or (H, W, C) arrays, as the decoders return them. torch runs on one
+thread, as in a DataLoader worker.
+
+usage: python scripts/bench_clip_transforms.py --clips 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video_reader import VideoDataset
+
+
+def make_dataset(img_size, backend):
+    """ a VideoDataset with only its transforms set up """
+    dataset = VideoDataset.__new__(VideoDataset)
+    dataset.args = argparse.Namespace(transform_backend=backend)
+    dataset.img_size = img_size
+    dataset.tensor_transform = transforms.ToTensor()
+    dataset.setup_transforms()
+    return dataset
+
+
+def pil_clip(dataset, frames, mode):
+    imgs = [Image.fromarray(f) for f in frames]
+    t0 = time.perf_counter()
+    out = torch.stack([dataset.tensor_transform(v) for v in dataset.transform[mode](imgs)])
+    return time.perf_counter() - t0, out
+
+
+def tensor_clip(dataset, frames, mode):
+    t0 = time.perf_counter()
+    clip = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2)
+    out = dataset.clip_to_float(dataset.transform[mode](clip))
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clips", type=int, default=200, help="Clips transformed per measurement.")
+    parser.add_argument("--seq_len", type=int, default=8, help="Frames per clip.")
+    parser.add_argument("--frame_size", type=int, default=256, help="Side of the decoded frames.")
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    rng = np.random.RandomState(0)
+    clips = [[rng.randint(0, 256, (args.frame_size, args.frame_size, 3), dtype=np.uint8) for _ in range(args.seq_len)]
+             for _ in range(args.clips)]
+    for img_size in (84, 224):
+        for mode in ("train", "test"):
+            results = {}
+            for backend, fn in (("pil", pil_clip), ("tensor", tensor_clip)):
+                dataset = make_dataset(img_size, backend)
+                fn(dataset, clips[0], mode) # warm up
+                times = [fn(dataset, clip, mode)[0] for clip in clips]
+                results[backend] = np.median(times) * 1e3
+            print("img_size {:3d} {:>5}: pil {:6.2f} ms/clip, tensor {:6.2f} ms/clip ({:.2f}x)".format(
+                img_size, mode, results["pil"], results["tensor"], results["pil"] / results["tensor"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Frames/sec of the JPEG decoder backends of video_reader.py (--decoder pil, pil_draft, torchvision), for the 84
+and 224 pipelines: decoding only, and decoding followed by the training transforms and ToTensor as in get_seq.
+
+Frames are taken from --src (any tree of .jpg files, e.g. a dataset with class/video/img folders), or generated
+as smooth 256 x 256 JPEGs when it is not given.
+
+usage: python scripts/bench_decoders.py --src /data3/cse455/hmdb51_org_256x256q5_rgb_flow --frames 800
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from glob import glob
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video_reader import JPEG_DECODERS, VideoDataset, make_decoder
+
+
+def synthetic_frames(n, size=256):
+    rng = np.random.RandomState(0)
+    frames = []
+    for _ in range(n):
+        # low-frequency noise upsampled, closer to natural frames than white noise for the entropy coder
+        small = rng.randint(0, 256, (size // 16, size // 16, 3)).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(small).resize((size, size), Image.BILINEAR).save(buf, format="JPEG", quality=75)
+        frames.append(buf.getvalue())
+    return frames
+
+
+def load_frames(src, n):
+    paths = sorted(glob(os.path.join(src, "**", "*.jpg"), recursive=True))
+    random.Random(0).shuffle(paths)
+    frames = []
+    for path in paths[:n]:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default=None, help="Directory searched for .jpg frames (default: synthetic frames).")
+    parser.add_argument("--frames", type=int, default=800, help="Frames decoded per measurement.")
+    parser.add_argument("--seq_len", type=int, default=8, help="Frames per clip, decoded in one call.")
+    args = parser.parse_args()
+
+    frames = load_frames(args.src, args.frames) if args.src else synthetic_frames(args.frames)
+    clips = [frames[i:i + args.seq_len] for i in range(0, len(frames), args.seq_len)]
+    print("{} frames, {:.1f} KB/frame".format(len(frames), np.mean([len(f) for f in frames]) / 1024))
+
+    for img_size in (84, 224):
+        # only the transforms of the dataset are needed
+        dataset = VideoDataset.__new__(VideoDataset)
+        dataset.args, dataset.img_size = argparse.Namespace(), img_size
+        dataset.setup_transforms()
+        transform = dataset.transform["train"]
+        to_tensor = transforms.ToTensor()
+        for name in JPEG_DECODERS:
+            decoder = make_decoder(name, dataset.resize_size)
+            decoder.decode(clips[0]) # warm up
+            t0 = time.perf_counter()
+            for clip in clips:
+                imgs = decoder.decode(clip)
+            t_decode = time.perf_counter() - t0
+            decoded_size = imgs[0].size
+            t0 = time.perf_counter()
+            for clip in clips:
+                torch.stack([to_tensor(v) for v in transform(decoder.decode(clip))])
+            t_pipeline = time.perf_counter() - t0
+            print("img_size {:3d} {:>12}: decode {:7.0f} frames/s (to {}x{}), decode+transform {:7.0f} frames/s".format(
+                img_size, name, len(frames) / t_decode, decoded_size[0], decoded_size[1], len(frames) / t_pipeline))
+
+
+if __name__ == "__main__":
+    main()
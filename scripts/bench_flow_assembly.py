@@ -0,0 +1,108 @@
+"""
+Microbenchmark of flow assembly per clip: the old get_seq path (np.load, crop, ToTensor per frame, torch.stack of
+x and y, torch.cat) against VideoDataset.read_flow, which decodes every memory-mapped frame straight into one
+preallocated (T, 2, 224, 224) array shared with the returned tensor.
+
+Flow files are generated in a temporary directory, as 256 x 256 float32 (what extract_flow.py writes) and as
+pre-cropped uint8. Allocation counts are the tensor allocations seen by the torch profiler, and the numpy blocks of
+at least one cropped frame still held after the call (tracemalloc).
+
+usage: python scripts/bench_flow_assembly.py --clips 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+from torchvision import transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_codec import FLOW_BOUND, FLOW_CROP_SIZE, encode_flow
+from video_reader import VideoDataset
+
+FRAME_BYTES = FLOW_CROP_SIZE * FLOW_CROP_SIZE * 4
+
+
+def make_clips(root, n_clips, n_flow, flow_format):
+    rng = np.random.RandomState(0)
+    clips = []
+    for c in range(n_clips):
+        paths = {}
+        for kind in ("flow_x", "flow_y"):
+            d = os.path.join(root, flow_format, str(c), kind)
+            os.makedirs(d)
+            paths[kind] = []
+            for i in range(n_flow):
+                path = os.path.join(d, "{:08d}_{}.npy".format(i + 2, kind))
+                np.save(path, encode_flow(rng.randn(256, 256).astype(np.float32) * 3, flow_format, crop=flow_format != "float32"))
+                paths[kind].append(path)
+        clips.append((paths["flow_x"], paths["flow_y"]))
+    return clips
+
+
+def old_flow(clip, to_tensor):
+    """ the get_seq flow path before read_flow """
+    flows = []
+    for paths in clip:
+        frames = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                frames.append(to_tensor(np.load(f)[8:232, 8:232]))
+        flows.append(torch.stack(frames))
+    return torch.cat(flows, 1)
+
+
+def new_flow(dataset, clip):
+    paths_x, paths_y = clip
+    return torch.from_numpy(dataset.read_flow(None, paths_x, paths_y, range(len(paths_x))))
+
+
+def count_allocations(fn):
+    """ (torch tensor allocations, numpy blocks of at least one frame held) of a call to fn() """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        out = fn()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    torch_allocs = sum(1 for e in prof.events() if e.cpu_memory_usage > 0)
+    numpy_allocs = sum(s.count for s in after.compare_to(before, "filename") if s.size_diff >= FRAME_BYTES)
+    del out
+    return torch_allocs, numpy_allocs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clips", type=int, default=50, help="Clips assembled per measurement.")
+    parser.add_argument("--flow_frames", type=int, default=7, help="Flow frames per clip.")
+    args = parser.parse_args()
+
+    to_tensor = transforms.ToTensor()
+    # read_flow only needs the storage mode and the dequantisation bound of a tree dataset, without frame cache
+    dataset = VideoDataset.__new__(VideoDataset)
+    dataset.zip, dataset.shards, dataset.flow_bound, dataset.frame_cache = False, False, FLOW_BOUND, None
+    dataset.flow_dtype = np.float32
+
+    with tempfile.TemporaryDirectory() as root:
+        for flow_format in ("float32", "uint8"):
+            clips = make_clips(root, args.clips, args.flow_frames, flow_format)
+            paths = [("old", lambda c: old_flow(c, to_tensor))] if flow_format == "float32" else []
+            paths.append(("read_flow", lambda c: new_flow(dataset, c)))
+            for name, fn in paths:
+                for clip in clips[:3]: # warm page cache and allocator
+                    fn(clip)
+                t0 = time.perf_counter()
+                for clip in clips:
+                    out = fn(clip)
+                dt = (time.perf_counter() - t0) / len(clips)
+                torch_allocs, numpy_allocs = count_allocations(lambda: fn(clips[0]))
+                print("{:>8} {:>10}: {:7.2f} ms/clip, {:3d} tensor allocations, {:3d} large numpy blocks, out {} {}".format(
+                    flow_format, name, dt * 1e3, torch_allocs, numpy_allocs, tuple(out.shape), out.dtype))
+
+
+if __name__ == "__main__":
+    main()
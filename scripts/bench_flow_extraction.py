@@ -0,0 +1,91 @@
+"""
+Optical flow extraction throughput (videos per minute) of extract_flow.py against the number of worker processes,
+next to the single-process extraction it replaced (frames re-encoded into img, float32 flow).
+
+Frame folders of --n_videos videos with --n_frames 256 x 256 frames are generated in a temporary directory unless
+--src (a class/video frame tree) is given; output goes to a temporary directory, fresh for every run.
+
+usage: python scripts/bench_flow_extraction.py --workers 1 2 4 8 16 --n_videos 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from extract_flow import extract_video_flow, list_jobs
+from video_jobs import run_jobs
+
+
+def legacy_video_flow(video_path, out_path):
+    """ the per-video work of the former extract_flow.py: colour decode, JPEG re-encode, float32 256 x 256 flow """
+    for kind in ("img", "flow_x", "flow_y"):
+        os.makedirs(os.path.join(out_path, kind), exist_ok=True)
+    prev_frame = None
+    frame_files = sorted(f for f in os.listdir(video_path) if f.endswith('.jpg'))
+    for frame_file in frame_files:
+        frame_rgb = cv2.imread(os.path.join(video_path, frame_file))
+        frame_gray = cv2.cvtColor(frame_rgb, cv2.COLOR_BGR2GRAY)
+        cv2.imwrite(os.path.join(out_path, "img", frame_file), frame_rgb)
+        if prev_frame is not None:
+            flow = cv2.calcOpticalFlowFarneback(prev_frame, frame_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+            base_name = os.path.splitext(frame_file)[0]
+            np.save(os.path.join(out_path, "flow_x", base_name + "_flow_x.npy"), flow[..., 0])
+            np.save(os.path.join(out_path, "flow_y", base_name + "_flow_y.npy"), flow[..., 1])
+        prev_frame = frame_gray
+    return len(frame_files)
+
+
+def make_frames(root, n_videos, n_frames):
+    rng = np.random.RandomState(0)
+    for v in range(n_videos):
+        video = os.path.join(root, "class{}".format(v % 4), "video_{}".format(v))
+        os.makedirs(video)
+        # a smooth pattern moving a few pixels per frame, so the flow has something to track
+        base = cv2.resize(rng.randint(0, 256, (16, 16, 3)).astype(np.uint8), (320, 320), interpolation=cv2.INTER_CUBIC)
+        for i in range(n_frames):
+            cv2.imwrite(os.path.join(video, "{:08d}.jpg".format(i + 1)), base[3 * i:3 * i + 256, 2 * i:2 * i + 256])
+
+
+def run(fn, src, workers, log):
+    with tempfile.TemporaryDirectory() as out:
+        jobs = list_jobs(src, out, None)
+        start = time.time()
+        failed = run_jobs(fn, jobs, out, workers, log=log)
+        elapsed = time.time() - start
+    if failed:
+        raise RuntimeError("{} videos failed".format(len(failed)))
+    return len(jobs) / elapsed * 60
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default=None, help="Frame tree to extract (default: a generated one).")
+    parser.add_argument("--n_videos", type=int, default=32)
+    parser.add_argument("--n_frames", type=int, default=8, help="Frames per generated video.")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument("--flow_format", default="uint8")
+    parser.add_argument("--verbose", default=False, action="store_true", help="Show the progress lines of every run.")
+    args = parser.parse_args()
+    log = print if args.verbose else (lambda *a, **k: None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = args.src
+        if src is None:
+            src = os.path.join(tmp, "frames")
+            make_frames(src, args.n_videos, args.n_frames)
+        print("{} cores".format(os.cpu_count()))
+        reference = run(legacy_video_flow, src, 1, log)
+        print("{:>22}: {:8.1f} videos/min".format("former, 1 process", reference))
+        for workers in args.workers:
+            rate = run(partial(extract_video_flow, flow_format=args.flow_format), src, workers, log)
+            print("{:>22}: {:8.1f} videos/min ({:.2f}x)".format("{} workers".format(workers), rate, rate / reference))
+
+
+if __name__ == "__main__":
+    main()
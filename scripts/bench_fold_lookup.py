@@ -0,0 +1,58 @@
+"""
+Startup benchmark for the train/test membership test done by VideoDataset.read_dir.
+
+Every video folder visited while indexing the dataset is looked up in the fold lists. This compares the old
+list-based lookup (`name in train_list`) with the hashed lookup built by video_reader.read_fold_lists, on the
+shipped split files. The list lookup is quadratic, so it is timed on a sample of visits and extrapolated.
+
+usage: python scripts/bench_fold_lookup.py --splits splits/ssv2_OTAM --split 7
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video_reader import read_fold_list, read_fold_lists
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--splits", default="splits/ssv2_OTAM", help="Directory with the {train/test}listXX.txt files.")
+    parser.add_argument("--split", type=int, default=7, help="Dataset split.")
+    parser.add_argument("--sample", type=int, default=2000, help="Visits timed for the list-based lookup.")
+    args = parser.parse_args()
+
+    lists = {}
+    for name in ["train", "test"]:
+        fname = os.path.join(args.splits, "{}list{:02d}.txt".format(name, args.split))
+        lists[name] = [v for _, v in read_fold_list(fname)]
+    # read_dir visits every video folder on disk, i.e. every listed video
+    visits = lists["train"] + lists["test"]
+    print("{} train, {} test videos".format(len(lists["train"]), len(lists["test"])))
+
+    sample = random.Random(0).sample(visits, min(args.sample, len(visits)))
+    t0 = time.perf_counter()
+    for v in sample:
+        if v in lists["train"]:
+            pass
+        elif v in lists["test"]:
+            pass
+    t_list = (time.perf_counter() - t0) / len(sample) * len(visits)
+
+    t0 = time.perf_counter()
+    lookup = read_fold_lists(args.splits, args.split)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for v in visits:
+        lookup.get(v)
+    t_dict = time.perf_counter() - t0
+
+    print("list lookup:  {:10.3f}s for {} visits (extrapolated from {})".format(t_list, len(visits), len(sample)))
+    print("hash lookup:  {:10.3f}s for {} visits (+{:.3f}s to parse and build)".format(t_dict, len(visits), t_build))
+    print("speedup:      {:10.0f}x".format(t_list / max(t_dict + t_build, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
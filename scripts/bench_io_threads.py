@@ -0,0 +1,114 @@
+"""
+Episode assembly latency and file reads/s of VideoDataset against --io_threads, on storage made artificially slow:
+every file read (a JPEG frame, a flow .npy, a shard or zip read) is delayed by --delay_ms, as on a network
+filesystem. io_threads 0 is the serial path.
+
+A small class/video/{img,flow_x,flow_y} dataset with its split lists is generated in a temporary directory unless
+--path and --traintestlist are given.
+
+usage: python scripts/bench_io_threads.py --delay_ms 5 --threads 0 1 2 4 8 16
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import video_reader
+from mmap_zip import MmapZip
+from video_shards import ShardReader
+
+
+class DelayedReads():
+    """ delays the file reads of VideoDataset and counts them; sleeping releases the GIL as a blocking read does """
+    def __init__(self, delay):
+        self.delay = delay
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def wrap(self, fn):
+        def delayed(*args, **kwargs):
+            time.sleep(self.delay)
+            with self.lock:
+                self.reads += 1
+            return fn(*args, **kwargs)
+        return delayed
+
+    def install(self):
+        # read-ahead path
+        video_reader.read_file = self.wrap(video_reader.read_file)
+        MmapZip.fetch = self.wrap(MmapZip.fetch)
+        ShardReader._pread = self.wrap(ShardReader._pread)
+        # serial path: frames opened by the decoder and memory-mapped flow
+        VideoDataset = video_reader.VideoDataset
+        VideoDataset.read_single_image_flow = self.wrap(VideoDataset.read_single_image_flow)
+        frame_source = VideoDataset.frame_source
+        VideoDataset.frame_source = lambda dataset, path: self.wrap(frame_source)(dataset, path)
+
+
+def make_dataset(root, n_classes, n_videos, seq_len):
+    rng = np.random.RandomState(0)
+    data, splits = os.path.join(root, "data"), os.path.join(root, "splits")
+    os.makedirs(splits)
+    lists = {"train": [], "test": []}
+    for c in range(n_classes):
+        for v in range(n_videos):
+            video = os.path.join(data, "class{}".format(c), "video_{}_{}".format(c, v))
+            for kind in ("img", "flow_x", "flow_y"):
+                os.makedirs(os.path.join(video, kind))
+            for i in range(seq_len):
+                small = rng.randint(0, 256, (16, 16, 3)).astype(np.uint8)
+                Image.fromarray(small).resize((256, 256), Image.BILINEAR).save(os.path.join(video, "img", "{:08d}.jpg".format(i + 1)))
+                if i > 0:
+                    for kind in ("flow_x", "flow_y"):
+                        np.save(os.path.join(video, kind, "{:08d}_{}.npy".format(i + 1, kind)), rng.randn(256, 256).astype(np.float32))
+            lists["train" if c < n_classes - 2 else "test"].append("class{}/video_{}_{}".format(c, c, v))
+    for name, videos in lists.items():
+        with open(os.path.join(splits, "{}list07.txt".format(name)), "w") as f:
+            f.write("\n".join(videos) + "\n")
+    return data, splits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=None, help="Dataset to read (default: a generated one).")
+    parser.add_argument("--traintestlist", default=None, help="Split lists of --path.")
+    parser.add_argument("--split", type=int, default=7)
+    parser.add_argument("--delay_ms", type=float, default=5.0, help="Latency added to every file read.")
+    parser.add_argument("--threads", type=int, nargs='+', default=[0, 1, 2, 4, 8, 16], help="io_threads values measured.")
+    parser.add_argument("--episodes", type=int, default=5, help="Episodes assembled per measurement.")
+    parser.add_argument("--way", type=int, default=5)
+    parser.add_argument("--shot", type=int, default=5)
+    parser.add_argument("--query_per_class", type=int, default=5)
+    args = parser.parse_args()
+
+    shim = DelayedReads(args.delay_ms / 1000.0)
+    shim.install()
+    with tempfile.TemporaryDirectory() as root:
+        if args.path is None:
+            args.path, args.traintestlist = make_dataset(root, args.way + 2, args.shot + args.query_per_class, 8)
+        for io_threads in args.threads:
+            dataset_args = argparse.Namespace(path=args.path, traintestlist=args.traintestlist, split=args.split,
+                                              seq_len=8, img_size=224, way=args.way, shot=args.shot,
+                                              query_per_class=args.query_per_class, query_per_class_test=1,
+                                              debug_loader=False, no_manifest_cache=True, io_threads=io_threads)
+            dataset = video_reader.VideoDataset(dataset_args)
+            random.seed(0)
+            dataset[0] # warm up, starts the pool
+            shim.reads = 0
+            t0 = time.perf_counter()
+            for i in range(args.episodes):
+                dataset[i]
+            dt = time.perf_counter() - t0
+            print("io_threads {:2d}: {:7.1f} ms/episode, {:7.0f} reads/s".format(
+                io_threads, dt / args.episodes * 1e3, shim.reads / dt), flush=True)
+
+
+if __name__ == "__main__":
+    main()
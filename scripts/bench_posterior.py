@@ -0,0 +1,125 @@
+"""
+Microbenchmark of ModalitySpecificPosterior: the old per-pair loop (nn.PairwiseDistance on every query and class,
+scalars written into a CPU tensor) against the batched forward (one cdist, log-softmax), across way and query
+counts. Both are checked to agree, on the posterior, the certainties and the gradients of the features.
+
+With --fusion, the whole of AAS and AMI is timed instead (RGB and flow posteriors, then the fused posterior): the
+old loops, AMI computing both distances again per pair, against the batched modules, AMI reusing the distances of
+AAS.
+
+Features are random, --dim wide, scaled so that the distances are a few units and exp(-distance) does not underflow
+in the loop (which then divides 0 by 0).
+
+usage: python scripts/bench_posterior.py --ways 5 10 20 50 --queries 20 100 500
+       python scripts/bench_posterior.py --fusion --ways 5 20 --queries 20 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model import AAS, AMI, ModalitySpecificPosterior
+
+
+def loop_posterior(class_prototypes, query_features):
+    """ the forward ModalitySpecificPosterior had before it was batched """
+    psi = nn.PairwiseDistance(p=2)
+    num_queries = query_features.size(0)
+    num_classes = class_prototypes.size(0)
+    posterior = torch.zeros(num_queries, num_classes)
+    for i in range(num_queries):
+        for k in range(num_classes):
+            distance = psi(query_features[i], class_prototypes[k])
+            posterior[i, k] = torch.exp(-distance)
+    posterior = posterior / torch.sum(posterior, dim=1, keepdim=True)
+    c = torch.max(posterior, dim=1)[0]
+    h = -torch.sum(posterior * torch.log(posterior), dim=1)
+    return posterior, c, h
+
+
+def loop_fusion(context_rgb, context_flow, target_rgb, target_flow):
+    """ the fused posterior as AAS and AMI computed it before they were batched """
+    p_r, c_r, h_r = loop_posterior(context_rgb, target_rgb)
+    p_f, c_f, h_f = loop_posterior(context_flow, target_flow)
+    w_r = c_r / (c_r + c_f)
+    w_f = c_f / (c_r + c_f)
+    posterior = torch.zeros(target_rgb.size(0), context_rgb.size(0))
+    for i in range(target_rgb.size(0)):
+        for k in range(context_rgb.size(0)):
+            distance_rgb = torch.nn.PairwiseDistance(p=2)(target_rgb[i], context_rgb[k])
+            distance_flow = torch.nn.PairwiseDistance(p=2)(target_flow[i], context_flow[k])
+            posterior[i, k] = w_r[i] * torch.exp(-distance_rgb) + w_f[i] * torch.exp(-distance_flow)
+    posterior = posterior / torch.sum(posterior, dim=1, keepdim=True)
+    return posterior, p_r, p_f
+
+
+class BatchedFusion():
+    def __init__(self):
+        self.aas = AAS(None)
+        self.ami = AMI(None)
+
+    def __call__(self, context_rgb, context_flow, target_rgb, target_flow):
+        x = {"context_rgb_features": context_rgb, "context_flow_features": context_flow,
+             "target_rgb_features": target_rgb, "target_flow_features": target_flow}
+        output_AAS = self.aas(x)
+        return self.ami(x, output_AAS), output_AAS["p_r"], output_AAS["p_f"]
+
+
+def run(fn, prototypes, queries, backward):
+    """ the first three outputs of fn (posterior and two per-query or per-modality ones), then with backward the gradients of the features """
+    features = [t.detach().requires_grad_(backward) for t in prototypes + queries]
+    posterior, a, b = fn(*features)[:3]
+    if backward:
+        # a loss touching all three outputs, as AMFAR's losses do
+        (posterior.sum(dim=0) @ torch.arange(posterior.size(1), dtype=posterior.dtype) + (a * a).sum() + (b * b).sum()).backward()
+        return (posterior, a, b) + tuple(t.grad for t in features)
+    return posterior, a, b
+
+
+def seconds(fn, prototypes, queries, backward, repeat):
+    best = float("inf")
+    for r in range(repeat):
+        start = time.perf_counter()
+        run(fn, prototypes, queries, backward)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ways", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--queries", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--dim", type=int, default=2048, help="Feature width (of the RGB features with --fusion).")
+    parser.add_argument("--flow_dim", type=int, default=1024, help="Feature width of the flow features with --fusion.")
+    parser.add_argument("--fusion", default=False, action="store_true", help="Time AAS and AMI instead of one posterior.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the fastest is reported.")
+    parser.add_argument("--backward", default=False, action="store_true", help="Time forward and backward.")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    dims = [args.dim, args.flow_dim] if args.fusion else [args.dim]
+    loop, batched = (loop_fusion, BatchedFusion()) if args.fusion else (loop_posterior, ModalitySpecificPosterior(None))
+    print("{:>5} {:>7} {:>11} {:>11} {:>9} {:>10} {:>10}".format("way", "queries", "loop ms", "batched ms", "speedup", "max diff", "grad diff"))
+    for way in args.ways:
+        for n_queries in args.queries:
+            prototypes = [torch.randn(way, dim, dtype=torch.float64) / dim ** 0.5 for dim in dims]
+            queries = [torch.randn(n_queries, dim, dtype=torch.float64) / dim ** 0.5 for dim in dims]
+            # agreement in double precision, with gradients
+            ref = run(loop, prototypes, queries, True)
+            new = run(batched, prototypes, queries, True)
+            diff = max((a - b).abs().max().item() for a, b in zip(ref[:3], new[:3]))
+            grad_diff = max((a - b).abs().max().item() for a, b in zip(ref[3:], new[3:]))
+            # timings in float32, as training runs
+            prototypes, queries = [p.float() for p in prototypes], [q.float() for q in queries]
+            t_loop = seconds(loop, prototypes, queries, args.backward, args.repeat)
+            t_batched = seconds(batched, prototypes, queries, args.backward, args.repeat)
+            print("{:>5} {:>7} {:>11.2f} {:>11.3f} {:>8.0f}x {:>10.1e} {:>10.1e}".format(
+                way, n_queries, t_loop * 1e3, t_batched * 1e3, t_loop / t_batched, diff, grad_diff))
+
+
+if __name__ == "__main__":
+    main()
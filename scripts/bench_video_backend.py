@@ -0,0 +1,115 @@
+"""
+Clip loading throughput of VideoDataset reading the video files directly (--video_dir, see video_files.py) against
+the JPEG frame tree with stored flow the same videos are ingested into (scripts/ingest.py --format tree), in
+training mode (jittered frames, random crops and flips).
+
+For the video files, the time to decode the sampled frames alone is reported next to the full clip (frames plus
+the flow computed from them), since the flow is what the frame tree stores ahead of time.
+
+Videos of --n_frames 320 x 240 frames are generated in a temporary directory unless --video_dir and
+--traintestlist are given.
+
+usage: python scripts/bench_video_backend.py --n_videos 40 --n_frames 150 --clips 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ingest import list_videos, write_video_tree
+from video_files import read_video_frames
+from video_jobs import run_jobs
+from video_reader import VideoDataset
+
+
+def make_videos(root, n_videos, n_frames, fourcc):
+    rng = np.random.RandomState(0)
+    data, splits = os.path.join(root, "videos"), os.path.join(root, "splits")
+    os.makedirs(splits)
+    lists = {"train": [], "test": []}
+    for v in range(n_videos):
+        c = v % 4
+        os.makedirs(os.path.join(data, "class{}".format(c)), exist_ok=True)
+        name = "video_{}_{}".format(c, v)
+        writer = cv2.VideoWriter(os.path.join(data, "class{}".format(c), name + ".mp4"), cv2.VideoWriter_fourcc(*fourcc), 25, (320, 240))
+        # a smooth pattern panning across the frame
+        base = cv2.resize(rng.randint(0, 256, (16, 16, 3)).astype(np.uint8), (320 + n_frames, 240 + n_frames), interpolation=cv2.INTER_CUBIC)
+        for t in range(n_frames):
+            writer.write(np.ascontiguousarray(base[t:t + 240, t:t + 320]))
+        writer.release()
+        lists["train"].append("class{}/{}".format(c, name))
+    lists["test"] = lists["train"][:4]
+    for name, videos in lists.items():
+        with open(os.path.join(splits, "{}list07.txt".format(name)), "w") as f:
+            f.write("\n".join(videos) + "\n")
+    return data, splits
+
+
+def dataset(path, traintestlist, seq_len, video_dir=None, transform_backend="pil"):
+    return VideoDataset(argparse.Namespace(path=path, traintestlist=traintestlist, split=7, seq_len=seq_len, img_size=224,
+                                           way=2, shot=1, query_per_class=1, query_per_class_test=1, debug_loader=False,
+                                           no_manifest_cache=True, video_dir=video_dir, transform_backend=transform_backend))
+
+
+def clips_per_s(d, n_clips, seed=0):
+    random.seed(seed)
+    c = d.train_split
+    start = time.time()
+    for n in range(n_clips):
+        label = random.choice(c.get_unique_classes())
+        d.get_seq(label, random.randrange(c.get_num_videos_for_class(label)))
+    return n_clips / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video_dir", default=None, help="Directory of class/<video> files (default: generated ones).")
+    parser.add_argument("--traintestlist", default=None)
+    parser.add_argument("--ext", default=".mp4", help="Extension of the video files.")
+    parser.add_argument("--n_videos", type=int, default=16)
+    parser.add_argument("--n_frames", type=int, default=150, help="Frames per generated video.")
+    parser.add_argument("--fourcc", default="mp4v", help="Codec of the generated videos.")
+    parser.add_argument("--seq_len", type=int, default=8)
+    parser.add_argument("--clips", type=int, default=100, help="Clips loaded per backend.")
+    parser.add_argument("--transform_backend", choices=["pil", "tensor"], default="pil")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_dir, traintestlist = args.video_dir, args.traintestlist
+        if video_dir is None:
+            video_dir, traintestlist = make_videos(tmp, args.n_videos, args.n_frames, args.fourcc)
+        tree = os.path.join(tmp, "tree")
+        jobs = [(os.path.join(c, v), source, os.path.join(tree, c, v)) for c, v, source in list_videos(video_dir, traintestlist, args.ext)]
+        for _, _, dst in jobs:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+        run_jobs(partial(write_video_tree, max_seq_len=args.seq_len, flow_format="float32"), jobs, tree, os.cpu_count(), log=lambda *a: None)
+
+        d_tree = dataset(tree, traintestlist, args.seq_len, transform_backend=args.transform_backend)
+        d_video = dataset(video_dir, traintestlist, args.seq_len, video_dir=video_dir, transform_backend=args.transform_backend)
+        mean_frames = np.mean([len(v) for v in d_video.train_split.videos])
+
+        rate_tree = clips_per_s(d_tree, args.clips)
+        rate_video = clips_per_s(d_video, args.clips)
+        c = d_video.train_split
+        start = time.time()
+        for n in range(args.clips):
+            video = c.videos[n % len(c)]
+            read_video_frames(video, d_video.sample_idxs(len(video), args.seq_len - 1))
+        rate_decode = args.clips / (time.time() - start)
+
+        print("{} training videos of {:.0f} frames on average, {} frames per clip".format(len(c), mean_frames, args.seq_len))
+        print("{:>30}: {:7.1f} clips/s, {:8.1f} frames/s".format("JPEG tree + stored flow", rate_tree, rate_tree * args.seq_len))
+        print("{:>30}: {:7.1f} clips/s, {:8.1f} frames/s ({:.2f}x)".format("video files + flow", rate_video, rate_video * args.seq_len, rate_video / rate_tree))
+        print("{:>30}: {:7.1f} clips/s, {:8.1f} frames/s".format("video files, frames only", rate_decode, rate_decode * args.seq_len))
+
+
+if __name__ == "__main__":
+    main()
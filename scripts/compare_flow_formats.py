@@ -0,0 +1,116 @@
+"""
+Measure what the compact flow formats of flow_codec.py cost in accuracy and save in bytes, on flow frames
+sampled from a float32 class/video/{img,flow_x,flow_y} tree.
+
+Reports bytes per stored frame, the reduction against the original .npy files, and the reconstruction error of
+the 224 x 224 window the loader uses (mean/max absolute error, end-point error, fraction of clipped values).
+With --i3d it also compares the I3D flow features of whole clips decoded from each format with the float32 ones.
+
+usage: python scripts/compare_flow_formats.py --src /data3/cse455/hmdb51_org_256x256q5_rgb_flow --videos 200
+"""
+import argparse
+import io
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_codec import FLOW_BOUND, FLOW_FORMATS, crop_flow, decode_flow, encode_flow
+
+
+def sample_videos(src, n, seed):
+    videos = []
+    for class_folder in sorted(os.listdir(src)):
+        if class_folder[0] == '.' or not os.path.isdir(os.path.join(src, class_folder)):
+            continue
+        for video_folder in sorted(os.listdir(os.path.join(src, class_folder))):
+            videos.append(os.path.join(src, class_folder, video_folder))
+    random.Random(seed).shuffle(videos)
+    return videos[:n]
+
+
+def load_clip(video_path):
+    """ (original file sizes, float32 flow (T, 2, 224, 224)) of a video """
+    sizes = []
+    flows = []
+    for kind in ("flow_x", "flow_y"):
+        names = sorted(os.listdir(os.path.join(video_path, kind)))
+        sizes.extend(os.path.getsize(os.path.join(video_path, kind, name)) for name in names)
+        flows.append([crop_flow(np.load(os.path.join(video_path, kind, name))).astype(np.float32) for name in names])
+    return sizes, np.stack([np.stack(flows[0]), np.stack(flows[1])], axis=1)
+
+
+def stored_size(array):
+    buf = io.BytesIO()
+    np.save(buf, array)
+    return buf.tell()
+
+
+def load_i3d(path):
+    import torch
+    from pytorch_i3d import InceptionI3d
+    i3d = InceptionI3d(400, in_channels=2)
+    i3d.replace_logits(157)
+    i3d.load_state_dict(torch.load(path, map_location="cpu"))
+    return i3d.eval()
+
+
+def i3d_features(i3d, flow):
+    """ features of one (T, 2, H, W) clip, padded in time like Flow_i3d_backbone """
+    import torch
+    with torch.no_grad():
+        x = torch.from_numpy(flow).unsqueeze(0)
+        x = torch.cat((x[:, 0:1], x, x[:, -1:]), 1).permute(0, 2, 1, 3, 4)
+        return i3d.extract_features(x).flatten().numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", required=True, help="class/video/{img,flow_x,flow_y} tree with float32 flow.")
+    parser.add_argument("--videos", type=int, default=100, help="Videos sampled.")
+    parser.add_argument("--flow_bound", type=float, default=FLOW_BOUND, help="Clipping bound for uint8 flow.")
+    parser.add_argument("--i3d", default=None, help="Flow I3D weights (e.g. model/flow_charades.pt) to compare features.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    i3d = load_i3d(args.i3d) if args.i3d else None
+    stats = {f: {"bytes": 0, "abs_err": 0.0, "max_err": 0.0, "epe": 0.0, "clipped": 0, "cos": []} for f in FLOW_FORMATS}
+    src_bytes = n_frames = n_values = 0
+    for video_path in sample_videos(args.src, args.videos, args.seed):
+        sizes, flow = load_clip(video_path)
+        if len(flow) == 0:
+            continue
+        src_bytes += sum(sizes)
+        n_frames += 2 * len(flow)
+        n_values += flow.size
+        reference = i3d_features(i3d, flow) if i3d is not None else None
+        for flow_format in FLOW_FORMATS:
+            s = stats[flow_format]
+            stored = encode_flow(flow, flow_format, args.flow_bound)
+            s["bytes"] += sum(stored_size(frame) for frame in stored.reshape((-1,) + stored.shape[-2:]))
+            decoded = decode_flow(stored, args.flow_bound)
+            err = decoded - flow
+            s["abs_err"] += float(np.abs(err).sum())
+            s["max_err"] = max(s["max_err"], float(np.abs(err).max()))
+            s["epe"] += float(np.sqrt((err ** 2).sum(axis=1)).sum())
+            if flow_format == "uint8":
+                s["clipped"] += int((np.abs(flow) > args.flow_bound).sum())
+            if reference is not None:
+                feat = i3d_features(i3d, decoded)
+                s["cos"].append(float(np.dot(feat, reference) / (np.linalg.norm(feat) * np.linalg.norm(reference) + 1e-12)))
+
+    print("{} flow frames, original {:.1f} KB/frame".format(n_frames, src_bytes / max(n_frames, 1) / 1024))
+    print("{:>8} {:>10} {:>10} {:>12} {:>10} {:>12} {:>10} {:>14}".format(
+        "format", "KB/frame", "reduction", "mean |err|", "max |err|", "mean EPE", "clipped", "i3d cos sim"))
+    for flow_format in FLOW_FORMATS:
+        s = stats[flow_format]
+        print("{:>8} {:>10.1f} {:>9.2f}x {:>12.5f} {:>10.4f} {:>12.5f} {:>9.4f}% {:>14}".format(
+            flow_format, s["bytes"] / max(n_frames, 1) / 1024, src_bytes / max(s["bytes"], 1),
+            s["abs_err"] / max(n_values, 1), s["max_err"], s["epe"] / max(n_values // 2, 1),
+            100.0 * s["clipped"] / max(n_values, 1), "{:.6f}".format(np.mean(s["cos"])) if s["cos"] else "-"))
+
+
+if __name__ == "__main__":
+    main()
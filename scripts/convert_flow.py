@@ -0,0 +1,62 @@
+"""
+Rewrite the flow of a class/video/{img,flow_x,flow_y} tree in a compact format (see flow_codec.py): the 224 x 224
+window the loader uses, as float16 or clipped-and-scaled uint8. Frames are hardlinked into the new tree (copied
+if the destination is on another filesystem).
+
+usage: python scripts/convert_flow.py --src /data3/cse455/hmdb51_org_256x256q5_rgb_flow --dst /data3/cse455/hmdb51_rgb_flow_u8
+"""
+import argparse
+import os
+import shutil
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_codec import FLOW_BOUND, FLOW_FORMATS, decode_flow, encode_flow, read_flow_bound, write_flow_format
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", required=True, help="class/video/{img,flow_x,flow_y} dataset tree.")
+    parser.add_argument("--dst", required=True, help="Output tree.")
+    parser.add_argument("--flow_format", choices=FLOW_FORMATS, default="uint8", help="Storage format of the flow.")
+    parser.add_argument("--flow_bound", type=float, default=FLOW_BOUND, help="Clipping bound for uint8 flow.")
+    args = parser.parse_args()
+
+    src_bound = read_flow_bound(args.src)
+    os.makedirs(args.dst, exist_ok=True)
+    write_flow_format(args.dst, args.flow_format, args.flow_bound)
+    src_bytes = dst_bytes = 0
+    for class_folder in sorted(os.listdir(args.src)):
+        if class_folder[0] == '.' or not os.path.isdir(os.path.join(args.src, class_folder)):
+            continue
+        for video_folder in sorted(os.listdir(os.path.join(args.src, class_folder))):
+            src_video = os.path.join(args.src, class_folder, video_folder)
+            dst_video = os.path.join(args.dst, class_folder, video_folder)
+            for kind in ("img", "flow_x", "flow_y"):
+                os.makedirs(os.path.join(dst_video, kind), exist_ok=True)
+            for name in os.listdir(os.path.join(src_video, "img")):
+                dst = os.path.join(dst_video, "img", name)
+                if not os.path.exists(dst):
+                    link_or_copy(os.path.join(src_video, "img", name), dst)
+            for kind in ("flow_x", "flow_y"):
+                for name in os.listdir(os.path.join(src_video, kind)):
+                    src = os.path.join(src_video, kind, name)
+                    dst = os.path.join(dst_video, kind, name)
+                    np.save(dst, encode_flow(decode_flow(np.load(src), src_bound), args.flow_format, args.flow_bound))
+                    src_bytes += os.path.getsize(src)
+                    dst_bytes += os.path.getsize(dst)
+        print("{}: flow {:.1f} MB -> {:.1f} MB".format(class_folder, src_bytes / 2**20, dst_bytes / 2**20), flush=True)
+    print("flow reduced {:.2f}x".format(src_bytes / max(dst_bytes, 1)))
+
+
+if __name__ == "__main__":
+    main()
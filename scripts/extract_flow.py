@@ -1,70 +1,113 @@
+"""
+Farneback optical flow of a frame dataset (src/<class>/<video>/*.jpg, as written by shrink_dataset.py), into the
+class/video/{img,flow_x,flow_y} tree VideoDataset reads: img holds the frames themselves, hard-linked (or copied
+across filesystems, never re-encoded), flow_x and flow_y one .npy per consecutive frame pair, in --flow_format.
+float32 keeps the full 256 x 256 flow; float16 and uint8 (the default) keep the 224 x 224 window the loader uses,
+uint8 clipped to [-flow_bound, flow_bound] (see flow_codec.py).
+
+Videos are processed on --workers processes, and the run is resumable: see video_jobs.py. Video folders of an
+earlier run without a journal are kept when they hold every frame and flow file.
+
+usage: python scripts/extract_flow.py --src /data3/cse455/hmdb51_org_256x256q5_l8 --out /data3/cse455/hmdb51_org_256x256q5_rgb_flow
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from functools import partial
+
 import cv2
 import numpy as np
-import os
 
-def extract_and_save_optical_flow(frames_dir_base, output_dir_base):
-    """
-    Traverses given directories of video frames, extracts optical flow from grayscale images, 
-    and saves the original RGB frames and optical flow horizontal and vertical components 
-    into separate directories for each video.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from flow_codec import FLOW_BOUND, FLOW_FORMAT_FILE, FLOW_FORMATS, encode_flow, write_flow_format
+from video_jobs import add_common_args, read_split_lists, run_jobs
+
+
+def link_or_copy(src, dst):
+    """ the bytes of src at dst, by a hard link when both are on the same filesystem """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-    :param frames_dir_base: Base directory path containing folders of frames for each video.
-    :param output_dir_base: Base directory path where the output directories should be saved.
+
+def extract_video_flow(video_path, out_path, flow_format="uint8", flow_bound=FLOW_BOUND):
+    """
+    Link the frames of one video folder into out_path/img and save the flow between consecutive frames, computed on
+    grayscale, into out_path/flow_x and out_path/flow_y. Returns the number of frames.
     """
-    for class_name in os.listdir(frames_dir_base):
-        class_path = os.path.join(frames_dir_base, class_name)
-        if not os.path.isdir(class_path):
-            continue
-        
-        for video_name in os.listdir(class_path):
-            video_path = os.path.join(class_path, video_name)
-            if not os.path.isdir(video_path):
-                continue
-            
-            frame_files = sorted([f for f in os.listdir(video_path) if f.endswith('.jpg')])
-            prev_frame = None
-            
-            for frame_file in frame_files:
-                frame_path = os.path.join(video_path, frame_file)
-                
-                # Load the frame in original RGB color
-                frame_rgb = cv2.imread(frame_path)  # cv2.IMREAD_COLOR is default and can be omitted
-                
-                # Convert the frame to grayscale for optical flow calculation
-                frame_gray = cv2.cvtColor(frame_rgb, cv2.COLOR_BGR2GRAY)
-                
-                if frame_gray is None:
-                    print(f"Failed to read frame: {frame_path}")
-                    continue
-                
-                # Save original RGB frames to img folder
-                img_dir = os.path.join(output_dir_base, class_name, video_name, "img")
-                os.makedirs(img_dir, exist_ok=True)
-                cv2.imwrite(os.path.join(img_dir, frame_file), frame_rgb)
-                
-                if prev_frame is None:
-                    prev_frame = frame_gray
-                    continue
-                
-                # Compute optical flow
-                flow = cv2.calcOpticalFlowFarneback(prev_frame, frame_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
-                flow_x, flow_y = flow[..., 0], flow[..., 1]
-                
-                flow_x_dir = os.path.join(output_dir_base, class_name, video_name, "flow_x")
-                flow_y_dir = os.path.join(output_dir_base, class_name, video_name, "flow_y")
-                os.makedirs(flow_x_dir, exist_ok=True)
-                os.makedirs(flow_y_dir, exist_ok=True)
-                
-                base_name = os.path.splitext(frame_file)[0]
-                flow_x_file = os.path.join(flow_x_dir, f"{base_name}_flow_x.npy")
-                flow_y_file = os.path.join(flow_y_dir, f"{base_name}_flow_y.npy")
-                
-                np.save(flow_x_file, flow_x)
-                np.save(flow_y_file, flow_y)
-                
-                prev_frame = frame_gray
-
-# Example paths, replace with your actual paths
-frames_dir_base = '/data3/cse455/hmdb51_org_256x256q5_l8'
-output_dir_base = '/data3/cse455/hmdb51_org_256x256q5_rgb_flow'
-extract_and_save_optical_flow(frames_dir_base, output_dir_base)
+    frame_files = sorted(f for f in os.listdir(video_path) if f.endswith('.jpg'))
+    dirs = {kind: os.path.join(out_path, kind) for kind in ("img", "flow_x", "flow_y")}
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+    crop = flow_format != "float32"
+    prev_frame = None
+    for frame_file in frame_files:
+        frame_path = os.path.join(video_path, frame_file)
+        frame_gray = cv2.imread(frame_path, cv2.IMREAD_GRAYSCALE)
+        if frame_gray is None:
+            raise IOError("cannot read frame {}".format(frame_path))
+        link_or_copy(frame_path, os.path.join(dirs["img"], frame_file))
+
+        if prev_frame is not None:
+            flow = cv2.calcOpticalFlowFarneback(prev_frame, frame_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+            base_name = os.path.splitext(frame_file)[0]
+            for i, kind in enumerate(("flow_x", "flow_y")):
+                np.save(os.path.join(dirs[kind], "{}_{}.npy".format(base_name, kind)),
+                        encode_flow(flow[..., i], flow_format, flow_bound, crop=crop))
+        prev_frame = frame_gray
+    return len(frame_files)
+
+
+def is_complete(video_path, out_path):
+    """ whether out_path already holds the frames and flow of video_path, e.g. from a run without a journal """
+    try:
+        n_frames = len([f for f in os.listdir(video_path) if f.endswith('.jpg')])
+        counts = [len(os.listdir(os.path.join(out_path, kind))) for kind in ("img", "flow_x", "flow_y")]
+    except OSError:
+        return False
+    return counts == [n_frames, max(n_frames - 1, 0), max(n_frames - 1, 0)]
+
+
+def list_jobs(src, out, traintestlist):
+    """ (key, frame folder, output video folder) of every video """
+    if traintestlist:
+        videos = [(c, v) for items in read_split_lists(traintestlist).values() for c, v in items]
+    else:
+        videos = [(c, v) for c in sorted(os.listdir(src)) if os.path.isdir(os.path.join(src, c))
+                  for v in sorted(os.listdir(os.path.join(src, c))) if os.path.isdir(os.path.join(src, c, v))]
+    jobs = []
+    for c, v in videos:
+        os.makedirs(os.path.join(out, c), exist_ok=True)
+        jobs.append((os.path.join(c, v), os.path.join(src, c, v), os.path.join(out, c, v)))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser, "Frame dataset of <class>/<video> folders.", "Output class/video/{img,flow_x,flow_y} tree.")
+    parser.add_argument("--flow_format", choices=FLOW_FORMATS, default="uint8", help="Storage format of the flow.")
+    parser.add_argument("--flow_bound", type=float, default=FLOW_BOUND, help="Clipping bound for uint8 flow.")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        with open(os.path.join(args.out, FLOW_FORMAT_FILE)) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = None
+    if previous and not args.redo and (previous.get("format"), previous.get("bound")) != (args.flow_format, args.flow_bound):
+        sys.exit("{} holds {} flow (bound {}): resume with the same --flow_format and --flow_bound, or pass --redo".format(
+            args.out, previous.get("format"), previous.get("bound")))
+    write_flow_format(args.out, args.flow_format, args.flow_bound)
+    jobs = list_jobs(args.src, args.out, args.traintestlist)
+    extract = partial(extract_video_flow, flow_format=args.flow_format, flow_bound=args.flow_bound)
+    failed = run_jobs(extract, jobs, args.out, args.workers, args.redo, complete=is_complete)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
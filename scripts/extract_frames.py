@@ -1,72 +1,74 @@
-import os
-import subprocess
-import json
-from glob import glob
-# from joblib import Parallel, delayed
-import cv2
+"""
+Decode the videos of a dataset (src/<class>/<video>.avi) into resized JPEG frames, out/<split>/<class>/<video>/%08d.jpg
+for the videos named by the split lists of --traintestlist, or out/<class>/<video>/%08d.jpg for every video of src
+without it.
 
-out_h = 256
-out_w = 256
-in_folder = '/Users/daithyren/Desktop/School/graduate/UW/2024_winter/CSE455_computer_vision/final_proj/datasets/hmdb51_org'
-out_folder = '/Users/daithyren/Desktop/School/graduate/UW/2024_winter/CSE455_computer_vision/final_proj/datasets/hmdb51_org_{}x{}q5'.format(out_w,out_h)
+Videos are decoded on --workers processes, and the run is resumable: see video_jobs.py.
 
-split_dir = "/Users/daithyren/Desktop/School/graduate/UW/2024_winter/CSE455_computer_vision/final_proj/CSE455_final-main/splits/hmdb_ARN"
+usage: python scripts/extract_frames.py --src /data3/cse455/hmdb51_org --out /data3/cse455/hmdb51_org_256x256q5 \
+    --traintestlist splits/hmdb_ARN
+"""
+import argparse
+import os
+import sys
+from functools import partial
 
-wc = os.path.join(split_dir, "*.txt")
+import cv2
 
-# 确保输出目录存在
-if not os.path.exists(out_folder):
-    os.makedirs(out_folder)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from video_jobs import add_common_args, read_split_lists, run_jobs
 
-print("out_folder successful")
 
-for fn in glob(wc):
-    classes = []
-    vids = []
+def extract_video(source_vid, extract_dir, out_w=256, out_h=256, jpeg_quality=95):
+    cap = cv2.VideoCapture(source_vid)
+    if not cap.isOpened():
+        raise IOError("cannot open {}".format(source_vid))
+    frame_count = 0
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
 
-    print(fn)
-    if "train" in fn:
-        cur_split = "train"
-    elif "val" in fn:
-        cur_split = "val"
-    elif "test" in fn:
-        cur_split = "test"
+        frame = cv2.resize(frame, (out_w, out_h))
+        frame_path = os.path.join(extract_dir, '{:08d}.jpg'.format(frame_count))
+        if not cv2.imwrite(frame_path, frame, params):
+            raise IOError("cannot write {}".format(frame_path))
+        frame_count += 1
 
-    with open(fn, "r") as f:
-        data = f.readlines()
-        c = [x.split('/')[-2].strip() for x in data]
-        v = [x.split('/')[-1].strip().split('.')[0] for x in data]  # Assuming the file format is included
-        vids.extend(v)
-        classes.extend(c)
+    cap.release()
+    if frame_count == 0:
+        raise IOError("no frames decoded from {}".format(source_vid))
+    return frame_count
 
-    split_out_folder = os.path.join(out_folder, cur_split)
-    if not os.path.exists(split_out_folder):
-        os.makedirs(split_out_folder)
 
-    for c in set(classes):
-        class_out_folder = os.path.join(split_out_folder, c)
-        if not os.path.exists(class_out_folder):
-            os.makedirs(class_out_folder)
+def list_jobs(src, out, traintestlist, ext):
+    """ (key, source video, frame folder) of every video to extract """
+    if traintestlist:
+        videos = [(os.path.join(split, c), c, v) for split, items in read_split_lists(traintestlist).items() for c, v in items]
+    else:
+        videos = [(c, c, os.path.splitext(v)[0]) for c in sorted(os.listdir(src)) if os.path.isdir(os.path.join(src, c))
+                  for v in sorted(os.listdir(os.path.join(src, c))) if v.endswith(ext)]
+    jobs = []
+    for folder, c, v in videos:
+        os.makedirs(os.path.join(out, folder), exist_ok=True)
+        jobs.append((os.path.join(folder, v), os.path.join(src, c, v + ext), os.path.join(out, folder, v)))
+    return jobs
 
-    for v, c in zip(vids, classes):
-        source_vid = os.path.join(in_folder, c, "{}.avi".format(v))
-        extract_dir = os.path.join(out_folder, cur_split, c, v)
 
-        if os.path.exists(extract_dir):
-            continue
-        else:
-            os.makedirs(extract_dir)
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser, "Directory of <class>/<video> files.", "Output directory of the frame folders.")
+    parser.add_argument("--ext", default=".avi", help="Extension of the video files.")
+    parser.add_argument("--size", type=int, nargs=2, default=[256, 256], metavar=("W", "H"), help="Size of the frames written.")
+    parser.add_argument("--jpeg_quality", type=int, default=95, help="JPEG quality of the frames written.")
+    args = parser.parse_args()
 
-        cap = cv2.VideoCapture(source_vid)
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+    jobs = list_jobs(args.src, args.out, args.traintestlist, args.ext)
+    extract = partial(extract_video, out_w=args.size[0], out_h=args.size[1], jpeg_quality=args.jpeg_quality)
+    failed = run_jobs(extract, jobs, args.out, args.workers, args.redo)
+    sys.exit(1 if failed else 0)
 
-            frame = cv2.resize(frame, (out_w, out_h))
-            frame_path = os.path.join(extract_dir, '{:08d}.jpg'.format(frame_count))
-            cv2.imwrite(frame_path, frame)
-            frame_count += 1
 
-        cap.release()
+if __name__ == "__main__":
+    main()
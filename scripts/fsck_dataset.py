@@ -0,0 +1,164 @@
+"""
+Check every video of a class/video/{img,flow_x,flow_y} dataset tree on all cores, and write the videos that pass as
+a verified index VideoDataset loads with --dataset_index instead of listing the tree.
+
+A video fails when it has fewer than --seq_len frames, when its flow_x and flow_y frames are not one per pair of
+consecutive frames (n_frames - 1 each, with matching names), or when a frame or a flow file does not decode (a
+truncated JPEG, a .npy with a bad header, flow that is not 2-D or not finite). --expected_frames only reports videos
+with another number of frames (as test_path.py did), without failing them. --no_decode checks the counts and names
+only. Frames are the .jpg and .png files of img, as VideoDataset reads them; other files there are reported, not
+counted.
+
+Only the videos in the train and test lists of --split are checked. The report (--report, json) lists the problems
+of every video that has some; the index (--index) is a DatasetManifest (see dataset_manifest.py) of the videos that
+passed, with the fingerprint of the tree, so the loader refuses it once the tree or the split lists change.
+
+usage: python scripts/fsck_dataset.py --path /data3/cse455/hmdb51_org_256x256q5_rgb_flow --traintestlist splits/hmdb_ARN \
+    --split 3 --index /data3/cse455/hmdb51_verified.npz --report hmdb51_fsck.json
+"""
+import argparse
+import json
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from dataset_manifest import FRAME_EXTENSIONS, SUBDIRS, DatasetManifest, verified_index_fingerprint
+from flow_codec import FLOW_CROP_SIZE
+from video_jobs import Progress
+from video_reader import fold_list_files, read_fold_lists
+
+
+def check_frame(path):
+    with Image.open(path) as i:
+        i.load()
+
+
+def check_flow(path):
+    flow = np.load(path, allow_pickle=False)
+    if flow.ndim != 2 or min(flow.shape) < FLOW_CROP_SIZE:
+        raise ValueError("flow of shape {}".format(flow.shape))
+    if flow.dtype.kind == "f" and not np.isfinite(flow).all():
+        raise ValueError("flow is not finite")
+
+
+def flow_base(name, kind):
+    """ frame name a flow file belongs to: 00000002_flow_x.npy -> 00000002 """
+    stem = os.path.splitext(name)[0]
+    return stem[:-len(kind) - 1] if stem.endswith("_" + kind) else stem
+
+
+def check_video(video_path, seq_len=8, expected_frames=None, decode=True):
+    """ (sorted frame names of img (see FRAME_EXTENSIONS), flow_x and flow_y names, errors, warnings) of one video folder """
+    names = {}
+    errors = []
+    warnings = []
+    for kind in SUBDIRS:
+        try:
+            names[kind] = sorted(os.listdir(os.path.join(video_path, kind)))
+        except OSError as e:
+            names[kind] = []
+            errors.append("{}: {}".format(kind, e.strerror))
+    imgs = [name for name in names["img"] if name.lower().endswith(FRAME_EXTENSIONS)]
+    if len(imgs) < len(names["img"]):
+        warnings.append("{} files in img that are not frames".format(len(names["img"]) - len(imgs)))
+    names["img"] = imgs
+    flow_x, flow_y = names["flow_x"], names["flow_y"]
+    if len(imgs) < seq_len:
+        errors.append("{} frames, fewer than seq_len {}".format(len(imgs), seq_len))
+    if expected_frames is not None and len(imgs) != expected_frames:
+        warnings.append("{} frames, expected {}".format(len(imgs), expected_frames))
+    if not len(flow_x) == len(flow_y) == max(len(imgs) - 1, 0):
+        errors.append("{} frames but {} flow_x and {} flow_y".format(len(imgs), len(flow_x), len(flow_y)))
+    elif [flow_base(n, "flow_x") for n in flow_x] != [flow_base(n, "flow_y") for n in flow_y]:
+        errors.append("flow_x and flow_y names differ")
+    if decode:
+        for kind, check in (("img", check_frame), ("flow_x", check_flow), ("flow_y", check_flow)):
+            for name in names[kind]:
+                try:
+                    check(os.path.join(video_path, kind, name))
+                except Exception as e:
+                    errors.append("{}/{}: {}".format(kind, name, e))
+    return imgs, flow_x, flow_y, errors, warnings
+
+
+def _check_job(args):
+    check, video_dir, class_id, video_path = args
+    return (video_dir, class_id) + check(video_path)
+
+
+def list_videos(root, fold_lookup=None):
+    """ sorted class folders, and (video dir relative to root, class id) of every video in the split lists (of the tree without them) """
+    class_folders = sorted(c for c in os.listdir(root) if c[0] != '.' and os.path.isdir(os.path.join(root, c)))
+    videos = []
+    for class_id, class_folder in enumerate(class_folders):
+        for video_folder in sorted(os.listdir(os.path.join(root, class_folder))):
+            if (fold_lookup is None or video_folder.lower() in fold_lookup) and os.path.isdir(os.path.join(root, class_folder, video_folder)):
+                videos.append((os.path.join(class_folder, video_folder), class_id))
+    return class_folders, videos
+
+
+def fsck(root, traintestlist, split, seq_len=8, expected_frames=None, decode=True, workers=None, log=print):
+    """
+    (DatasetManifest of the videos that passed, {video dir: {"frames": n, "errors": [...], "warnings": [...]}} of the
+    others). With traintestlist None every video of the tree is checked, and the manifest is not a valid index.
+    """
+    if traintestlist is None:
+        class_folders, videos = list_videos(root)
+        split_files = []
+    else:
+        class_folders, videos = list_videos(root, read_fold_lists(traintestlist, split))
+        split_files = fold_list_files(traintestlist, split)
+    log("checking {} videos of {} on {} workers".format(len(videos), root, workers))
+    manifest = DatasetManifest(class_folders, verified_index_fingerprint(root, split_files, seq_len))
+    problems = {}
+    progress = Progress(len(videos), log=log)
+    check = partial(check_video, seq_len=seq_len, expected_frames=expected_frames, decode=decode)
+    with Pool(workers or os.cpu_count()) as pool:
+        # in order, so the index lists the videos as read_dir would
+        results = pool.imap(_check_job, [(check, video_dir, class_id, os.path.join(root, video_dir)) for video_dir, class_id in videos], chunksize=8)
+        for video_dir, class_id, imgs, flow_x, flow_y, errors, warnings in results:
+            if errors or warnings:
+                problems[video_dir] = {"frames": len(imgs), "errors": errors, "warnings": warnings}
+            if not errors:
+                manifest.add_video(video_dir, class_id, imgs, flow_x, flow_y)
+            progress.update(len(imgs))
+    return manifest, problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", required=True, help="class/video/{img,flow_x,flow_y} dataset tree.")
+    parser.add_argument("--traintestlist", required=True, help="Directory with the split lists.")
+    parser.add_argument("--split", type=int, default=7)
+    parser.add_argument("--seq_len", type=int, default=8, help="Frames a video needs (the --seq_len of training).")
+    parser.add_argument("--expected_frames", type=int, default=None, help="Report videos with another number of frames.")
+    parser.add_argument("--no_decode", default=False, action="store_true", help="Check counts and names only, do not decode the files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes checking videos in parallel.")
+    parser.add_argument("--index", default=None, help="Write the verified index (.npz) of the videos that passed here.")
+    parser.add_argument("--report", default=None, help="Write the problems of every video (json) here.")
+    args = parser.parse_args()
+
+    manifest, problems = fsck(args.path, args.traintestlist, args.split, args.seq_len, args.expected_frames,
+                              not args.no_decode, args.workers)
+    failed = sorted(v for v, p in problems.items() if p["errors"])
+    for video_dir in sorted(problems):
+        for kind in ("errors", "warnings"):
+            for problem in problems[video_dir][kind]:
+                print("{} {}: {}".format(kind[:-1], os.path.join(args.path, video_dir), problem))
+    print("{} videos passed, {} failed, {} with warnings only".format(len(manifest), len(failed), len(problems) - len(failed)))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"path": os.path.abspath(args.path), "passed": len(manifest), "failed": failed, "videos": problems}, f, indent=1, sort_keys=True)
+    if args.index:
+        manifest.save(args.index)
+        print("verified index {}".format(args.index))
+
+
+if __name__ == "__main__":
+    main()
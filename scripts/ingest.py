@@ -0,0 +1,246 @@
+"""
+Single-pass ingest of a video dataset (src/<class>/<video>.avi) into the format VideoDataset reads, replacing
+extract_frames.py, shrink_dataset.py and extract_flow.py (and pack_shards.py with --format shards).
+
+Each video is decoded once and only the --max_seq_len evenly spaced frames shrink_dataset.py would keep (all of
+them for shorter videos) are converted and resized; the Farneback flow between consecutive kept frames, as
+extract_flow.py computes it, is computed in memory. Nothing but the final dataset is written:
+- --format tree: out/<class>/<video>/{img,flow_x,flow_y}, the frames as JPEG and the flow in --flow_format;
+- --format shards: the shard format of video_shards.py, --videos_per_shard videos per shard file.
+
+Videos are processed on --workers processes and the run is resumable (see video_jobs.py): a journal records the
+finished videos (tree) or shards (shards), and partial outputs of an interrupted run are removed when it resumes.
+A video that cannot be ingested is left out of the dataset: in a tree it is tried again on the next run, in shards
+its shard is completed without it and the video is listed, with the error, in <out>/ingest_failures.txt.
+
+usage: python scripts/ingest.py --src /data3/cse455/hmdb51_org --out /data3/cse455/hmdb51_shards \
+    --traintestlist splits/hmdb_ARN --format shards
+"""
+import argparse
+import os
+import sys
+import zlib
+from collections import deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from flow_codec import FLOW_BOUND, FLOW_CROP_SIZE, FLOW_FORMATS, encode_flow, write_flow_format
+from video_jobs import (JOURNAL_NAME, PARTIAL_SUFFIX, Journal, Progress, add_common_args, init_worker, read_split_lists,
+                        remove_partials, run_jobs)
+from video_shards import ShardWriter, write_shards_file
+
+FAILURES_NAME = "ingest_failures.txt"
+
+
+def sample_positions(n_frames, max_seq_len):
+    """ positions of the frames kept from a video of n_frames, as shrink_dataset.py picks them """
+    if n_frames <= max_seq_len:
+        return list(range(n_frames))
+    return [int(f) for f in np.linspace(0, n_frames - 1, num=max_seq_len)]
+
+
+def grab_frames(source_vid, wanted, size):
+    """
+    ({position: frame resized to size (w, h)} of the frames of a video at the positions in wanted, number of frames
+    grabbed). The other frames are only grabbed, never converted or resized.
+    """
+    cap = cv2.VideoCapture(source_vid)
+    if not cap.isOpened():
+        raise IOError("cannot open {}".format(source_vid))
+    frames = {}
+    n = 0
+    try:
+        while cap.grab():
+            if n in wanted:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                frames[n] = cv2.resize(frame, size)
+            n += 1
+    finally:
+        cap.release()
+    return frames, n
+
+
+def decode_sampled(source_vid, max_seq_len, size):
+    """
+    The kept frames of a video, resized to size (w, h). The container's frame count picks the frames; when there is
+    none or it turns out to be wrong, the frames are picked from the number of frames grabbed and the video is
+    decoded a second time keeping only those, so at most max_seq_len frames are held at any time.
+    """
+    cap = cv2.VideoCapture(source_vid)
+    if not cap.isOpened():
+        raise IOError("cannot open {}".format(source_vid))
+    hint = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if hint > 0:
+        wanted = set(sample_positions(hint, max_seq_len))
+        frames, n = grab_frames(source_vid, wanted, size)
+        if n == hint and len(frames) == len(wanted):
+            return [frames[i] for i in sorted(frames)]
+    else:
+        _, n = grab_frames(source_vid, set(), size)
+    frames, _ = grab_frames(source_vid, set(sample_positions(n, max_seq_len)), size)
+    return [frames[i] for i in sorted(frames)]
+
+
+def ingest_video(source_vid, max_seq_len=8, size=(256, 256), jpeg_quality=95, flow_format="uint8", flow_bound=FLOW_BOUND):
+    """ (list of jpeg bytes, flow (T - 1, 2, H, W) in flow_format) of the kept frames of one video """
+    frames = decode_sampled(source_vid, max_seq_len, size)
+    if not frames:
+        raise IOError("no frames decoded from {}".format(source_vid))
+    jpegs = []
+    for frame in frames:
+        ret, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        if not ret:
+            raise IOError("cannot encode a frame of {}".format(source_vid))
+        jpegs.append(buf.tobytes())
+    crop = flow_format != "float32"
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    flows = [cv2.calcOpticalFlowFarneback(prev, cur, None, 0.5, 3, 15, 3, 5, 1.2, 0) for prev, cur in zip(grays, grays[1:])]
+    if flows:
+        flow = encode_flow(np.stack(flows).transpose(0, 3, 1, 2), flow_format, flow_bound, crop)
+    else:
+        shape = (FLOW_CROP_SIZE, FLOW_CROP_SIZE) if crop else (size[1], size[0])
+        flow = encode_flow(np.zeros((0, 2) + shape, dtype=np.float32), flow_format, flow_bound, crop)
+    return jpegs, flow
+
+
+def write_video_tree(source_vid, out_path, **options):
+    """ one video as an img/flow_x/flow_y folder, with the file names of extract_flow.py """
+    jpegs, flow = ingest_video(source_vid, **options)
+    for kind in ("img", "flow_x", "flow_y"):
+        os.makedirs(os.path.join(out_path, kind))
+    for i, jpeg in enumerate(jpegs):
+        with open(os.path.join(out_path, "img", "{:08d}.jpg".format(i + 1)), "wb") as f:
+            f.write(jpeg)
+    for i in range(len(flow)):
+        for k, kind in enumerate(("flow_x", "flow_y")):
+            np.save(os.path.join(out_path, kind, "{:08d}_{}.npy".format(i + 2, kind)), flow[i, k])
+    return len(jpegs)
+
+
+def _ingest_job(args):
+    fn, source_vid = args
+    try:
+        return fn(source_vid), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def bounded_imap(pool, fn, items, window):
+    """ pool.imap(fn, items) with at most window items submitted and not yet consumed, so results never pile up in this process """
+    items = iter(items)
+    pending = deque(pool.apply_async(fn, (item,)) for item in islice(items, window))
+    while pending:
+        result = pending.popleft().get()
+        for item in islice(items, 1):
+            pending.append(pool.apply_async(fn, (item,)))
+        yield result
+
+
+def write_shards(videos, out, videos_per_shard, workers, redo, options, log=print):
+    """
+    Pack (class, video, source) videos into shards, shard_<i>.bin holding videos [i * videos_per_shard, ...) in
+    order. Workers ingest videos, at most two per worker ahead of this process, which writes the shards, each as
+    <name>.partial renamed when complete. A video that fails is left out of its shard and appended to the failures
+    file with its error, so one bad source does not keep its shard, and the dataset, from being written. Returns
+    the failed "class/video"s.
+    """
+    removed = remove_partials(out)
+    if removed:
+        log("removed {} partial outputs of an interrupted run".format(removed))
+    journal = Journal(os.path.join(out, JOURNAL_NAME), redo)
+    failures_path = os.path.join(out, FAILURES_NAME)
+    if redo and os.path.exists(failures_path):
+        os.remove(failures_path)
+    shards = [("shard_{:05d}.bin".format(i), videos[start:start + videos_per_shard])
+              for i, start in enumerate(range(0, len(videos), videos_per_shard))]
+    # journalled with the videos they hold, so a shard is done again if the video list or --videos_per_shard changes
+    key = lambda name, shard_videos: "{} {:08x}".format(name, zlib.crc32("\n".join(c + "/" + v for c, v, _ in shard_videos).encode("utf-8")))
+    todo = [(name, shard_videos) for name, shard_videos in shards if key(name, shard_videos) not in journal]
+    n_todo = sum(len(shard_videos) for _, shard_videos in todo)
+    log("{} videos in {} shards, {} shards already done, {} videos to do on {} workers".format(
+        len(videos), len(shards), len(shards) - len(todo), n_todo, workers))
+    failed = []
+    progress = Progress(n_todo, log=log)
+    ingest = partial(ingest_video, **options)
+    try:
+        with Pool(max(1, workers), initializer=init_worker) as pool, open(failures_path, "a") as failures:
+            # in order, so the videos of each shard arrive together, and two per worker ahead of the writer
+            results = bounded_imap(pool, _ingest_job, ((ingest, source) for _, shard_videos in todo for _, _, source in shard_videos),
+                                   2 * max(1, workers))
+            for name, shard_videos in todo:
+                path = os.path.join(out, name)
+                with ShardWriter(path + PARTIAL_SUFFIX) as writer:
+                    for class_folder, video_folder, _ in shard_videos:
+                        result, error = next(results)
+                        if error is not None:
+                            failed.append("{}/{}".format(class_folder, video_folder))
+                            log("failed {}: {}".format(failed[-1], error))
+                            # written before the shard is journalled, so a resumed run never loses the record
+                            failures.write("{}\t{}\t{}\n".format(failed[-1], name, error))
+                            failures.flush()
+                        else:
+                            writer.add_video(class_folder, video_folder, *result)
+                        progress.update(len(result[0]) if result else 0)
+                os.replace(path + PARTIAL_SUFFIX, path)
+                journal.record(key(name, shard_videos))
+    finally:
+        journal.close()
+    return failed
+
+
+def list_videos(src, traintestlist, ext):
+    """ (class, video, source file) of every video, sorted """
+    if traintestlist:
+        videos = sorted({(c, v) for items in read_split_lists(traintestlist).values() for c, v in items})
+    else:
+        videos = [(c, os.path.splitext(v)[0]) for c in sorted(os.listdir(src)) if os.path.isdir(os.path.join(src, c))
+                  for v in sorted(os.listdir(os.path.join(src, c))) if v.endswith(ext)]
+    return [(c, v, os.path.join(src, c, v + ext)) for c, v in videos]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser, "Directory of <class>/<video> files.", "Output dataset directory.")
+    parser.add_argument("--format", choices=("tree", "shards"), default="shards", help="Layout of the dataset written.")
+    parser.add_argument("--ext", default=".avi", help="Extension of the video files.")
+    parser.add_argument("--max_seq_len", type=int, default=8, help="Frames kept per video.")
+    parser.add_argument("--size", type=int, nargs=2, default=[256, 256], metavar=("W", "H"), help="Size of the frames written.")
+    parser.add_argument("--jpeg_quality", type=int, default=95, help="JPEG quality of the frames written.")
+    parser.add_argument("--flow_format", choices=FLOW_FORMATS, default="uint8", help="Storage format of the flow.")
+    parser.add_argument("--flow_bound", type=float, default=FLOW_BOUND, help="Clipping bound for uint8 flow.")
+    parser.add_argument("--videos_per_shard", type=int, default=256, help="Videos packed into each shard file.")
+    args = parser.parse_args()
+
+    options = {"max_seq_len": args.max_seq_len, "size": tuple(args.size), "jpeg_quality": args.jpeg_quality,
+               "flow_format": args.flow_format, "flow_bound": args.flow_bound}
+    videos = list_videos(args.src, args.traintestlist, args.ext)
+    os.makedirs(args.out, exist_ok=True)
+    if args.format == "tree":
+        jobs = []
+        for c, v, source in videos:
+            os.makedirs(os.path.join(args.out, c), exist_ok=True)
+            jobs.append((os.path.join(c, v), source, os.path.join(args.out, c, v)))
+        failed = run_jobs(partial(write_video_tree, **options), jobs, args.out, args.workers, args.redo)
+        write_flow_format(args.out, args.flow_format, args.flow_bound)
+    else:
+        failed = write_shards(videos, args.out, args.videos_per_shard, args.workers, args.redo, options)
+        write_flow_format(args.out, args.flow_format, args.flow_bound)
+        n_shards = (len(videos) + args.videos_per_shard - 1) // args.videos_per_shard
+        # written last, so a partial ingest is never picked up as a dataset
+        write_shards_file(args.out, ["shard_{:05d}.bin".format(i) for i in range(n_shards)], sorted({c for c, _, _ in videos}))
+        if failed:
+            print("{} videos failed and were left out of the shards, see {}".format(len(failed), os.path.join(args.out, FAILURES_NAME)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Generates a seeded episode manifest (see episode_manifest.py) for a dataset and split, to be replayed with
+run.py --episode_manifest, by default of the test split with the evaluation episode shape.
+
+usage: python scripts/make_episode_manifest.py --path /data3/cse455/hmdb51_org_256x256q5_rgb_flow \
+    --traintestlist splits/hmdb51OurSplits --episodes 10000 --seed 0 --out manifests/hmdb51_test_10000_s0.npz
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from episode_manifest import generate_episodes
+from video_reader import VideoDataset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", required=True, help="Dataset the episodes are drawn from (tree, zip or shards).")
+    parser.add_argument("--traintestlist", required=True, help="Directory with the split lists.")
+    parser.add_argument("--split", type=int, default=7, help="Dataset split.")
+    parser.add_argument("--out", required=True, help="Manifest file written (.npz).")
+    parser.add_argument("--episodes", type=int, default=10000, help="Number of episodes.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the episode sampling.")
+    parser.add_argument("--train", default=False, action="store_true", help="Draw episodes of the train split instead of the test split.")
+    parser.add_argument("--way", type=int, default=5)
+    parser.add_argument("--shot", type=int, default=5)
+    parser.add_argument("--query_per_class", type=int, default=5, help="Queries per class of train episodes.")
+    parser.add_argument("--query_per_class_test", type=int, default=1, help="Queries per class of test episodes.")
+    parser.add_argument("--seq_len", type=int, default=8, help="Frames per clip.")
+    parser.add_argument("--manifest_dir", default=None, help="Directory for cached dataset manifests.")
+    parser.add_argument("--no_manifest_cache", default=False, action="store_true", help="Always list the dataset tree.")
+    args = parser.parse_args()
+    if args.episodes < 1:
+        parser.error("--episodes must be positive")
+
+    # frames are never read, only the index of the dataset is needed
+    dataset = VideoDataset(argparse.Namespace(path=args.path, traintestlist=args.traintestlist, split=args.split,
+                                              seq_len=args.seq_len, img_size=224, way=args.way, shot=args.shot,
+                                              query_per_class=args.query_per_class,
+                                              query_per_class_test=args.query_per_class_test, debug_loader=False,
+                                              manifest_dir=args.manifest_dir, no_manifest_cache=args.no_manifest_cache))
+    manifest = generate_episodes(dataset, args.episodes, args.seed, train=args.train)
+    manifest.save(args.out)
+    n_videos = len(np.unique(np.concatenate([manifest.support_videos.ravel(), manifest.query_videos.ravel()])))
+    print("{}: {} {} episodes, {}-way {}-shot, {} queries, {} distinct videos, {:.1f} KB".format(
+        args.out, len(manifest), "train" if args.train else "test", manifest.way, manifest.support_videos.shape[1] // manifest.way,
+        manifest.query_videos.shape[1], n_videos, os.path.getsize(args.out) / 1024))
+
+
+if __name__ == "__main__":
+    main()
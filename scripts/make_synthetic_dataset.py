@@ -0,0 +1,62 @@
+"""
+Write a small synthetic dataset in the layout VideoDataset reads, for the bench scripts and quick checks without
+HMDB51: out/class<c>/vid_<c>_<v>/ with img/00000001.jpg.. of random RGB noise and flow_x/flow_y/<n>_flow_x.npy..
+of float32 noise (std --flow_std) from the second frame on, plus trainlist<split>.txt and testlist<split>.txt in
+--splits with the first --train_classes classes for training and the others for testing.
+
+The data is drawn from a fixed seed, so two runs write the same dataset. Timings quoted for the loader were taken
+on the default one (8 classes of 8 videos, 8 frames of 256x256).
+
+usage: python scripts/make_synthetic_dataset.py --out /tmp/fx/data --splits /tmp/fx/splits
+       python run.py --path /tmp/fx/data --traintestlist /tmp/fx/splits --split 7 ...
+"""
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def make_video(video_dir, rng, n_frames=8, size=256, flow_std=3.0):
+    for sub in ["img", "flow_x", "flow_y"]:
+        os.makedirs(os.path.join(video_dir, sub), exist_ok=True)
+    for i in range(n_frames):
+        frame = (rng.rand(size, size, 3) * 255).astype(np.uint8)
+        Image.fromarray(frame).save(os.path.join(video_dir, "img", "{:08d}.jpg".format(i + 1)))
+        if i > 0:
+            for axis in ["x", "y"]:
+                flow = rng.randn(size, size).astype(np.float32) * flow_std
+                np.save(os.path.join(video_dir, "flow_" + axis, "{:08d}_flow_{}.npy".format(i + 1, axis)), flow)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True, help="Dataset root to write.")
+    parser.add_argument("--splits", required=True, help="Directory for the split lists.")
+    parser.add_argument("--split", type=int, default=7, help="Number in the names of the split lists.")
+    parser.add_argument("--classes", type=int, default=8)
+    parser.add_argument("--train_classes", type=int, default=6, help="Classes in the train list, the rest are test classes.")
+    parser.add_argument("--videos", type=int, default=8, help="Videos per class.")
+    parser.add_argument("--frames", type=int, default=8, help="Frames per video.")
+    parser.add_argument("--size", type=int, default=256, help="Height and width of frames and flow.")
+    parser.add_argument("--flow_std", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    os.makedirs(args.splits, exist_ok=True)
+    train, test = [], []
+    for c in range(args.classes):
+        class_folder = "class{}".format(c)
+        for v in range(args.videos):
+            video_folder = "vid_{}_{}".format(c, v)
+            make_video(os.path.join(args.out, class_folder, video_folder), rng, args.frames, args.size, args.flow_std)
+            (train if c < args.train_classes else test).append("{}/{}".format(class_folder, video_folder))
+    for name, videos in [("trainlist", train), ("testlist", test)]:
+        with open(os.path.join(args.splits, "{}{:02d}.txt".format(name, args.split)), "w") as f:
+            f.write("\n".join(videos) + "\n")
+    print("{} train and {} test videos written to {}".format(len(train), len(test), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Pack a class/video/{img,flow_x,flow_y} tree (as written by extract_flow.py) into the shard format of
+video_shards.py, which VideoDataset reads when --path points at the output directory.
+
+JPEG bytes are copied as they are, without re-encoding. The flow of each video is stacked into one (T, 2, H, W)
+array, cropped to the 224 x 224 window the loader uses unless --no_flow_crop is given, and stored in
+--flow_format (see flow_codec.py).
+
+usage: python scripts/pack_shards.py --src /data3/cse455/hmdb51_org_256x256q5_rgb_flow --out /data3/cse455/hmdb51_shards
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_codec import FLOW_BOUND, FLOW_CROP_SIZE, FLOW_FORMATS, decode_flow, encode_flow, read_flow_bound, write_flow_format
+from video_shards import ShardWriter, write_shards_file
+
+
+def list_videos(src):
+    class_folders = sorted(c for c in os.listdir(src) if c[0] != '.' and os.path.isdir(os.path.join(src, c)))
+    videos = []
+    for class_folder in class_folders:
+        for video_folder in sorted(os.listdir(os.path.join(src, class_folder))):
+            if os.path.isdir(os.path.join(src, class_folder, video_folder, "img")):
+                videos.append((class_folder, video_folder))
+    return class_folders, videos
+
+
+def load_video(video_path, crop, flow_format, src_bound, bound):
+    """ (list of jpeg bytes, flow array (T, 2, H, W) in flow_format) of one video folder """
+    jpegs = []
+    for name in sorted(os.listdir(os.path.join(video_path, "img"))):
+        with open(os.path.join(video_path, "img", name), "rb") as f:
+            jpegs.append(f.read())
+    flows = []
+    for kind in ("flow_x", "flow_y"):
+        arrays = [np.load(os.path.join(video_path, kind, name)) for name in sorted(os.listdir(os.path.join(video_path, kind)))]
+        # the source tree may itself hold compact flow
+        arrays = [encode_flow(decode_flow(a, src_bound), flow_format, bound, crop) for a in arrays]
+        flows.append(arrays)
+    if len(flows[0]) != len(flows[1]):
+        raise ValueError("{}: {} flow_x but {} flow_y frames".format(video_path, len(flows[0]), len(flows[1])))
+    if flows[0]:
+        flow = np.stack([np.stack(flows[0]), np.stack(flows[1])], axis=1)
+    else:
+        flow = encode_flow(np.zeros((0, 2, FLOW_CROP_SIZE, FLOW_CROP_SIZE), dtype=np.float32), flow_format, bound, crop)
+    return jpegs, flow
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", required=True, help="class/video/{img,flow_x,flow_y} dataset tree.")
+    parser.add_argument("--out", required=True, help="Output directory for the shards.")
+    parser.add_argument("--videos_per_shard", type=int, default=256, help="Videos packed into each shard file.")
+    parser.add_argument("--no_flow_crop", default=False, action="store_true", help="Store the flow uncropped.")
+    parser.add_argument("--flow_format", choices=FLOW_FORMATS, default="float32", help="Storage format of the flow.")
+    parser.add_argument("--flow_bound", type=float, default=FLOW_BOUND, help="Clipping bound for uint8 flow.")
+    args = parser.parse_args()
+
+    class_folders, videos = list_videos(args.src)
+    src_bound = read_flow_bound(args.src)
+    os.makedirs(args.out, exist_ok=True)
+    shard_names = []
+    for start in range(0, len(videos), args.videos_per_shard):
+        shard_name = "shard_{:05d}.bin".format(len(shard_names))
+        with ShardWriter(os.path.join(args.out, shard_name)) as writer:
+            for class_folder, video_folder in videos[start:start + args.videos_per_shard]:
+                jpegs, flow = load_video(os.path.join(args.src, class_folder, video_folder), not args.no_flow_crop,
+                                         args.flow_format, src_bound, args.flow_bound)
+                writer.add_video(class_folder, video_folder, jpegs, flow)
+        shard_names.append(shard_name)
+        print("{}: {}/{} videos".format(shard_name, min(start + args.videos_per_shard, len(videos)), len(videos)), flush=True)
+    write_flow_format(args.out, args.flow_format, args.flow_bound)
+    # written last, so a partial conversion is never picked up as a dataset
+    write_shards_file(args.out, shard_names, class_folders)
+
+
+if __name__ == "__main__":
+    main()
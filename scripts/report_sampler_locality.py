@@ -0,0 +1,118 @@
+"""
+Working set of training episodes: unique bytes of frame and flow files touched per --block episodes, with the
+uniform episode sampler of VideoDataset and with the windowed sampler (episode_sampler.py) for several class
+windows. Episodes are only planned (classes, videos and frames drawn as in training), nothing is decoded.
+
+Also reports how far class and video frequencies over all simulated episodes are from uniform (max / min count),
+which for the windowed sampler converges to the uniform sampler's after full turns of the class ring.
+
+usage: python scripts/report_sampler_locality.py --path /data3/cse455/hmdb51_org_256x256q5_rgb_flow \
+    --traintestlist splits/hmdb_ARN --episodes 10000 --class_windows 8 16 32 --video_window 20
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from episode_sampler import WindowedEpisodeSampler
+from video_reader import VideoDataset
+
+
+class TouchedBytes():
+    """ sizes of the files (or zip members, or shard ranges) a clip reads, by a key unique to each """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.sizes = {}
+
+    def clip(self, paths, paths_flow_x, paths_flow_y, idxs, idxs_flow):
+        d = self.dataset
+        if d.shards:
+            video = paths
+            flow_bytes = int(np.prod(video.flow_shape[1:])) * video.flow_dtype.itemsize
+            return ([((video.shard, int(video.frame_offsets[i])), int(video.frame_offsets[i + 1] - video.frame_offsets[i])) for i in idxs] +
+                    [((video.shard, video.flow_offset + i * flow_bytes), flow_bytes) for i in idxs_flow])
+        names = [paths[i] for i in idxs] + [p[i] for i in idxs_flow for p in (paths_flow_x, paths_flow_y)]
+        return [(name, self.size(name)) for name in names]
+
+    def size(self, name):
+        if name not in self.sizes:
+            self.sizes[name] = self.dataset.zfile.members[name][1] if self.dataset.zip else os.path.getsize(name)
+        return self.sizes[name]
+
+
+def simulate(dataset, touched, sampler, episodes, block, seed):
+    """ unique bytes per block of episodes, and the class and video counts over all episodes """
+    random.seed(seed)
+    c = dataset.train_split
+    classes = c.get_unique_classes()
+    n_videos = dataset.args.shot + dataset.args.query_per_class
+    block_bytes = []
+    class_counts, video_counts = Counter(), Counter()
+    seen = {}
+    for index in range(episodes):
+        if sampler is None:
+            batch_classes = random.sample(classes, dataset.way)
+            videos = {bc: random.sample(range(c.get_num_videos_for_class(bc)), n_videos) for bc in batch_classes}
+        else:
+            batch_classes, videos = sampler.episode(index, dataset.way, n_videos)
+        for bc in batch_classes:
+            class_counts[bc] += 1
+            for idx in videos[bc]:
+                paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id = dataset.plan_seq(bc, idx)
+                video_counts[vid_id] += 1
+                seen.update(touched.clip(paths, paths_flow_x, paths_flow_y, idxs, idxs_flow))
+        if (index + 1) % block == 0:
+            block_bytes.append(sum(seen.values()))
+            seen = {}
+    return block_bytes, class_counts, video_counts
+
+
+def spread(counts, n):
+    """ max / min count, over n items """
+    values = list(counts.values()) + [0] * (n - len(counts))
+    return max(values) / max(min(values), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", required=True, help="Dataset (tree, zip or shards).")
+    parser.add_argument("--traintestlist", required=True, help="Directory with the split lists.")
+    parser.add_argument("--split", type=int, default=7)
+    parser.add_argument("--episodes", type=int, default=10000, help="Training episodes simulated per sampler.")
+    parser.add_argument("--block", type=int, default=1000, help="Episodes per working-set measurement.")
+    parser.add_argument("--class_windows", type=int, nargs='+', default=[8, 16, 32], help="Class windows of the windowed sampler.")
+    parser.add_argument("--video_window", type=int, default=20, help="Videos per class in the window.")
+    parser.add_argument("--shift_every", type=int, default=100, help="Episodes between moves of the class window.")
+    parser.add_argument("--way", type=int, default=5)
+    parser.add_argument("--shot", type=int, default=5)
+    parser.add_argument("--query_per_class", type=int, default=5)
+    parser.add_argument("--seq_len", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no_manifest_cache", default=False, action="store_true", help="Always list the dataset tree.")
+    args = parser.parse_args()
+
+    dataset = VideoDataset(argparse.Namespace(path=args.path, traintestlist=args.traintestlist, split=args.split,
+                                              seq_len=args.seq_len, img_size=224, way=args.way, shot=args.shot,
+                                              query_per_class=args.query_per_class, query_per_class_test=1,
+                                              debug_loader=False, no_manifest_cache=args.no_manifest_cache))
+    touched = TouchedBytes(dataset)
+    n_classes, n_videos = len(dataset.train_split.get_unique_classes()), len(dataset.train_split)
+    samplers = [("uniform", None)] + [("window {:3d}/{:d}".format(w, args.video_window),
+                                       WindowedEpisodeSampler(dataset.train_split, max(w, args.way), args.video_window, args.shift_every, args.seed))
+                                      for w in args.class_windows]
+    reference = None
+    for name, sampler in samplers:
+        block_bytes, class_counts, video_counts = simulate(dataset, touched, sampler, args.episodes, args.block, args.seed)
+        mean = np.mean(block_bytes) if block_bytes else 0.0
+        reference = reference or mean
+        print("{:>14}: {:9.1f} MB unique per {} episodes ({:.2f}x uniform), class counts max/min {:.2f}, video counts max/min {:.2f}".format(
+            name, mean / 2 ** 20, args.block, mean / reference if reference else 0.0,
+            spread(class_counts, n_classes), spread(video_counts, n_videos)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,69 @@
+"""
+Reduce every video folder of a frame dataset written by extract_frames.py to at most --max_seq_len evenly spaced
+frames: src/<split>/<class>/<video> (or src/<class>/<video>) becomes out/<class>/<video>, the splits merged.
 
-import os
+Videos are copied on --workers processes, and the run is resumable: see video_jobs.py.
+
+usage: python scripts/shrink_dataset.py --src /data3/cse455/hmdb51_org_256x256q5 --out /data3/cse455/hmdb51_org_256x256q5_l8
+"""
+import argparse
 import glob
+import os
 import shutil
-import numpy as np
+import sys
+from functools import partial
 
-max_seq_len = 8
+import numpy as np
 
-old_dir = "/Users/daithyren/Desktop/School/graduate/UW/2024_winter/CSE455_computer_vision/final_proj/datasets/hmdb51_org_256x256q5"
-new_dir = "/Users/daithyren/Desktop/School/graduate/UW/2024_winter/CSE455_computer_vision/final_proj/datasets/hmdb51_org_256x256q5_l{}".format(max_seq_len)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from video_jobs import add_common_args, read_split_lists, run_jobs
 
-# 新的实现考虑到old_dir下的train, test, val文件夹
 data_types = ['train', 'test', 'val']
 
-os.mkdir(new_dir)
-
-src_jpgs = 0
-tgt_jpgs = 0
 
-for data_type in data_types:
-    
-    data_type_dir = os.path.join(old_dir, data_type)
-    classes = [j for j in glob.glob(os.path.join(data_type_dir, "*")) if os.path.isdir(j)]
+def shrink_video(video_folder, new_v, max_seq_len=8):
+    jpgs = sorted(glob.glob(os.path.join(video_folder, "*.jpg")))
+    n_jpgs = len(jpgs)
+    if n_jpgs <= max_seq_len:
+        for src in jpgs:
+            shutil.copy(src, os.path.join(new_v, os.path.basename(src)))
+        return n_jpgs
 
-    for class_folder in classes:
-        c = os.path.split(class_folder)[-1]
-        new_c = os.path.join(new_dir, c)
+    idx_f = np.linspace(0, n_jpgs-1, num=max_seq_len)
+    idxs = [int(f) for f in idx_f]
+    for i in range(len(idxs)):
+        src = jpgs[idxs[i]]
+        tgt = os.path.join(new_v, "{:08d}.jpg".format(i+1))
+        shutil.copy(src, tgt)
+    return len(idxs)
 
-        if not os.path.exists(new_c):
-            os.mkdir(new_c)
 
-        for video_folder in glob.glob(os.path.join(class_folder, "*")):
-            v = os.path.split(video_folder)[-1]
-            new_v = os.path.join(new_c, v)
+def list_jobs(src, out, traintestlist):
+    """ (key, source folder, shrunk folder) of every video """
+    if traintestlist:
+        videos = [(os.path.join(src, split, c, v), c, v) for split, items in read_split_lists(traintestlist).items() for c, v in items]
+    else:
+        # the splits written by extract_frames.py, or the class folders directly
+        roots = [os.path.join(src, d) for d in data_types if os.path.isdir(os.path.join(src, d))] or [src]
+        videos = [(os.path.join(root, c, v), c, v) for root in roots for c in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, c))
+                  for v in sorted(os.listdir(os.path.join(root, c))) if os.path.isdir(os.path.join(root, c, v))]
+    jobs = []
+    for video_folder, c, v in videos:
+        os.makedirs(os.path.join(out, c), exist_ok=True)
+        jobs.append((os.path.join(c, v), video_folder, os.path.join(out, c, v)))
+    return jobs
 
-            print("ss")
-            jpgs = [j for j in glob.glob(os.path.join(video_folder, "*.jpg"))]
 
-            n_jpgs = len(jpgs)
-            src_jpgs += n_jpgs
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser, "Frame dataset written by extract_frames.py.", "Output directory of the shrunk dataset.")
+    parser.add_argument("--max_seq_len", type=int, default=8, help="Frames kept per video.")
+    args = parser.parse_args()
 
-            if n_jpgs <= max_seq_len:
-                tgt_jpgs += n_jpgs
-                shutil.copytree(video_folder, new_v)
-            else:
-                os.mkdir(new_v)
-                jpgs.sort()
+    jobs = list_jobs(args.src, args.out, args.traintestlist)
+    failed = run_jobs(partial(shrink_video, max_seq_len=args.max_seq_len), jobs, args.out, args.workers, args.redo)
+    sys.exit(1 if failed else 0)
 
-                idx_f = np.linspace(0, n_jpgs-1, num=max_seq_len)
-                idxs = [int(f) for f in idx_f]
-                # print(len(idxs))
-                for i in range(len(idxs)):
-                    src = jpgs[idxs[i]]
-                    tgt = os.path.join(new_v, "{:08d}.jpg".format(i+1))
-                    shutil.copy(src, tgt)
-                    tgt_jpgs += 1
 
-print("Reduced {} to {} jpgs".format(src_jpgs, tgt_jpgs))
+if __name__ == "__main__":
+    main()
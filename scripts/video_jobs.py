@@ -0,0 +1,164 @@
+"""
+Command line, completion journal and process pool shared by the per-video dataset scripts (extract_frames.py,
+shrink_dataset.py, extract_flow.py, ingest.py).
+
+A script lists its videos as jobs (a key, an input and an output folder) and a function that builds one output
+folder. run_jobs runs the function on --workers processes and records every finished video in a journal file in
+the output directory, one key per line, appended only after the folder is complete. A video is written to
+<folder>.partial and renamed into place when done, so an interrupted run leaves at most partial folders behind:
+they are removed when the run is resumed, and the videos not in the journal are done again.
+"""
+import os
+import shutil
+import time
+from glob import glob
+from multiprocessing import Pool
+
+JOURNAL_NAME = ".done"
+PARTIAL_SUFFIX = ".partial"
+
+
+def add_common_args(parser, src_help, out_help):
+    parser.add_argument("--src", required=True, help=src_help)
+    parser.add_argument("--out", required=True, help=out_help)
+    parser.add_argument("--traintestlist", default=None,
+                        help="Directory with the split lists (e.g. splits/hmdb_ARN): only the videos they name are processed.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes working on videos in parallel.")
+    parser.add_argument("--redo", default=False, action="store_true", help="Ignore the journal and process every video again.")
+
+
+def read_split_lists(traintestlist):
+    """ {split name: [(class, video), ...]} from the train/val/test lists of a split directory """
+    splits = {}
+    for fn in sorted(glob(os.path.join(traintestlist, "*.txt"))):
+        name = os.path.basename(fn)
+        split = "train" if "train" in name else "val" if "val" in name else "test" if "test" in name else None
+        if split is None:
+            continue
+        with open(fn) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        splits.setdefault(split, []).extend((line.split('/')[-2], os.path.splitext(line.split('/')[-1])[0]) for line in lines)
+    return splits
+
+
+class Journal():
+    """ keys of the finished videos, appended to a file as they finish """
+    def __init__(self, path, redo=False):
+        self.path = path
+        self.done = set()
+        if redo and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                # a line is complete only with its newline: a run killed mid-write leaves no half key behind
+                self.done = {line[:-1] for line in f if line.endswith("\n")}
+        self.file = open(path, "a")
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def record(self, key):
+        self.done.add(key)
+        self.file.write(key + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def remove_partials(out):
+    """ remove the <folder>.partial directories (and <file>.partial files) an interrupted run left under out """
+    removed = 0
+    for root, dirs, files in os.walk(out):
+        for d in list(dirs):
+            if d.endswith(PARTIAL_SUFFIX):
+                shutil.rmtree(os.path.join(root, d))
+                dirs.remove(d)
+                removed += 1
+        for name in files:
+            if name.endswith(PARTIAL_SUFFIX):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+def _run_job(args):
+    fn, key, src, dst = args
+    partial = dst + PARTIAL_SUFFIX
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    try:
+        n_frames = fn(src, partial)
+    except Exception as e:
+        shutil.rmtree(partial, ignore_errors=True)
+        return key, None, "{}: {}".format(type(e).__name__, e)
+    # a folder from an earlier run that did not make it into the journal
+    shutil.rmtree(dst, ignore_errors=True)
+    os.rename(partial, dst)
+    return key, n_frames, None
+
+
+class Progress():
+    """ logs videos/s, frames/s and the time left, at most every log_every seconds and once at the end """
+    def __init__(self, total, log_every=10.0, log=print):
+        self.total = total
+        self.log_every = log_every
+        self.log = log
+        self.videos = self.frames = 0
+        self.start = self.last = time.time()
+
+    def update(self, frames):
+        self.videos += 1
+        self.frames += frames
+        now = time.time()
+        if now - self.last >= self.log_every or self.videos == self.total:
+            self.last = now
+            elapsed = max(now - self.start, 1e-9)
+            rate = self.videos / elapsed
+            self.log("{}/{} videos, {:.1f} videos/s, {:.0f} frames/s, eta {:.0f} s".format(
+                self.videos, self.total, rate, self.frames / elapsed, (self.total - self.videos) / max(rate, 1e-9)))
+
+
+def init_worker():
+    try:
+        import cv2
+        # one process per core already, OpenCV's own threads would only compete with the other workers
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+
+def run_jobs(fn, jobs, out, workers, redo=False, complete=None, log_every=10.0, log=print):
+    """
+    Run fn(src, dst_folder) -> number of frames written, for every (key, src, dst) job not in the journal of out,
+    on workers processes. fn must be picklable (a module-level function or a functools.partial of one).
+    complete(src, dst), if given, tells the dst folders found finished without being in the journal (written before
+    there was one), which are then recorded instead of done again. Returns the keys of the failed jobs.
+    """
+    os.makedirs(out, exist_ok=True)
+    removed = remove_partials(out)
+    if removed:
+        log("removed {} partial outputs of an interrupted run".format(removed))
+    journal = Journal(os.path.join(out, JOURNAL_NAME), redo)
+    if complete is not None and not redo:
+        for key, src, dst in jobs:
+            if key not in journal and complete(src, dst):
+                journal.record(key)
+    todo = [(fn, key, src, dst) for key, src, dst in jobs if key not in journal]
+    log("{} videos, {} already done, {} to do on {} workers".format(len(jobs), len(jobs) - len(todo), len(todo), workers))
+    failed = []
+    progress = Progress(len(todo), log_every, log)
+    try:
+        with Pool(max(1, workers), initializer=init_worker) as pool:
+            for key, frames, error in pool.imap_unordered(_run_job, todo):
+                if error is None:
+                    journal.record(key)
+                else:
+                    failed.append(key)
+                    log("failed {}: {}".format(key, error))
+                progress.update(frames or 0)
+    finally:
+        journal.close()
+    if failed:
+        log("{} videos failed, run again to retry them".format(len(failed)))
+    return failed
@@ -1,20 +1,19 @@
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from fsck_dataset import fsck
 
 # Define the root directory to search in
 root_dir = "/data3/cse455/hmdb51_org_256x256q5_rgb_flow"
 
-# Initialize a list to store directories with a different number of images than expected
-directories_with_diff_img_count = []
-
 # Define the expected number of images in each "img" directory
 expected_img_count = 8
 
-# Walk through the directory
-for subdir, dirs, files in os.walk(root_dir):
-    if subdir.endswith("/img"):  # Check if the directory ends with "/img"
-        img_count = len([file for file in files if file.endswith((".jpg", ".png"))])  # Count only image files
-        if img_count != expected_img_count:
-            directories_with_diff_img_count.append(subdir)
-            print(subdir)
-
-# print(directories_with_diff_img_count)
+# Counts only, of every video of the tree, on all cores; scripts/fsck_dataset.py also decodes every file and writes a verified index
+if __name__ == "__main__":
+    _, problems = fsck(root_dir, None, None, expected_frames=expected_img_count, decode=False)
+    directories_with_diff_img_count = [os.path.join(root_dir, video_dir, "img") for video_dir, p in sorted(problems.items())
+                                       if p["frames"] != expected_img_count]
+    for subdir in directories_with_diff_img_count:
+        print(subdir)
@@ -0,0 +1,198 @@
+"""Reading clips straight from the original video files (--video_dir), instead of from extracted JPEG frames.
+
+The dataset is a directory of <class>/<video>.avi (or .mp4, ...) files. A VideoIndex, built once and cached like
+the DatasetManifest of a frame tree, records the exact frame count of every video (containers often misreport it)
+and whether seeking in it lands on the right frame, checked by comparing a frame reached by seeking with the same
+frame reached by decoding from the start. A clip is decoded with OpenCV: the sampled frames only, seeking over long
+gaps when the video is seekable and grabbing (decoding without conversion) otherwise. Frames are resized to
+FRAME_SIZE x FRAME_SIZE, as extract_frames.py does, so clips match those of the frame datasets.
+
+There is no stored flow: the Farneback flow between consecutive sampled frames, as extract_flow.py computes it
+between the frames it is given, is computed when the clip is read.
+"""
+import os
+import json
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from flow_codec import crop_flow
+
+try:
+    import cv2
+except ImportError: # only needed with --video_dir
+    cv2 = None
+
+VIDEO_INDEX_VERSION = 1
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mkv", ".webm", ".mov", ".mpg")
+FRAME_SIZE = 256
+# frames between two sampled frames beyond which seeking beats grabbing the frames in between
+SEEK_GAP = 16
+
+
+class VideoFile(Sequence):
+    """ one video file, standing in for the frame paths of a video: len() is its number of frames """
+    __slots__ = ("path", "n_frames", "seekable")
+
+    def __init__(self, path, n_frames, seekable):
+        self.path = path
+        self.n_frames = n_frames
+        self.seekable = seekable
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(range(self.n_frames))[i]
+        if i < 0:
+            i += self.n_frames
+        if not 0 <= i < self.n_frames:
+            raise IndexError("frame index out of range")
+        return i
+
+
+def require_cv2():
+    if cv2 is None:
+        raise ImportError("reading video files (--video_dir) needs OpenCV: pip install opencv-python")
+
+
+def probe_video(path):
+    """ (number of frames, whether seeking to a frame gives the frame decoded from the start) of a video file """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return 0, False
+    probe = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 1) // 2
+    reference = None
+    n = 0
+    while cap.grab():
+        if n == probe:
+            ret, reference = cap.retrieve()
+        n += 1
+    cap.release()
+    if reference is None:
+        return n, False
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, probe)
+    ret, frame = cap.read()
+    cap.release()
+    return n, bool(ret) and frame.shape == reference.shape and np.array_equal(frame, reference)
+
+
+class VideoIndex():
+    """ class folders, and the path (relative to the root), class id, frame count and seekability of every video """
+    def __init__(self, class_folders, fingerprint=None):
+        self.class_folders = list(class_folders)
+        self.fingerprint = fingerprint
+        self.video_files = []
+        self.class_ids = []
+        self.n_frames = []
+        self.seekable = []
+
+    def __len__(self):
+        return len(self.video_files)
+
+    @classmethod
+    def build(cls, root, keep=None, threads=None, log=print):
+        """ index the videos under root whose name (file name without extension) keep(name) accepts """
+        require_cv2()
+        class_folders = sorted(c for c in os.listdir(root) if c[0] != '.' and os.path.isdir(os.path.join(root, c)))
+        index = cls(class_folders)
+        videos = []
+        for class_id, class_folder in enumerate(class_folders):
+            for name in sorted(os.listdir(os.path.join(root, class_folder))):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() in VIDEO_EXTENSIONS and (keep is None or keep(stem)):
+                    videos.append((os.path.join(class_folder, name), class_id))
+        log("indexing {} video files".format(len(videos)))
+        # OpenCV releases the GIL while decoding, so the videos are probed on threads
+        with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+            probes = pool.map(probe_video, [os.path.join(root, v) for v, _ in videos])
+            for (video_file, class_id), (n_frames, seekable) in zip(videos, probes):
+                index.video_files.append(video_file)
+                index.class_ids.append(class_id)
+                index.n_frames.append(n_frames)
+                index.seekable.append(seekable)
+        return index
+
+    def videos(self, root):
+        """ yields (video file relative to root, class id, VideoFile) for every video """
+        for video_file, class_id, n_frames, seekable in zip(self.video_files, self.class_ids, self.n_frames, self.seekable):
+            yield video_file, class_id, VideoFile(os.path.join(root, video_file), n_frames, seekable)
+
+    def save(self, path):
+        """ write atomically, so a concurrent reader never sees a partial index """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f,
+                     version=np.array(VIDEO_INDEX_VERSION),
+                     fingerprint=np.array(json.dumps(self.fingerprint, sort_keys=True)),
+                     class_folders=np.array(self.class_folders, dtype=str),
+                     video_files=np.array(self.video_files, dtype=str),
+                     class_ids=np.array(self.class_ids, dtype=np.int32),
+                     n_frames=np.array(self.n_frames, dtype=np.int64),
+                     seekable=np.array(self.seekable, dtype=np.bool_))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """ index written by save(), or None if missing, unreadable, of another version or of another fingerprint """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != VIDEO_INDEX_VERSION:
+                    return None
+                stored = json.loads(str(data["fingerprint"]))
+                if fingerprint is not None and stored != json.loads(json.dumps(fingerprint, sort_keys=True)):
+                    return None
+                index = cls(data["class_folders"].tolist(), stored)
+                index.video_files = data["video_files"].tolist()
+                index.class_ids = data["class_ids"].tolist()
+                index.n_frames = data["n_frames"].tolist()
+                index.seekable = data["seekable"].tolist()
+        except (OSError, KeyError, ValueError):
+            return None
+        return index
+
+
+def read_video_frames(video, idxs, size=FRAME_SIZE):
+    """ frames idxs (in any order, repeats allowed) of a VideoFile, as uint8 (size, size, 3) RGB arrays """
+    require_cv2()
+    cap = cv2.VideoCapture(video.path)
+    if not cap.isOpened():
+        raise IOError("cannot open {}".format(video.path))
+    frames = {}
+    position = 0 # index of the frame the next grab() decodes
+    try:
+        for i in sorted(set(idxs)):
+            if video.seekable and i - position > SEEK_GAP:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+                position = i
+            while position < i:
+                if not cap.grab():
+                    raise IOError("{} ends at frame {}, expected {} frames".format(video.path, position, len(video)))
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                raise IOError("cannot decode frame {} of {}".format(i, video.path))
+            position += 1
+            frames[i] = cv2.cvtColor(cv2.resize(frame, (size, size)), cv2.COLOR_BGR2RGB)
+    finally:
+        cap.release()
+    return [frames[i] for i in idxs]
+
+
+def clip_flow(frames, idxs_flow, out):
+    """
+    Farneback flow from frame t to frame t + 1 of a clip of RGB frames, for t in idxs_flow, into out
+    ((len(idxs_flow), 2, 224, 224), x then y flow, cropped to the window the loader uses).
+    """
+    grays = {}
+    for t, i in enumerate(idxs_flow):
+        for j in (i, i + 1):
+            if j not in grays:
+                grays[j] = cv2.cvtColor(frames[j], cv2.COLOR_RGB2GRAY)
+        flow = cv2.calcOpticalFlowFarneback(grays[i], grays[i + 1], None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        out[t] = crop_flow(flow.transpose(2, 0, 1))
+    return out
@@ -1,17 +1,143 @@
 import torch
+import torchvision
 from torchvision import datasets, transforms
 from PIL import Image
 import os
-import zipfile
 import io
 import numpy as np
 import random
 import re
 import pickle
+import json
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from glob import glob
 
 from videotransforms.video_transforms import Compose, Resize, RandomCrop, RandomRotation, ColorJitter, RandomHorizontalFlip, CenterCrop, TenCrop
 from videotransforms.volume_transforms import ClipToTensor
+from videotransforms.tensor_transforms import ClipResize, ClipRandomHorizontalFlip, ClipRandomCrop, ClipCenterCrop, ClipToFloat
+from mmap_zip import MmapZip, npy_from_buffer
+from flow_codec import FLOW_BOUND, FLOW_CROP_SIZE, FLOW_FORMAT_FILE, crop_flow, decode_flow, encode_flow, read_flow_format
+from video_shards import SHARDS_FILE, ShardReader, read_shard_index, read_shards_file
+from dataset_manifest import FRAME_EXTENSIONS, DatasetManifest, manifest_path, tree_fingerprint, verified_index_fingerprint
+from episode_manifest import EpisodeManifest, split_signature
+from episode_sampler import WindowedEpisodeSampler
+from video_store import VideoStore
+from video_files import VideoIndex, clip_flow, read_video_frames
+from clip_cache import KIND_FLOW_X, KIND_FLOW_Y, KIND_RGB, SharedFrameCache, frame_key
+
+# where read_dir caches dataset manifests unless --manifest_dir is given
+DEFAULT_MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cse455_final", "manifests")
+
+def read_fold_list(fname):
+    """
+    Parse one {train/test}list{03/07}.txt file into (class, video name) pairs, both normalised the way the
+    folders are looked up in read_dir.
+    """
+    pairs = []
+    with open(fname, "r") as fid:
+        for x in fid:
+            # eg: air drumming/-VtLx-mcPds_000012_000022
+            # -> air_drumming/-vtlx-mcpds_000012_000022
+            x = x.replace(' ', '_').lower().strip().split(" ")[0]
+            if not x:
+                continue
+            # -> os.path.split(x) : [air_drumming, -vtlx-mcpds_000012_000022]
+            class_name, video_name = os.path.split(x)
+            # -> os.path.splitext(video_name)[0] : -vtlx-mcpds_000012_000022
+            pairs.append((class_name, os.path.splitext(video_name)[0]))
+    return pairs
+
+def fold_list_files(annotation_path, split):
+    """ paths of the {train/test}list{03/07}.txt files of a split """
+    return [os.path.join(annotation_path, "{}list{:02d}.txt".format(name, split)) for name in ["train", "test"]]
+
+def read_fold_lists(annotation_path, split):
+    """
+    Load the train and test lists of a split into a dict mapping video name -> (split name, class name),
+    so that membership tests while indexing the dataset are a single hash lookup.
+    A video listed in both lists belongs to train, as it always has.
+    """
+    lookup = {}
+    for name, fname in zip(["train", "test"], fold_list_files(annotation_path, split)):
+        for class_name, video_name in read_fold_list(fname):
+            lookup.setdefault(video_name, (name, class_name))
+    return lookup
+
+def read_file(path):
+    """ whole file as bytes; the read releases the GIL, so I/O threads overlap their waits """
+    with open(path, 'rb') as f:
+        return f.read()
+
+"""Decodes JPEG frames with PIL. A frame source is a path, a file object or the encoded bytes. """
+class PILDecoder():
+    """
+    With draft_size set, libjpeg decodes each frame at the smallest 1/2, 1/4 or 1/8 scale whose shorter side is
+    still at least draft_size (Image.draft), which skips most of the decoding work when the frames are resized
+    down to draft_size afterwards. Without it frames are decoded at full resolution.
+    """
+    def __init__(self, draft_size=None):
+        self.draft_size = draft_size
+
+    def decode_one(self, src):
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            src = io.BytesIO(src)
+        with Image.open(src) as i:
+            if self.draft_size is not None:
+                w, h = i.size
+                scale = self.draft_size / min(w, h)
+                if scale < 1:
+                    i.draft(None, (int(np.ceil(w * scale)), int(np.ceil(h * scale))))
+            i.load()
+            return i
+
+    def decode(self, srcs):
+        """ list of PIL images """
+        return [self.decode_one(src) for src in srcs]
+
+    def decode_arrays(self, srcs):
+        """ list of uint8 (H, W, C) RGB arrays """
+        arrays = []
+        for src in srcs:
+            i = self.decode_one(src)
+            arrays.append(np.asarray(i if i.mode == "RGB" else i.convert("RGB")))
+        return arrays
+
+"""Decodes the JPEG frames of a clip with one batched torchvision.io.decode_jpeg call. """
+class TorchvisionDecoder():
+    @staticmethod
+    def encoded(src):
+        if isinstance(src, str):
+            return torchvision.io.read_file(src)
+        if not isinstance(src, (bytes, bytearray, memoryview)):
+            src = src.read()
+        # decode_jpeg wants a writable uint8 tensor; encoded frames are small, so copying them is cheap
+        return torch.frombuffer(bytearray(src), dtype=torch.uint8)
+
+    def decode_tensors(self, srcs):
+        """ list of uint8 (C, H, W) RGB tensors """
+        return torchvision.io.decode_jpeg([self.encoded(src) for src in srcs], mode=torchvision.io.ImageReadMode.RGB)
+
+    def decode(self, srcs):
+        """ list of PIL images, for the PIL transforms """
+        return [Image.fromarray(t.permute(1, 2, 0).contiguous().numpy()) for t in self.decode_tensors(srcs)]
+
+    def decode_arrays(self, srcs):
+        """ list of uint8 (H, W, C) RGB arrays, views of the decoded tensors """
+        return [t.permute(1, 2, 0).numpy() for t in self.decode_tensors(srcs)]
+
+JPEG_DECODERS = ["pil", "pil_draft", "torchvision"]
+
+def make_decoder(name, resize_size):
+    """ frame decoder for --decoder; resize_size is the shorter side frames are resized to before cropping """
+    if name == "pil":
+        return PILDecoder()
+    if name == "pil_draft":
+        return PILDecoder(draft_size=resize_size)
+    if name == "torchvision":
+        return TorchvisionDecoder()
+    raise ValueError("unknown decoder {}, expected one of {}".format(name, JPEG_DECODERS))
 
 """Contains video frame paths and ground truth labels for a single split (e.g. train videos). """
 class Split():
@@ -20,36 +146,63 @@ class Split():
         self.videos = []    # list of lists of frame paths
         self.videos_flows_X = [] # list of lists of flow_x paths for optical flow
         self.videos_flows_Y = [] # list of lists of flow_y paths for optical flow
+        self._index_dirty = True # per-class index needs (re)building
     
     def add_vid(self, paths_x, paths_y, paths, gt_a):
-        # print("paths: ", paths)
-        # print("gt_a: ", gt_a)
         self.videos_flows_X.append(paths_x) # list of frame paths
         self.videos_flows_Y.append(paths_y) # list of frame paths
         self.videos.append(paths)   # list of frame paths
         self.gt_a_list.append(gt_a) # ground truth action label
+        self._index_dirty = True
+
+    def build_class_index(self):
+        """
+        Group the video ids by class into one contiguous array so that per-class lookups are constant time.
+        Videos of class self.class_ids[r] are self.class_videos[self.class_offsets[r]:self.class_offsets[r + 1]],
+        in the order they were added.
+        """
+        labels = np.asarray(self.gt_a_list, dtype=np.int64)
+        # stable sort keeps the original video order inside each class
+        self.class_videos = np.argsort(labels, kind="stable")
+        self.class_ids, counts = np.unique(labels[self.class_videos], return_counts=True)
+        self.class_offsets = np.zeros(len(self.class_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.class_offsets[1:])
+        self.class_rows = {int(c): r for r, c in enumerate(self.class_ids)}
+        self.unique_classes = [int(c) for c in self.class_ids]
+        self._index_dirty = False
+
+    def _class_range(self, label):
+        if self._index_dirty:
+            self.build_class_index()
+        row = self.class_rows.get(int(label))
+        if row is None:
+            return 0, 0
+        return self.class_offsets[row], self.class_offsets[row + 1]
 
     def get_rand_vid(self, label, idx=-1):
         """
         Get a random video with the specified label. If idx is specified, return the video at that index.
         """
-        match_idxs = []              # list of indices of videos with the specified label
-        for i in range(len(self.gt_a_list)):
-            if label == self.gt_a_list[i]:
-                match_idxs.append(i) # add index to list if the label matches
+        start, end = self._class_range(label)
         # if the index is specified, return the video at that index
         if idx != -1:
-            return self.videos[match_idxs[idx]], self.videos_flows_X[match_idxs[idx]], self.videos_flows_Y[match_idxs[idx]], match_idxs[idx]
-        random_idx = np.random.choice(match_idxs)
-        return self.videos[random_idx], self.videos_flows_X[random_idx], self.videos_flows_Y[random_idx], random_idx
+            if idx < 0:
+                idx += end - start
+            if not 0 <= idx < end - start:
+                raise IndexError("video index {} out of range for class {}".format(idx, label))
+            vid_id = int(self.class_videos[start + idx])
+        else:
+            vid_id = int(self.class_videos[start + np.random.randint(end - start)])
+        return self.videos[vid_id], self.videos_flows_X[vid_id], self.videos_flows_Y[vid_id], vid_id
 
     def get_num_videos_for_class(self, label):
-        # print("label: ", label)
-        # print("self.gt_a_list: ", self.gt_a_list)
-        return len([gt for gt in self.gt_a_list if gt == label])
+        start, end = self._class_range(label)
+        return int(end - start)
 
     def get_unique_classes(self):
-        return list(set(self.gt_a_list))
+        if self._index_dirty:
+            self.build_class_index()
+        return list(self.unique_classes)
 
     def get_max_video_len(self):
         max_len = 0
@@ -84,287 +237,693 @@ class VideoDataset(torch.utils.data.Dataset):
         self.train_split = Split()
         self.test_split = Split()
 
+        # uint8 frames and float16 flow are emitted, a quarter and half of the float32 bytes sent from the workers
+        self.compact_transport = getattr(args, "compact_transport", False)
+        self.flow_dtype = np.float16 if self.compact_transport else np.float32
+        # training clips are read like test clips, so that the activations of the frozen backbone layers can be reused (see activation_cache.py)
+        self.fixed_train_clips = bool(getattr(args, "activation_cache_dir", None))
+        # done flags of the activation cache, and whether it holds the RGB and flow inputs (see use_prefix_cache)
+        self.prefix_done = None
+        self.prefix_rgb = self.prefix_flow = False
+
         self.setup_transforms()
+        self.decoder = make_decoder(getattr(args, "decoder", "pil"), self.resize_size)
         self._select_fold()
         self.read_dir()
+        self.load_episode_manifest()
+        self.setup_episode_sampler()
 
     """Setup crop sizes/flips for augmentation during training and centre crop for testing"""
+    """With --transform_backend tensor, frames are read as one uint8 (T, C, H, W) tensor and transformed as a whole clip. """
     def setup_transforms(self):
         video_transform_list = []
         video_test_list = []
+        self.transform_backend = getattr(self.args, "transform_backend", "pil")
+        tensor = self.transform_backend == "tensor"
             
         if self.img_size == 84:
-            video_transform_list.append(Resize(96))
-            video_test_list.append(Resize(96))
+            self.resize_size = 96
         elif self.img_size == 224:
-            video_transform_list.append(Resize(256)) 
-            video_test_list.append(Resize(256))
+            self.resize_size = 256
         else:
             print("img size transforms not setup")
             exit(1)
-        video_transform_list.append(RandomHorizontalFlip())
-        video_transform_list.append(RandomCrop(self.img_size)) # # Random 224 × 224 crops are used as augmentation during training
+        resize = ClipResize if tensor else Resize
+        video_transform_list.append(resize(self.resize_size))
+        video_test_list.append(resize(self.resize_size))
+        video_transform_list.append(ClipRandomHorizontalFlip() if tensor else RandomHorizontalFlip())
+        video_transform_list.append((ClipRandomCrop if tensor else RandomCrop)(self.img_size)) # # Random 224 × 224 crops are used as augmentation during training
 
-        video_test_list.append(CenterCrop(self.img_size)) # In contrast, only a centre crop is used during evaluation.
+        video_test_list.append((ClipCenterCrop if tensor else CenterCrop)(self.img_size)) # In contrast, only a centre crop is used during evaluation.
+        self.clip_to_float = ClipToFloat()
 
         self.transform = {} # apply a series of transformations when Compose is called
         self.transform["train"] = Compose(video_transform_list)
         self.transform["test"] = Compose(video_test_list)
     
-    """Loads all videos into RAM from an uncompressed zip. Necessary as the filesystem has a large block size, which is unsuitable for lots of images. """
-    """Contains some legacy code for loading images directly, but this has not been used/tested for a while so might not work with the current codebase. """
+    """Indexes videos from an uncompressed zip, which is memory-mapped so that all DataLoader workers share its pages. Necessary as the filesystem has a large block size, which is unsuitable for lots of images. """
+    """Or from packed shards (a directory with shards.json, see video_shards.py), a class/video/{img,flow_x,flow_y} directory tree, or the video files themselves with --video_dir (see video_files.py). """
     def read_dir(self):
-        # print("loading {}".format(self.data_dir))
-        # load zipfile into memory
-        if self.data_dir.endswith('.zip'):
-            self.zip = True
-            zip_fn = os.path.join(self.data_dir)
-            self.mem = open(zip_fn, 'rb').read()
-            self.zfile = zipfile.ZipFile(io.BytesIO(self.mem))
+        self.video_files = bool(getattr(self.args, "video_dir", None))
+        self.zip = self.data_dir.endswith('.zip')
+        # uint8 flow is dequantised with the bound recorded next to the dataset
+        self.flow_format = read_flow_format(self.data_dir)
+        self.shards = os.path.isfile(os.path.join(self.data_dir, SHARDS_FILE))
+        if self.video_files:
+            self.source = "videos"
+            self._read_videos()
+        elif self.zip:
+            self.source = "zip"
+            self._read_zip()
+        elif self.shards:
+            self.source = "shards"
+            self._read_shards()
         else:
-            self.zip = False
-
-        # go through zip and populate splits with frame locations and action groundtruths
-        if self.zip:
-            
-            # When using 'png' based datasets like kinetics, replace 'jpg' to 'png'
-            # gets a list of all the file names in the zip file that do not end with '.jpg', that is, the directories.
-            dir_list = list(set([x for x in self.zfile.namelist() if '.jpg' not in x]))
-
-            class_folders = list(set([x.split(os.sep)[-3] for x in dir_list if len(x.split(os.sep)) > 2]))
-            class_folders.sort()
-            self.class_folders = class_folders
-            video_folders = list(set([x.split(os.sep)[-2] for x in dir_list if len(x.split(os.sep)) > 3]))
-            video_folders.sort()
-            self.video_folders = video_folders
-
-            class_folders_indexes = {v: k for k, v in enumerate(self.class_folders)}
-            video_folders_indexes = {v: k for k, v in enumerate(self.video_folders)}
-            
-            img_list = [x for x in self.zfile.namelist() if '.jpg' in x]
-            img_list.sort()
-
-            c = self.get_train_or_test_db(video_folders[0])
+            self.source = "tree"
+            self._read_tree()
+        self.flow_bound = float((self.flow_format or {}).get("bound", FLOW_BOUND))
 
-            last_video_folder = None
-            last_video_class = -1
-            insert_frames = []
-            for img_path in img_list:
-            
-                # class/video/jpg_file
-                class_folder, video_folder, jpg = img_path.split(os.sep)[-3:]
-
-                if video_folder != last_video_folder: # checks if the video folder for the current image is different from the previous image
-                    if len(insert_frames) >= self.seq_len: # enough frames in insert_frames to form a video sequence.
-                        c = self.get_train_or_test_db(last_video_folder.lower())
-                        if c != None:
-                            c.add_vid(insert_frames, last_video_class)
-                        else: # No that video folder in the train or test list
-                            pass
-                    #  start accumulating frames for the new video
-                    insert_frames = []
-                    # label of the video
-                    class_id = class_folders_indexes[class_folder]
-                    vid_id = video_folders_indexes[video_folder]
-               
-                insert_frames.append(img_path)
-                last_video_folder = video_folder
-                last_video_class = class_id
-            # Iteration ends at the last image, so the last video sequence is not added to the database.
-            # Add the last video sequence to the database.
-            c = self.get_train_or_test_db(last_video_folder)
-            if c != None and len(insert_frames) >= self.seq_len:
-                c.add_vid(insert_frames, last_video_class)
-        else:
-            class_folders = os.listdir(self.data_dir)
-            # print("class_folders: ", class_folders)
-            class_folders.sort()
-            class_folders = [c for c in class_folders if c[0] != '.']
-            self.class_folders = class_folders
-            for class_folder in class_folders:
-                video_folders = os.listdir(os.path.join(self.data_dir, class_folder))
-                video_folders.sort()
-                video_folders = [v for v in video_folders]
-                # print("video_folders: ", video_folders)
-                if self.args.debug_loader:
-                    # print("video_folders: ", video_folders[0:1])
-                    video_folders = video_folders[0:1]
-                for video_folder in video_folders:
-                    c = self.get_train_or_test_db(video_folder.lower())
-                    # print("c: ", c)
-                    # print("video_folder: ", video_folder)
-
-
-                    if c == None:
-                        continue
-                    imgs = os.listdir(os.path.join(self.data_dir, class_folder, video_folder,"img"))
-                    flow_x = os.listdir(os.path.join(self.data_dir, class_folder, video_folder,"flow_x"))
-                    flow_y = os.listdir(os.path.join(self.data_dir, class_folder, video_folder,"flow_y"))
-                    # print("imgs: ", imgs)
-                    if len(imgs) < self.seq_len:
-                        continue            
-                    imgs.sort()
-                    paths = [os.path.join(self.data_dir, class_folder, video_folder, "img",img) for img in imgs]
-                    flow_x.sort()
-                    flow_y.sort()
-                    flow_x_paths = [os.path.join(self.data_dir, class_folder, video_folder, "flow_x",img) for img in flow_x]
-                    flow_y_paths = [os.path.join(self.data_dir, class_folder, video_folder, "flow_y",img) for img in flow_y]
-                    paths.sort()
-                    flow_x_paths.sort()
-                    flow_y_paths.sort()
-
-                    class_id =  class_folders.index(class_folder)
-                    c.add_vid(flow_x_paths, flow_y_paths, paths, class_id)
+        # build the per-class indexes once here so DataLoader workers inherit them instead of rebuilding
+        self.train_split.build_class_index()
+        self.test_split.build_class_index()
         print("loaded {}".format(self.data_dir))
         print("train: {}, test: {}".format(len(self.train_split), len(self.test_split)))
+        self.setup_frame_cache()
+        self.open_eval_clips()
+
+    """Reads the episode manifest given by --episode_manifest (see episode_manifest.py), keeping episodes --episode_range START STOP if given. Its episodes are replayed by __getitem__ while the dataset is in the mode (train or test) of the manifest. """
+    def load_episode_manifest(self):
+        self.episode_manifest = None
+        path = getattr(self.args, "episode_manifest", None)
+        if not path:
+            return
+        manifest = EpisodeManifest.load(path)
+        manifest.check(self.train_split if manifest.train else self.test_split, self.seq_len)
+        episode_range = getattr(self.args, "episode_range", None)
+        if episode_range:
+            manifest = manifest.select(*episode_range)
+        self.episode_manifest = manifest
+        print("episode manifest {}: {} {} episodes from {}".format(path, len(manifest), "train" if manifest.train else "test", manifest.first))
+
+    """Draws training episodes from a rotating window of classes and videos (see episode_sampler.py) if --sampler_class_window is set. """
+    def setup_episode_sampler(self):
+        self.episode_sampler = None
+        class_window = getattr(self.args, "sampler_class_window", 0)
+        if not class_window:
+            return
+        self.episode_sampler = WindowedEpisodeSampler(self.train_split, max(class_window, self.way),
+                                                      getattr(self.args, "sampler_video_window", 20),
+                                                      getattr(self.args, "sampler_shift_every", 100))
+
+    def replaying(self):
+        return self.episode_manifest is not None and self.train == self.episode_manifest.train
+
+    """Creates the decoded frame cache shared by the DataLoader workers (see clip_cache.py), if --frame_cache_bytes is set. Must run before the workers are forked; workers that are spawned cannot share it. """
+    def setup_frame_cache(self):
+        self.frame_cache = None
+        capacity = getattr(self.args, "frame_cache_bytes", 0)
+        if not capacity:
+            return
+        if self.video_files:
+            # flow is computed per clip from the sampled frames, there are no stored frames to share
+            print("frame cache: not used with --video_dir")
+            return
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("--frame_cache_bytes needs loader workers started with fork, which this platform does not support")
+        slot_bytes = getattr(self.args, "frame_cache_slot_bytes", 0)
+        if not slot_bytes:
+            # large enough for a decoded flow frame and for the RGB frames, assuming they all have the size of the first
+            slot_bytes = FLOW_CROP_SIZE * FLOW_CROP_SIZE * 4
+            split = self.train_split if len(self.train_split) else self.test_split
+            if len(split):
+                slot_bytes = max(slot_bytes, np.asarray(self.read_frames(split.videos[0], [0])[0]).nbytes)
+        self.frame_cache = SharedFrameCache(capacity, slot_bytes)
+        print("frame cache: {} slots of {} bytes".format(self.frame_cache.n_slots, self.frame_cache.slot_bytes))
+
+    """Identifies the clips that per-video stores of split (eval clips, embeddings, activations) are computed from: the split, the dataset (absolute root, how it is read, flow format) and the reading and preprocessing options. Stores keyed by it are rebuilt rather than reused for other inputs. """
+    def inputs_key(self, split):
+        return {"split": split_signature(split), "path": os.path.abspath(self.data_dir), "source": self.source,
+                "flow_format": self.flow_format, "flow_bound": self.flow_bound, "seq_len": self.seq_len, "img_size": self.img_size,
+                "decoder": getattr(self.args, "decoder", "pil"), "transform_backend": self.transform_backend,
+                "compact_transport": self.compact_transport}
+
+    """Opens the store of preprocessed test clips given by --eval_clip_store: per test video, its uint8 frames after the test transforms and its flow quantised to uint8 (see flow_codec.py). Filled by build_eval_clips, in the main process before the DataLoader workers fork. """
+    def open_eval_clips(self):
+        self.eval_clips = None
+        directory = getattr(self.args, "eval_clip_store", None)
+        if not directory:
+            return
+        key = self.inputs_key(self.test_split)
+        arrays = {"rgb": ((self.seq_len, 3, self.img_size, self.img_size), np.uint8),
+                  "flow": ((self.seq_len, 2, FLOW_CROP_SIZE, FLOW_CROP_SIZE), np.uint8),
+                  "n_flow": ((), np.int16)}
+        self.eval_clips = VideoStore(directory, len(self.test_split), arrays, key)
+        print("eval clip store {}: {}/{} test clips".format(directory, len(self.test_split) - len(self.eval_clips.missing()), len(self.test_split)))
+
+    """Reads, transforms and stores the test clips missing from the eval clip store. """
+    def build_eval_clips(self, log=print):
+        todo = self.eval_clips.missing()
+        if not len(todo):
+            return
+        was_train, self.train = self.train, False
+        c = self.test_split
+        try:
+            for n, vid_id in enumerate(todo.tolist()):
+                paths, paths_flow_x, paths_flow_y = c.videos[vid_id], c.videos_flows_X[vid_id], c.videos_flows_Y[vid_id]
+                plan = self.plan_vid(vid_id, self.sample_idxs(len(paths), len(paths_flow_x)))
+                imgs, imgs_flow = self.read_clip(*plan)
+                if len(imgs_flow) > self.seq_len:
+                    continue # more flow frames than a store row holds, read from the dataset
+                self.eval_clips["flow"][vid_id, :len(imgs_flow)] = encode_flow(imgs_flow, "uint8", self.flow_bound, crop=False)
+                self.eval_clips.put([vid_id], rgb=self.transform_clip(imgs, uint8=True).numpy(), n_flow=len(imgs_flow))
+                if (n + 1) % 500 == 0:
+                    self.eval_clips.flush()
+                    log("eval clip store: {}/{} test clips".format(len(c) - len(self.eval_clips.missing()), len(c)))
+        finally:
+            self.eval_clips.flush()
+            self.train = was_train
+
+    """ go through zip and populate splits with frame locations and action groundtruths """
+    def _read_zip(self):
+        self.zfile = MmapZip(self.data_dir)
+        if FLOW_FORMAT_FILE in self.zfile.members:
+            self.flow_format = json.loads(bytes(self.zfile.read(FLOW_FORMAT_FILE)))
+        # members are class/video/{img,flow_x,flow_y}/file, or class/video/file.jpg for zips of RGB frames only
+        videos = {}
+        for name in self.zfile.members:
+            parts = name.split('/')
+            if len(parts) >= 4 and parts[-2] in ("img", "flow_x", "flow_y"):
+                class_folder, video_folder, kind = parts[-4], parts[-3], parts[-2]
+            elif len(parts) >= 3 and name.lower().endswith(FRAME_EXTENSIONS):
+                class_folder, video_folder, kind = parts[-3], parts[-2], "img"
+            else:
+                continue
+            frames = videos.setdefault((class_folder, video_folder), {"img": [], "flow_x": [], "flow_y": []})
+            frames[kind].append(name)
+
+        self.class_folders = sorted(set(class_folder for class_folder, _ in videos))
+        class_folders_indexes = {v: k for k, v in enumerate(self.class_folders)}
+        for class_folder, video_folder in sorted(videos):
+            c = self.get_train_or_test_db(video_folder.lower())
+            frames = videos[(class_folder, video_folder)]
+            if c is None or len(frames["img"]) < self.seq_len:
+                continue
+            c.add_vid(sorted(frames["flow_x"]), sorted(frames["flow_y"]), sorted(frames["img"]), class_folders_indexes[class_folder])
+
+    """ index the videos of a packed shard dataset from the shard indexes """
+    def _read_shards(self):
+        shard_paths, self.class_folders = read_shards_file(self.data_dir)
+        class_folders_indexes = {v: k for k, v in enumerate(self.class_folders)}
+        self.shard_reader = ShardReader()
+        for path in shard_paths:
+            for video in read_shard_index(path):
+                c = self.get_train_or_test_db(video.name.lower())
+                if c is None or len(video) < self.seq_len:
+                    continue
+                c.add_vid(video.flow_frames, video.flow_frames, video, class_folders_indexes[video.class_folder])
+
+    """ Loads the index of the dataset (a DatasetManifest or a VideoIndex) from the on-disk manifest cache when it is enabled and up to date, else builds it with build() and caches it. """
+    def _cached_index(self, index_class, build, **options):
+        split_files = fold_list_files(self.annotation_path, self.args.split)
+        manifest = None
+        cache_path = None
+        if not getattr(self.args, "no_manifest_cache", False):
+            cache_dir = getattr(self.args, "manifest_dir", None) or DEFAULT_MANIFEST_DIR
+            cache_path = manifest_path(cache_dir, self.data_dir, split_files, **options)
+            fingerprint = tree_fingerprint(self.data_dir, split_files, **options)
+            if not getattr(self.args, "rebuild_manifest", False):
+                manifest = index_class.load(cache_path, fingerprint)
+                if manifest is not None:
+                    print("loaded manifest {}".format(cache_path))
+
+        if manifest is None:
+            manifest = build()
+            if cache_path is not None:
+                manifest.fingerprint = fingerprint
+                try:
+                    manifest.save(cache_path)
+                    print("saved manifest {}".format(cache_path))
+                except OSError as e:
+                    print("could not save manifest {}: {}".format(cache_path, e))
+        return manifest
+
+    """ Index a class/video/{img,flow_x,flow_y} tree, through the on-disk manifest cache when it is enabled, or from the verified index given by --dataset_index. """
+    def _read_tree(self):
+        if getattr(self.args, "dataset_index", None):
+            manifest = self._load_verified_index(self.args.dataset_index)
+        else:
+            manifest = self._cached_index(DatasetManifest, self._scan_tree, seq_len=self.seq_len, debug_loader=bool(self.args.debug_loader))
+
+        self.class_folders = manifest.class_folders
+        for video_dir, class_id, paths, flow_x_paths, flow_y_paths in manifest.videos(self.data_dir):
+            c = self.get_train_or_test_db(os.path.basename(video_dir).lower())
+            if c is not None:
+                c.add_vid(flow_x_paths, flow_y_paths, paths, class_id)
+
+    """ Loads the index of the videos scripts/fsck_dataset.py verified. Raises ValueError if it is unreadable, or was made for another tree, split or seq_len, or before the tree or the split lists changed. """
+    def _load_verified_index(self, path):
+        manifest = DatasetManifest.load(path)
+        if manifest is None:
+            raise ValueError("cannot read the verified index {}".format(path))
+        fingerprint = verified_index_fingerprint(self.data_dir, fold_list_files(self.annotation_path, self.args.split), self.seq_len)
+        if manifest.fingerprint != json.loads(json.dumps(fingerprint, sort_keys=True)):
+            raise ValueError("verified index {} does not match {} (split {}, seq_len {}) as it is now, run scripts/fsck_dataset.py again".format(
+                path, self.data_dir, self.args.split, self.seq_len))
+        print("loaded verified index {}".format(path))
+        return manifest
+
+    """ Index a directory of class/<video>.avi files: their frame counts are found once (see video_files.py) and cached like a tree manifest. """
+    """ A video has no flow files: its flow frames are the seq_len - 1 pairs of consecutive sampled frames. """
+    def _read_videos(self):
+        keep = lambda name: self.get_train_or_test_db(name.lower()) is not None
+        index = self._cached_index(VideoIndex, lambda: VideoIndex.build(self.data_dir, keep), video_files=True)
+        self.class_folders = index.class_folders
+        flow_frames = range(self.seq_len - 1)
+        seen_classes = set()
+        for video_file, class_id, video in index.videos(self.data_dir):
+            c = self.get_train_or_test_db(os.path.splitext(os.path.basename(video_file))[0].lower())
+            if c is None or len(video) < self.seq_len:
+                continue
+            if self.args.debug_loader:
+                if class_id in seen_classes:
+                    continue
+                seen_classes.add(class_id)
+            c.add_vid(flow_frames, flow_frames, video, class_id)
+
+    """ List the dataset tree, keeping the videos that are in the train/test lists and have enough frames. """
+    def _scan_tree(self):
+        class_folders = os.listdir(self.data_dir)
+        class_folders.sort()
+        class_folders = [c for c in class_folders if c[0] != '.' and os.path.isdir(os.path.join(self.data_dir, c))]
+        manifest = DatasetManifest(class_folders)
+        for class_id, class_folder in enumerate(class_folders):
+            video_folders = os.listdir(os.path.join(self.data_dir, class_folder))
+            video_folders.sort()
+            if self.args.debug_loader:
+                video_folders = video_folders[0:1]
+            for video_folder in video_folders:
+                if self.get_train_or_test_db(video_folder.lower()) is None:
+                    continue
+                video_path = os.path.join(self.data_dir, class_folder, video_folder)
+                imgs = [name for name in os.listdir(os.path.join(video_path, "img")) if name.lower().endswith(FRAME_EXTENSIONS)]
+                if len(imgs) < self.seq_len:
+                    continue
+                flow_x = os.listdir(os.path.join(video_path, "flow_x"))
+                flow_y = os.listdir(os.path.join(video_path, "flow_y"))
+                imgs.sort()
+                flow_x.sort()
+                flow_y.sort()
+                manifest.add_video(os.path.join(class_folder, video_folder), class_id, imgs, flow_x, flow_y)
+        return manifest
 
     """ return the current split being used """
     # whether the video should be added to the training database or the testing database based on the name of the video folder.
     def get_train_or_test_db(self, split=None):
-
-        # print("split: ", split)
         if split is None:
             get_train_split = self.train
         else:
-            # print("self.train_test_lists['train'][0]: ", self.train_test_lists["train"][0])
-            if split in self.train_test_lists["train"]:
-                # print("split: ", split)
-                get_train_split = True
-
-            elif split in self.train_test_lists["test"]:
-                get_train_split = False
-
-            else:
-
+            entry = self.fold_lookup.get(split)
+            if entry is None: # No that video folder in the train or test list
                 return None
+            get_train_split = entry[0] == "train"
             
         if get_train_split:
             return self.train_split
         else:
             return self.test_split
     
-    """ load the paths of all videos in the train and test splits. """ 
+    """ load the names of all videos in the train and test splits. """ 
     def _select_fold(self):
-        lists = {}
-        for name in ["train", "test"]:
-            # {train/test}list{03/07}.txt
-            fname = "{}list{:02d}.txt".format(name, self.args.split)
-            f = os.path.join(self.annotation_path, fname)
-            # print("f: ", f)
-            selected_files = []
-            with open(f, "r") as fid:
-                data = fid.readlines()
-                # eg: air drumming/-VtLx-mcPds_000012_000022
-                # -> air_drumming/-VtLx-mcPds_000012_000022
-                data = [x.replace(' ', '_').lower() for x in data]
-                # -> air_drumming/-VtLx-mcPds_000012_000022
-                data = [x.strip().split(" ")[0] for x in data]
-                # -> os.path.split(x) : [air_drumming, -VtLx-mcPds_000012_000022]
-                # -> os.path.splitext(os.path.split(x)[1]) : ('-VtLx-mcPds_000012_000022', '')
-                # -> os.path.splitext(os.path.split(x)[1])[0] : -VtLx-mcPds_000012_000022
-                data = [os.path.splitext(os.path.split(x)[1])[0] for x in data]
-                
-            
-                selected_files.extend(data)
-            lists[name] = selected_files
-        self.train_test_lists = lists
-        # print("lists: ", lists)
+        self.fold_lookup = read_fold_lists(self.annotation_path, self.args.split)
 
     """ Set len to large number as we use lots of random tasks. Stopping point controlled in run.py. """
+    """ When an episode manifest is replayed, its number of episodes. """
     def __len__(self):
         c = self.get_train_or_test_db()
+        if self.replaying():
+            return len(self.episode_manifest)
         return 1000000
         return len(c)
    
     """ Get the classes used for the current split """
     def get_split_class_list(self):
         c = self.get_train_or_test_db()
-        classes = list(set(c.gt_a_list))
-        classes.sort()
-        return classes
+        return sorted(c.get_unique_classes())
     
     """Loads a single image from a specified path """
     def read_single_image(self, path):
+        return self.decoder.decode([self.frame_source(path)])[0]
+
+    """What the decoder reads a frame from: a file object inside the zip, or the path of the frame. """
+    def frame_source(self, path):
         if self.zip:
-            with self.zfile.open(path, 'r') as f:
-                with Image.open(f) as i:
-                    i.load()
-                    return i
+            return self.zfile.open(path)
+        return path
+
+    def read_single_image_flow(self, path, out=None):
+        """read npy, stored either as full 256 x 256 float32 or pre-cropped float16/uint8 (see flow_codec.py)"""
+        if self.zip:
+            i = self.zfile.load_npy(path)
         else:
-            with Image.open(path) as i:
-                i.load()
-                return i
-    def read_single_image_flow(self, path):
-        """read npy"""
-        with open(path, 'rb') as f:
-            i = np.load(f)
-            # center crop 224 x 224
-            i = i[8:232, 8:232]
-            return i
-        
+            # memory-mapped, so only the pages of the crop are read and the array is copied once, into out
+            i = np.load(path, mmap_mode='r')
+        # center crop 224 x 224
+        i = crop_flow(i)
+        if out is None:
+            out = np.empty(i.shape, dtype=np.float32)
+        return decode_flow(i, self.flow_bound, out=out)
     
+    """Loads the sampled frames of one video, from the frame cache when it holds them (vid_id identifies the video in the current split). """
+    """Returns a list of PIL images, or a uint8 (T, C, H, W) tensor for the tensor transforms. """
+    def read_frames(self, paths, idxs, vid_id=None, fetched=None):
+        arrays = self.transform_backend == "tensor"
+        if self.frame_cache is None or vid_id is None:
+            imgs = self.decode_frames(paths, idxs, arrays, fetched)
+        else:
+            split = 0 if self.train else 1
+            keys = [frame_key(split, vid_id, KIND_RGB, i) for i in idxs]
+            cached = [self.frame_cache.get(key) for key in keys]
+            missing = [i for i, frame in zip(idxs, cached) if frame is None]
+            decoded = iter(self.decode_frames(paths, missing, arrays, fetched)) if missing else None
+            imgs = []
+            for key, frame in zip(keys, cached):
+                if frame is None:
+                    img = next(decoded)
+                    self.frame_cache.put(key, np.asarray(img))
+                elif not arrays:
+                    img = Image.fromarray(frame)
+                else:
+                    img = frame
+                imgs.append(img)
+        if arrays:
+            # channels-last in memory, which the uint8 resize kernels handle fastest
+            return torch.from_numpy(np.stack(imgs)).permute(0, 3, 1, 2)
+        return imgs
+
+    """Decodes the frames idxs of one video with the selected decoder, to PIL images or (H, W, C) arrays: one read for all of them for a shard video, one file per frame otherwise. """
+    """fetched maps frame indexes to encoded frames already read by fetch_clip. """
+    def decode_frames(self, paths, idxs, arrays=False, fetched=None):
+        if fetched is not None and all(i in fetched for i in idxs):
+            srcs = [fetched[i] for i in idxs]
+        elif self.shards:
+            srcs = self.shard_reader.read_frames(paths, idxs)
+        else:
+            srcs = [self.frame_source(paths[i]) for i in idxs]
+        if arrays:
+            return self.decoder.decode_arrays(srcs)
+        return self.decoder.decode(srcs)
+
+    """Loads the sampled flow frames of one video into a single (T, 2, 224, 224) array of self.flow_dtype, x then y flow, decoding each stored frame straight into its slot. """
+    def read_flow(self, paths, paths_flow_x, paths_flow_y, idxs_flow, vid_id=None, fetched=None):
+        flow = np.empty((len(idxs_flow), 2, FLOW_CROP_SIZE, FLOW_CROP_SIZE), dtype=self.flow_dtype)
+        if self.frame_cache is not None and vid_id is not None:
+            split = 0 if self.train else 1
+            keys = [(frame_key(split, vid_id, KIND_FLOW_X, i), frame_key(split, vid_id, KIND_FLOW_Y, i)) for i in idxs_flow]
+            hit = [self.frame_cache.get(kx, out=flow[t, 0]) is not None and self.frame_cache.get(ky, out=flow[t, 1]) is not None
+                   for t, (kx, ky) in enumerate(keys)]
+            if all(hit):
+                return flow
+            missing = [t for t, h in enumerate(hit) if not h]
+            if len(missing) == len(idxs_flow):
+                self.decode_flow_frames(paths, paths_flow_x, paths_flow_y, idxs_flow, out=flow, fetched=fetched)
+            else:
+                flow[missing] = self.decode_flow_frames(paths, paths_flow_x, paths_flow_y, [idxs_flow[t] for t in missing],
+                                                        out=np.empty((len(missing),) + flow.shape[1:], dtype=flow.dtype), fetched=fetched)
+            for t in missing:
+                self.frame_cache.put(keys[t][0], flow[t, 0])
+                self.frame_cache.put(keys[t][1], flow[t, 1])
+            return flow
+        return self.decode_flow_frames(paths, paths_flow_x, paths_flow_y, idxs_flow, out=flow, fetched=fetched)
+
+    """Decodes the flow frames idxs_flow of one video into out ((T, 2, 224, 224) float32 or float16). """
+    """fetched maps flow frame indexes to the (x, y) stored frames already read by fetch_clip. """
+    def decode_flow_frames(self, paths, paths_flow_x, paths_flow_y, idxs_flow, out, fetched=None):
+        if fetched is not None and all(i in fetched for i in idxs_flow):
+            for t, i in enumerate(idxs_flow):
+                decode_flow(crop_flow(fetched[i][0]), self.flow_bound, out=out[t, 0])
+                decode_flow(crop_flow(fetched[i][1]), self.flow_bound, out=out[t, 1])
+            return out
+        if self.shards:
+            # one read for the whole flow block; shards may be packed without cropping, or quantised
+            decode_flow(crop_flow(self.shard_reader.read_flow(paths, idxs_flow)), self.flow_bound, out=out)
+            return out
+        for t, i in enumerate(idxs_flow):
+            self.read_single_image_flow(paths_flow_x[i], out=out[t, 0])
+            self.read_single_image_flow(paths_flow_y[i], out=out[t, 1])
+        return out
+
+    """Loads the sampled frames (list of PIL images) and flow ((T, 2, 224, 224) array) of one video. """
+    """fetched is the (frames, flow) fetch_clip returned for it, if it was read ahead. """
+    def read_clip(self, paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id=None, fetched=None):
+        if self.video_files:
+            return self.read_video_clip(paths, idxs, idxs_flow, fetched)
+        fetched_frames, fetched_flow = fetched if fetched is not None else (None, None)
+        return (self.read_frames(paths, idxs, vid_id, fetched_frames),
+                self.read_flow(paths, paths_flow_x, paths_flow_y, idxs_flow, vid_id, fetched_flow))
+
+    """Decodes the sampled frames of a video file, as (H, W, C) RGB arrays, and computes the flow between consecutive ones ((T, 2, 224, 224) array of self.flow_dtype). """
+    def decode_video_clip(self, video, idxs, idxs_flow):
+        frames = read_video_frames(video, idxs)
+        flow = np.empty((len(idxs_flow), 2, FLOW_CROP_SIZE, FLOW_CROP_SIZE), dtype=self.flow_dtype)
+        return frames, clip_flow(frames, idxs_flow, flow)
+
+    """read_clip of a video file, from the frames and flow fetch_clip decoded ahead if given. """
+    def read_video_clip(self, video, idxs, idxs_flow, fetched=None):
+        frames, flow = fetched if fetched is not None else self.decode_video_clip(video, idxs, idxs_flow)
+        if self.transform_backend == "tensor":
+            return torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2), flow
+        return [Image.fromarray(frame) for frame in frames], flow
+
+    """Thread pool for the file reads of an episode (--io_threads), created in each DataLoader worker on first use. """
+    def io_pool(self):
+        n_threads = getattr(self.args, "io_threads", 0)
+        if not n_threads:
+            return None
+        if getattr(self, "_io_pool_pid", None) != os.getpid():
+            # a forked worker inherits the pool object but not its threads
+            self._io_pool = ThreadPoolExecutor(max_workers=n_threads)
+            self._io_pool_pid = os.getpid()
+        return self._io_pool
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_io_pool", None)
+        state.pop("_io_pool_pid", None)
+        return state
+
+    """Reads the encoded frames and stored flow of a planned clip (see plan_seq) without decoding them, so the reads of a whole episode can run concurrently on the I/O threads. Frames the frame cache holds are skipped. """
+    """A clip of a video file is decoded, and its flow computed, on the I/O thread: OpenCV releases the GIL. """
+    def fetch_clip(self, plan):
+        paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id = plan
+        skip_rgb, skip_flow = self.prefix_cached(vid_id)
+        if self.stored_clip(vid_id) or (skip_rgb and skip_flow):
+            return {}, {}
+        if self.video_files:
+            return self.decode_video_clip(paths, idxs, [] if skip_flow else idxs_flow)
+        idxs = [] if skip_rgb else sorted(set(idxs))
+        idxs_flow = [] if skip_flow else idxs_flow
+        if self.frame_cache is not None:
+            split = 0 if self.train else 1
+            idxs = [i for i in idxs if frame_key(split, vid_id, KIND_RGB, i) not in self.frame_cache]
+            idxs_flow = [i for i in idxs_flow if frame_key(split, vid_id, KIND_FLOW_X, i) not in self.frame_cache
+                         or frame_key(split, vid_id, KIND_FLOW_Y, i) not in self.frame_cache]
+        frames = {}
+        flow = {}
+        if self.shards:
+            if idxs:
+                frames = dict(zip(idxs, self.shard_reader.read_frames(paths, idxs)))
+            if idxs_flow:
+                block = self.shard_reader.read_flow(paths, idxs_flow)
+                flow = {i: (block[t, 0], block[t, 1]) for t, i in enumerate(idxs_flow)}
+        else:
+            read = self.zfile.fetch if self.zip else read_file
+            frames = {i: read(paths[i]) for i in idxs}
+            flow = {i: (npy_from_buffer(read(paths_flow_x[i])), npy_from_buffer(read(paths_flow_y[i]))) for i in idxs_flow}
+        return frames, flow
+
     """Gets a single video sequence. Handles sampling if there are more frames than specified. """
     def get_seq(self, label, idx=-1):
+        return self.load_seq(self.plan_seq(label, idx))
+
+    """Picks a video and the frames to sample from it: (paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id). """
+    def plan_seq(self, label, idx=-1):
         c = self.get_train_or_test_db()
         paths, paths_flow_x, paths_flow_y, vid_id = c.get_rand_vid(label, idx) 
-        n_frames = len(paths)
-        n_frames_flow = len(paths_flow_x)
+        idxs = self.sample_idxs(len(paths), len(paths_flow_x))
+        idxs_flow = self.flow_idxs(len(paths), len(paths_flow_x))
+        return paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id
+
+    """Plans video vid_id of the current split with the given frames, as replayed from an episode manifest. """
+    def plan_vid(self, vid_id, idxs):
+        c = self.get_train_or_test_db()
+        paths, paths_flow_x, paths_flow_y = c.videos[vid_id], c.videos_flows_X[vid_id], c.videos_flows_Y[vid_id]
+        return paths, paths_flow_x, paths_flow_y, list(idxs), self.flow_idxs(len(paths), len(paths_flow_x)), vid_id
+
+    """Frame indices of a clip of a video with n_frames frames: random jitter in training, evenly spaced in testing. rng is the random module or a random.Random. """
+    def sample_idxs(self, n_frames, n_frames_flow, rng=random):
         if n_frames == self.args.seq_len: # default case: 8
-            idxs = [int(f) for f in range(n_frames)] # [0, 1, 2, 3, 4, 5, 6, 7]
-            idxs_flow = [int(f) for f in range(n_frames_flow)] # [0, 1, 2, 3, 4, 5, 6]
-        else:
-            if self.train:
-                excess_frames = n_frames - self.seq_len
-                excess_pad = int(min(5, excess_frames / 2))
-                if excess_pad < 1:
-                    start = 0
-                    end = n_frames - 1
-                else:
-                    start = random.randint(0, excess_pad)
-                    end = random.randint(n_frames-1 -excess_pad, n_frames-1)
-            else:
-                start = 1
-                end = n_frames - 2
-    
-            if end - start < self.seq_len:
-                end = n_frames - 1
+            return [int(f) for f in range(n_frames)] # [0, 1, 2, 3, 4, 5, 6, 7]
+        if self.train and not self.fixed_train_clips:
+            excess_frames = n_frames - self.seq_len
+            excess_pad = int(min(5, excess_frames / 2))
+            if excess_pad < 1:
                 start = 0
+                end = n_frames - 1
             else:
-                pass
-    
-            idx_f = np.linspace(start, end, num=self.seq_len)
-            idxs = [int(f) for f in idx_f]
-            # idxs_flow = [int(f) for f in range(n_frames_flow)] # 取前7个
-            idxs_flow = [int(f) for f in range(n_frames_flow) if f < self.seq_len] # 取前7个
-
-            if self.seq_len == 1:
-                idxs = [random.randint(start, end-1)]
+                start = rng.randint(0, excess_pad)
+                end = rng.randint(n_frames-1 -excess_pad, n_frames-1)
+        else:
+            start = 1
+            end = n_frames - 2
 
-        imgs = [self.read_single_image(paths[i]) for i in idxs]
-        imgs_flow_x = [self.read_single_image_flow(paths_flow_x[i]) for i in idxs_flow]
-        imgs_flow_y = [self.read_single_image_flow(paths_flow_y[i]) for i in idxs_flow]
+        if end - start < self.seq_len:
+            end = n_frames - 1
+            start = 0
+        else:
+            pass
+
+        idx_f = np.linspace(start, end, num=self.seq_len)
+        idxs = [int(f) for f in idx_f]
+
+        if self.seq_len == 1:
+            idxs = [rng.randint(start, end-1)]
+        return idxs
+
+    """Flow frame indices of a clip, which do not depend on the sampled frames. """
+    def flow_idxs(self, n_frames, n_frames_flow):
+        if n_frames == self.args.seq_len:
+            return [int(f) for f in range(n_frames_flow)] # [0, 1, 2, 3, 4, 5, 6]
+        # idxs_flow = [int(f) for f in range(n_frames_flow)] # 取前7个
+        return [int(f) for f in range(n_frames_flow) if f < self.seq_len] # 取前7个
+
+    """Reads, decodes and transforms a planned clip, from what fetch_clip read ahead for it if given. """
+    def load_seq(self, plan, fetched=None):
+        paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id = plan
+        if self.stored_clip(vid_id):
+            return self.read_stored_clip(vid_id)
+        skip_rgb, skip_flow = self.prefix_cached(vid_id)
+        if skip_rgb or skip_flow:
+            return self.load_uncached_seq(plan, skip_rgb, skip_flow, fetched)
+        imgs, imgs_flow = self.read_clip(paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id, fetched)
+        # flow was assembled in its final layout, the tensor shares its memory
+        imgs_flow = torch.from_numpy(imgs_flow)
         if (self.transform is not None):
-            if self.train:
-                transform = self.transform["train"]
+            imgs = self.transform_clip(imgs, self.compact_transport)
+
+        return imgs, imgs_flow, vid_id
+
+    """Applies the train or test transforms to the decoded frames of a clip. Returns a uint8 (T, C, H, W) tensor if uint8, else float in [0, 1]. """
+    def transform_clip(self, imgs, uint8=False):
+        if self.train and not self.fixed_train_clips:
+            transform = self.transform["train"]
+        else:
+            transform = self.transform["test"]
+        # img size is 224
+        if uint8:
+            # uint8 (T, C, H, W), scaled to [0, 1] by the model (see model.InputPreprocess)
+            if self.transform_backend == "tensor":
+                imgs = transform(imgs).contiguous()
             else:
-                transform = self.transform["test"]
-            # img size is 224
+                imgs = torch.from_numpy(np.stack([np.asarray(v) for v in transform(imgs)])).permute(0, 3, 1, 2).contiguous()
+        elif self.transform_backend == "tensor":
+            imgs = self.clip_to_float(transform(imgs))
+        else:
             imgs = [self.tensor_transform(v) for v in transform(imgs)]
             # imgs shape: [8, 3, 224, 224]
             imgs = torch.stack(imgs)
-            imgs_flow_x = [self.tensor_transform(v) for v in imgs_flow_x]
-            imgs_flow_x = torch.stack(imgs_flow_x)
-            imgs_flow_y = [self.tensor_transform(v) for v in imgs_flow_y]
-            imgs_flow_y = torch.stack(imgs_flow_y)
-            # combine two flow images to a two-channel image
-            imgs_flow = torch.cat((imgs_flow_x, imgs_flow_y), 1)
-
-
+        return imgs
+
+    """load_seq of a training clip whose RGB (skip_rgb) or flow (skip_flow) prefix activations are cached: that part is neither read nor decoded, and None is returned in its place. """
+    def load_uncached_seq(self, plan, skip_rgb, skip_flow, fetched=None):
+        paths, paths_flow_x, paths_flow_y, idxs, idxs_flow, vid_id = plan
+        imgs = imgs_flow = None
+        if self.video_files:
+            # the flow is computed from the frames, which are decoded for it even when their activations are cached
+            if not (skip_rgb and skip_flow):
+                imgs, imgs_flow = self.read_video_clip(paths, idxs, [] if skip_flow else idxs_flow, fetched)
+        else:
+            fetched_frames, fetched_flow = fetched if fetched is not None else (None, None)
+            if not skip_rgb:
+                imgs = self.read_frames(paths, idxs, vid_id, fetched_frames)
+            if not skip_flow:
+                imgs_flow = self.read_flow(paths, paths_flow_x, paths_flow_y, idxs_flow, vid_id, fetched_flow)
+        imgs = None if skip_rgb else self.transform_clip(imgs, self.compact_transport)
+        imgs_flow = None if skip_flow else torch.from_numpy(imgs_flow)
         return imgs, imgs_flow, vid_id
 
+    """Skips decoding the training clips whose frozen-layer activations are stored (see activation_cache.PrefixCache): done is the store's flags per training video, shared with the workers, rgb and flow whether the store holds each input. Must run before the workers are forked. """
+    def use_prefix_cache(self, done, rgb, flow):
+        self.prefix_done = done
+        self.prefix_rgb = rgb
+        self.prefix_flow = flow
+
+    """Whether the RGB and the flow inputs of training video vid_id are left out of episodes, their activations being cached. """
+    def prefix_cached(self, vid_id):
+        if not self.train or self.prefix_done is None or not self.prefix_done[vid_id]:
+            return False, False
+        return self.prefix_rgb, self.prefix_flow
+
+    """Whether the test clip of video vid_id is read from the eval clip store. """
+    def stored_clip(self, vid_id):
+        return not self.train and self.eval_clips is not None and bool(self.eval_clips.done[vid_id])
+
+    """Test clip of video vid_id from the eval clip store, as load_seq returns it. """
+    def read_stored_clip(self, vid_id):
+        n_flow = int(self.eval_clips["n_flow"][vid_id])
+        imgs = torch.from_numpy(np.array(self.eval_clips["rgb"][vid_id]))
+        if not self.compact_transport:
+            imgs = self.clip_to_float(imgs)
+        flow = self.eval_clips["flow"][vid_id, :n_flow]
+        imgs_flow = decode_flow(flow, self.flow_bound, out=np.empty(flow.shape, dtype=self.flow_dtype))
+        return imgs, torch.from_numpy(imgs_flow), vid_id
+
+
+    """Yields (request, get_seq(label, idx)) for each request (label, idx, ...) in order, or the clip plan(request) plans if plan is given. With I/O threads, all clips are planned first and their files are read ahead on the pool, at most 2 clips per thread ahead of the one being decoded. """
+    def load_clips(self, requests, plan=None):
+        if plan is None:
+            plan = lambda request: self.plan_seq(request[0], request[1])
+        pool = self.io_pool()
+        if pool is None:
+            for request in requests:
+                yield request, self.load_seq(plan(request))
+            return
+        plans = [(request, plan(request)) for request in requests]
+        window = 2 * self.args.io_threads
+        pending = deque()
+        for request, plan in plans:
+            pending.append((request, plan, pool.submit(self.fetch_clip, plan)))
+            if len(pending) >= window:
+                request, plan, fetched = pending.popleft()
+                yield request, self.load_seq(plan, fetched.result())
+        while pending:
+            request, plan, fetched = pending.popleft()
+            yield request, self.load_seq(plan, fetched.result())
+
+    """Episode i of the episode manifest, with the slots in their recorded order. """
+    def replay_episode(self, i):
+        batch_classes, support, query = self.episode_manifest.episode(i)
+        clips = {}
+        slots = [(True, n) for n in range(len(support))] + [(False, n) for n in range(len(query))]
+        def plan(slot):
+            vid_id, _, idxs = (support if slot[0] else query)[slot[1]]
+            return self.plan_vid(vid_id, idxs)
+        for slot, clip in self.load_clips(slots, plan):
+            clips[slot] = clip
+        support_set = [clips[True, n][0] for n in range(len(support))]
+        support_flow_set = [clips[True, n][1] for n in range(len(support))]
+        target_set = [clips[False, n][0] for n in range(len(query))]
+        target_flow_set = [clips[False, n][1] for n in range(len(query))]
+        support_labels = [bl for _, bl, _ in support]
+        target_labels = [bl for _, bl, _ in query]
+        real_target_labels = [batch_classes[bl] for bl in target_labels]
+        support_vids = [vid_id for vid_id, _, _ in support]
+        target_vids = [vid_id for vid_id, _, _ in query]
+        return self.make_task(support_set, support_flow_set, support_labels, target_set, target_flow_set, target_labels, real_target_labels, batch_classes, support_vids, target_vids)
 
     """returns dict of support and target images and labels"""
     def __getitem__(self, index):
+        if self.replaying():
+            return self.replay_episode(index)
 
         #select classes to use for this task
         c = self.get_train_or_test_db()
@@ -372,14 +931,17 @@ class VideoDataset(torch.utils.data.Dataset):
         classes = c.get_unique_classes()
         # print("classes: ", classes)
         # print("way: ", self.way)
-        # N way K shot
-        batch_classes = random.sample(classes, self.way)
-
         if self.train:
             n_queries = self.args.query_per_class # default: 5
         else:
             n_queries = self.args.query_per_class_test # default: 1
 
+        # N way K shot
+        if self.train and self.episode_sampler is not None:
+            batch_classes, window_videos = self.episode_sampler.episode(index, self.way, self.args.shot + n_queries)
+        else:
+            batch_classes = random.sample(classes, self.way)
+
         support_set = []
         support_flow_set = []
         support_labels = []
@@ -389,41 +951,72 @@ class VideoDataset(torch.utils.data.Dataset):
         real_support_labels = []
         real_target_labels = []
 
-        for bl, bc in enumerate(batch_classes):
-            
-            #select shots from the chosen classes
-            n_total = c.get_num_videos_for_class(bc)
-            # K shot + N query
-            idxs = random.sample([i for i in range(n_total)], self.args.shot + n_queries)
-            for idx in idxs[0:self.args.shot]:
-                vid, flow, vid_id = self.get_seq(bc, idx)
+        def episode_clips():
+            """ (class, video index, label, is support) of each clip, drawn lazily so serial loading keeps its random order """
+            for bl, bc in enumerate(batch_classes):
+                
+                #select shots from the chosen classes
+                n_total = c.get_num_videos_for_class(bc)
+                # K shot + N query
+                if self.train and self.episode_sampler is not None:
+                    idxs = window_videos[bc]
+                else:
+                    idxs = random.sample(range(n_total), self.args.shot + n_queries)
+                for idx in idxs[0:self.args.shot]:
+                    yield bc, idx, bl, True
+                for idx in idxs[self.args.shot:]:
+                    yield bc, idx, bl, False
+
+        support_vids = []
+        target_vids = []
+        for (bc, idx, bl, support), (vid, flow, vid_id) in self.load_clips(episode_clips()):
+            if support:
                 support_set.append(vid)
                 support_flow_set.append(flow)
                 support_labels.append(bl)
-            for idx in idxs[self.args.shot:]:
-                vid, flow, vid_id = self.get_seq(bc, idx)
+                support_vids.append(vid_id)
+            else:
                 target_set.append(vid)
                 target_flow_set.append(flow)
                 target_labels.append(bl)
                 real_target_labels.append(bc)
+                target_vids.append(vid_id)
         
-        s = list(zip(support_set, support_flow_set,support_labels))
+        s = list(zip(support_set, support_flow_set,support_labels, support_vids))
         random.shuffle(s)
-        support_set, support_flow_set, support_labels = zip(*s)
+        support_set, support_flow_set, support_labels, support_vids = zip(*s)
         
-        t = list(zip(target_set, target_flow_set, target_labels, real_target_labels))
+        t = list(zip(target_set, target_flow_set, target_labels, real_target_labels, target_vids))
         random.shuffle(t)
-        target_set, target_flow_set, target_labels, real_target_labels = zip(*t)
-        support_set = torch.cat(support_set)
-        target_set = torch.cat(target_set)
+        target_set, target_flow_set, target_labels, real_target_labels, target_vids = zip(*t)
+        return self.make_task(support_set, support_flow_set, support_labels, target_set, target_flow_set, target_labels, real_target_labels, batch_classes, support_vids, target_vids)
+
+    """Collates the clips and labels of an episode into the task dict, with the ids of the videos of the clips in their split. Clips whose activations are cached (support_cached, target_cached) have no frames or flow in it. """
+    def make_task(self, support_set, support_flow_set, support_labels, target_set, target_flow_set, target_labels, real_target_labels, batch_classes, support_vids, target_vids):
+        support_cached = torch.BoolTensor([v is None or f is None for v, f in zip(support_set, support_flow_set)])
+        target_cached = torch.BoolTensor([v is None or f is None for v, f in zip(target_set, target_flow_set)])
+        support_set = self.collate_clips(support_set)
+        target_set = self.collate_clips(target_set)
         
-        support_flow_set = torch.stack(support_flow_set,dim=0)
-        target_flow_set = torch.stack(target_flow_set, dim = 0)
+        support_flow_set = self.collate_clips(support_flow_set, flow=True)
+        target_flow_set = self.collate_clips(target_flow_set, flow=True)
         support_labels = torch.FloatTensor(support_labels)
         target_labels = torch.FloatTensor(target_labels)
         real_target_labels = torch.FloatTensor(real_target_labels)
         batch_classes = torch.FloatTensor(batch_classes) 
-
-        return {"support_set":support_set, "support_flow_set": support_flow_set,"support_labels":support_labels, "target_set":target_set,   "target_flow_set": target_flow_set,"target_labels":target_labels, "real_target_labels":real_target_labels, "batch_class_list": batch_classes}
+        support_vids = torch.LongTensor(support_vids)
+        target_vids = torch.LongTensor(target_vids)
+
+        return {"support_set":support_set, "support_flow_set": support_flow_set,"support_labels":support_labels, "target_set":target_set,   "target_flow_set": target_flow_set,"target_labels":target_labels, "real_target_labels":real_target_labels, "batch_class_list": batch_classes, "support_vids": support_vids, "target_vids": target_vids,
+                "support_cached": support_cached, "target_cached": target_cached}
+
+    """Concatenates the frames, or stacks the flow, of the clips of an episode, leaving out the ones that are None (see load_uncached_seq). """
+    def collate_clips(self, clips, flow=False):
+        clips = [clip for clip in clips if clip is not None]
+        if clips:
+            return torch.stack(clips) if flow else torch.cat(clips)
+        if flow:
+            return torch.from_numpy(np.empty((0, self.seq_len - 1, 2, FLOW_CROP_SIZE, FLOW_CROP_SIZE), dtype=self.flow_dtype))
+        return torch.empty((0, 3, self.img_size, self.img_size), dtype=torch.uint8 if self.compact_transport else torch.float32)
  
 
@@ -0,0 +1,160 @@
+"""Packed per-video shard format: the JPEG frames and the flow of a video stored back to back in one file per
+N videos, so a clip is fetched with one read for the frames and one for the flow.
+
+Shard file layout:
+    [video 0: jpeg 0 | jpeg 1 | ... | flow (T x 2 x H x W)] [video 1: ...] ... [index (utf-8 json)] [trailer]
+The 16 byte trailer holds the index offset and length (little-endian uint64) and is preceded by SHARD_MAGIC, so
+an index is found by reading the end of the file. A dataset is a directory of shards plus SHARDS_FILE listing
+them and the class folders (class ids are positions in that sorted list, as in directory mode).
+"""
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+SHARD_MAGIC = b"VSHARD01"
+SHARDS_FILE = "shards.json"
+_TRAILER = struct.Struct("<8sQQ")
+
+
+class ShardVideo():
+    """ location of one video inside a shard; len() is its number of frames """
+    __slots__ = ("shard", "class_folder", "name", "frame_offsets", "flow_offset", "flow_shape", "flow_dtype")
+
+    def __init__(self, shard, class_folder, name, frame_offsets, flow_offset, flow_shape, flow_dtype):
+        self.shard = shard
+        self.class_folder = class_folder
+        self.name = name
+        self.frame_offsets = frame_offsets # n_frames + 1 byte offsets, frame i is [offsets[i], offsets[i + 1])
+        self.flow_offset = flow_offset
+        self.flow_shape = tuple(flow_shape) # (T, 2, H, W)
+        self.flow_dtype = np.dtype(flow_dtype)
+
+    def __len__(self):
+        return len(self.frame_offsets) - 1
+
+    @property
+    def flow_frames(self):
+        """ flow frames are addressed by index into the flow block """
+        return range(self.flow_shape[0])
+
+
+class ShardWriter():
+    """ appends videos to one shard file; close() writes the index """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "wb")
+        self.videos = []
+
+    def add_video(self, class_folder, name, jpegs, flow):
+        """
+        jpegs: list of encoded frames (bytes)
+        flow: array (T, 2, H, W) with the x and y flow of each frame pair
+        """
+        flow = np.ascontiguousarray(flow)
+        offsets = [self.f.tell()]
+        for jpeg in jpegs:
+            self.f.write(jpeg)
+            offsets.append(self.f.tell())
+        flow_offset = self.f.tell()
+        self.f.write(flow.tobytes())
+        self.videos.append({"class": class_folder, "name": name, "frames": offsets,
+                            "flow_offset": flow_offset, "flow_shape": list(flow.shape), "flow_dtype": flow.dtype.str})
+
+    def close(self):
+        index = json.dumps({"videos": self.videos}).encode("utf-8")
+        index_offset = self.f.tell()
+        self.f.write(index)
+        self.f.write(_TRAILER.pack(SHARD_MAGIC, index_offset, len(index)))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_shard_index(path):
+    """ list of ShardVideo stored in one shard """
+    with open(path, "rb") as f:
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        magic, index_offset, index_len = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != SHARD_MAGIC:
+            raise ValueError("{} is not a video shard".format(path))
+        f.seek(index_offset)
+        index = json.loads(f.read(index_len).decode("utf-8"))
+    return [ShardVideo(path, v["class"], v["name"], np.asarray(v["frames"], dtype=np.int64),
+                       v["flow_offset"], v["flow_shape"], v["flow_dtype"]) for v in index["videos"]]
+
+
+def write_shards_file(root, shard_names, class_folders):
+    with open(os.path.join(root, SHARDS_FILE), "w") as f:
+        json.dump({"shards": list(shard_names), "class_folders": sorted(class_folders)}, f, indent=1)
+
+
+def read_shards_file(root):
+    """ (shard paths, sorted class folders) of a shard dataset directory """
+    with open(os.path.join(root, SHARDS_FILE), "r") as f:
+        meta = json.load(f)
+    return [os.path.join(root, s) for s in meta["shards"]], meta["class_folders"]
+
+
+class ShardReader():
+    """
+    Reads clips out of shards with positional reads on file descriptors opened lazily per process (a forked
+    DataLoader worker must not share a descriptor it did not open).
+    """
+    def __init__(self):
+        self._fds = {}
+        self._pid = None
+
+    def __getstate__(self):
+        return {"_fds": {}, "_pid": None}
+
+    def _fd(self, path):
+        if self._pid != os.getpid():
+            self._fds = {}
+            self._pid = os.getpid()
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = self._fds[path] = os.open(path, os.O_RDONLY)
+        return fd
+
+    def _pread(self, path, offset, size):
+        fd = self._fd(path)
+        data = os.pread(fd, size, offset)
+        while len(data) < size: # pread may return short reads on network filesystems
+            more = os.pread(fd, size - len(data), offset + len(data))
+            if not more:
+                raise IOError("unexpected end of shard {}".format(path))
+            data += more
+        return data
+
+    def read_frames(self, video, idxs):
+        """ encoded frames idxs of a video, fetched with a single read spanning them """
+        offsets = video.frame_offsets
+        start = int(offsets[min(idxs)])
+        data = memoryview(self._pread(video.shard, start, int(offsets[max(idxs) + 1]) - start))
+        return [data[offsets[i] - start:offsets[i + 1] - start] for i in idxs]
+
+    def read_flow(self, video, idxs):
+        """
+        flow frames idxs of a video as an array (len(idxs), 2, H, W), fetched with a single read. Consecutive idxs
+        (the usual case) give a read-only view of the read buffer, others a copy.
+        """
+        frame_shape = video.flow_shape[1:]
+        frame_bytes = int(np.prod(frame_shape)) * video.flow_dtype.itemsize
+        first, last = min(idxs), max(idxs)
+        data = self._pread(video.shard, video.flow_offset + first * frame_bytes, (last - first + 1) * frame_bytes)
+        flow = np.frombuffer(data, dtype=video.flow_dtype).reshape((last - first + 1,) + frame_shape)
+        if list(idxs) == list(range(first, last + 1)):
+            return flow
+        return flow[[i - first for i in idxs]]
+
+    @staticmethod
+    def open_frame(data):
+        """ file object for an encoded frame returned by read_frames """
+        return io.BytesIO(data)
@@ -0,0 +1,73 @@
+"""Per-video arrays computed once and kept on disk: memory-mapped .npy files in a directory, one row per video id.
+
+A VideoStore holds any number of named arrays (e.g. the video-level embeddings of feature_eval.py, or the frozen
+backbone activations of activation_cache.py) plus a done flag per video, and a description (key) of what the rows
+depend on. Rows are filled incrementally and survive restarts; a store found with another key is discarded.
+Written by one process; readers see rows through the shared page cache.
+"""
+import json
+import os
+
+import numpy as np
+
+STORE_VERSION = 1
+
+
+class VideoStore():
+    """
+    directory: where the <name>.npy arrays, done.npy and store.json live
+    n_videos: rows of every array, indexed by video id
+    arrays: name -> (shape of the row of one video, dtype)
+    key: json-serialisable description of what the rows depend on
+    """
+    def __init__(self, directory, n_videos, arrays, key):
+        self.directory = directory
+        self.key = json.loads(json.dumps({"version": STORE_VERSION, "n_videos": n_videos, "key": key,
+                                          "arrays": {name: [list(shape), np.dtype(dtype).str] for name, (shape, dtype) in arrays.items()}},
+                                         sort_keys=True))
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, "store.json")
+        try:
+            with open(meta_path) as f:
+                fresh = json.load(f) != self.key
+        except (OSError, ValueError):
+            fresh = True
+        if fresh:
+            # the description is removed first and written last, so it is never found next to arrays it does not describe
+            for name in ("store.json", "done.npy"):
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+        mode = "w+" if fresh else "r+"
+        self.arrays = {}
+        for name, (shape, dtype) in arrays.items():
+            self.arrays[name] = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode=mode, dtype=dtype,
+                                                          shape=(n_videos,) + tuple(shape))
+        self.done = np.lib.format.open_memmap(os.path.join(directory, "done.npy"), mode=mode, dtype=np.bool_, shape=(n_videos,))
+        if fresh:
+            with open(meta_path, "w") as f:
+                json.dump(self.key, f, sort_keys=True)
+
+    def __len__(self):
+        return len(self.done)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def missing(self):
+        """ ids of the videos not stored yet """
+        return np.flatnonzero(~self.done)
+
+    def put(self, vid_ids, **rows):
+        for name, values in rows.items():
+            self.arrays[name][vid_ids] = values
+        self.done[vid_ids] = True
+
+    def flush(self):
+        # the rows reach the files before the flags saying they are there
+        for array in self.arrays.values():
+            array.flush()
+        self.done.flush()
+
+    def nbytes(self):
+        """ bytes of the arrays on disk """
+        return sum(array.nbytes for array in self.arrays.values())
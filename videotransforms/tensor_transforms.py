@@ -1,5 +1,9 @@
+import numbers
 import random
 
+import torch.nn.functional as NF
+
+from videotransforms.functional import get_resize_sizes
 from videotransforms.utils import functional as F
 
 
@@ -57,3 +61,107 @@ class SpatialRandomCrop(object):
         y1 = random.randint(0, tensor_h - h)
         cropped = tensor[:, :, y1:y1 + h, x1:x1 + h]
         return cropped
+
+
+class ClipResize(object):
+    """Resizes a uint8 clip tensor of shape (T, C, H, W) so that its
+    shorter side matches size, like Resize on a list of PIL images
+
+    All frames are resized in one call, with bilinear interpolation
+    (antialiased when downscaling, as PIL does). The clip must be
+    4-dimensional
+
+    Args:
+    size (int or tuple): shorter side, or (height, width)
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, clip):
+        im_h, im_w = clip.shape[-2:]
+        if isinstance(self.size, numbers.Number):
+            # Min spatial dim already matches minimal size
+            if min(im_h, im_w) == self.size:
+                return clip
+            size = list(get_resize_sizes(im_h, im_w, self.size))
+        else:
+            size = list(self.size)
+        # uint8 has a native kernel, fastest on channels-last clips
+        return NF.interpolate(clip, size=size, mode='bilinear', align_corners=False, antialias=True)
+
+
+class ClipRandomHorizontalFlip(object):
+    """Horizontally flips a clip tensor (..., H, W) with a probability 0.5
+    """
+
+    def __call__(self, clip):
+        if random.random() < 0.5:
+            return clip.flip(-1)
+        return clip
+
+
+class ClipRandomCrop(object):
+    """Crops all frames of a clip tensor (..., H, W) at the same random
+    location, drawn like RandomCrop does
+
+    Args:
+    size (sequence or int): Desired output size for the
+    crop in format (h, w)
+    """
+
+    def __init__(self, size):
+        if isinstance(size, numbers.Number):
+            size = (size, size)
+        self.size = size
+
+    def __call__(self, clip):
+        h, w = self.size
+        im_h, im_w = clip.shape[-2:]
+        if w > im_w or h > im_h:
+            error_msg = (
+                'Initial tensor spatial size should be larger then '
+                'cropped size but got cropped sizes : ({w}, {h}) while '
+                'initial tensor is ({t_w}, {t_h})'.format(
+                    t_w=im_w, t_h=im_h, w=w, h=h))
+            raise ValueError(error_msg)
+        x1 = random.randint(0, im_w - w)
+        y1 = random.randint(0, im_h - h)
+        return clip[..., y1:y1 + h, x1:x1 + w]
+
+
+class ClipCenterCrop(object):
+    """Crops the centre of all frames of a clip tensor (..., H, W)
+
+    Args:
+    size (sequence or int): Desired output size for the
+    crop in format (h, w)
+    """
+
+    def __init__(self, size):
+        if isinstance(size, numbers.Number):
+            size = (size, size)
+        self.size = size
+
+    def __call__(self, clip):
+        h, w = self.size
+        im_h, im_w = clip.shape[-2:]
+        if w > im_w or h > im_h:
+            error_msg = (
+                'Initial tensor spatial size should be larger then '
+                'cropped size but got cropped sizes : ({w}, {h}) while '
+                'initial tensor is ({t_w}, {t_h})'.format(
+                    t_w=im_w, t_h=im_h, w=w, h=h))
+            raise ValueError(error_msg)
+        x1 = int(round((im_w - w) / 2.))
+        y1 = int(round((im_h - h) / 2.))
+        return clip[..., y1:y1 + h, x1:x1 + w]
+
+
+class ClipToFloat(object):
+    """Converts a uint8 clip tensor in the range [0, 255] to a contiguous
+    float tensor in the range [0, 1.0], as ToTensor does per frame
+    """
+
+    def __call__(self, clip):
+        return clip.contiguous().float().div_(255)